@@ -1,38 +1,40 @@
 #!/usr/bin/env python3
 import argparse
 import csv
-import hashlib
+import datetime
+import itertools
 import json
 import locale
+import multiprocessing
 import os
+import queue
 import re
-import sqlite3
+import shlex
 import subprocess
 import sys
 import textwrap
+import time
 import tkinter as tk
 import tkinter.font as tkFont
 import warnings
-import unicodedata
 from tkinter import Tk, filedialog, scrolledtext, Button, StringVar, OptionMenu, ttk, font, simpledialog
 # from pathlib import Path
 
+from mybible import (
+    BOOKMAPPING_FILE, DEFAULT_FORMAT_STRING, KWIC_WIDTH, NON_BIBLE_MODULE_MARKERS, TEXT_VARIANTS, InvalidCursorError,
+    InvalidReferenceError, ModuleRegistry, ModuleWatcher, build_scan_pattern, clean_reference, collect_strong_numbers,
+    compile_mapping, concordance, custom_json_dump, diff_verse_hashes, ensure_book_mapping_exists, find_ambiguous_book_names,
+    find_corrected_book_names, find_sqlite_files, format_canonical_range, format_lexicon_entry,
+    format_readable_range, get_default_config_path, get_info, get_module_fingerprint, get_module_name,
+    iter_json_document, iter_json_lines, load_mapping, lookup_strong_numbers, make_http_server, normalize_keyword,
+    plan_readings_to_ranges, reset_to_normal, scan_references, split_modules_path, start_bold, start_italics,
+    verse_record, warm_module_caches, whole_module_range, write_file_atomic
+)
+
 os.environ['PYTHONIOENCODING'] = 'utf-8'
 sys.stdout.reconfigure(encoding='utf-8')
 
-# Config location (APP_NAME) is a folder name under ~/.config
-APP_NAME = 'mybible-cli'
-
 warnings.filterwarnings("ignore", category=DeprecationWarning)
-def get_default_config_path():
-    if os.name == 'nt':
-        return os.path.join(os.getenv('APPDATA'), APP_NAME)
-    elif os.name == 'posix':
-        if 'darwin' in os.sys.platform:
-            return os.path.join(os.path.expanduser('~'), 'Library', 'Application Support', APP_NAME)
-        else:
-            return os.path.join(os.path.expanduser('~'), '.config', APP_NAME)
-
 # Get system locale to get the language, set language to 'en' if not set
 language_country = locale.getdefaultlocale()[0]
 if not language_country:
@@ -79,7 +81,6 @@ def read_properties(properties_file):
     return properties
 
 CONFIG_FILE = os.path.join(get_default_config_path(), 'config.json')
-BOOKMAPPING_FILE = os.path.join(get_default_config_path(), 'mapping.json')
 INSTALLED_MODULES_FILE = os.path.join(get_default_config_path(), 'installed_modules.json')
 L10N_FILE = os.path.join(get_default_config_path(), 'l10n', f'{language}.properties',)
 
@@ -89,9 +90,28 @@ default_l10n_strings = {
     'empty_path': '\nNo MyBible modules found found in {modules_path}',
     'in_path': '\nFull path to the folder with MyBible modules:\n',
     'no_module': '\nNo module named \'{module_name}\' found in \'{modules_path}\'',
+    'no_xref_module': 'No cross-references module named \'{module_name}\' found in \'{modules_path}\'',
+    'no_dictionary_module': 'No dictionary module named \'{module_name}\' found in \'{modules_path}\'',
+    'no_plan_module': 'No reading plan module named \'{module_name}\' found in \'{modules_path}\'',
     'exit_now': '\nExiting now...',
     'available_modules': '\nAvailable MyBible modules: {number}',
+    'available_xref_modules': 'Cross-references modules: {modules}',
+    'available_dictionary_modules': 'Dictionary modules: {modules}',
+    'available_plan_modules': 'Reading plans: {modules}',
+    'plan_day': 'Day {day}: {reference}',
+    'plan_day_evening': 'Day {day}, evening: {reference}',
+    'invalid_plan_day': 'There is no day {day} in the reading plan \'{plan}\' of {length} days',
+    'invalid_date': 'Invalid date \'{date}\', expected YYYY-MM-DD',
     'invalid_reference': '\nInvalid reference for this module',
+    'too_many_verses': '{count} verses requested, the limit is {limit}',
+    'next_page': 'Verses shown: {shown} of {total}. To continue, add --cursor {cursor}',
+    'invalid_cursor': 'This cursor doesn\'t belong to the reference',
+    'unknown_text_variants': 'Unknown text variants: {variants}. Use text, raw or zapped',
+    'diff_summary': '{module_a} → {module_b}: {changed} changed, {added} added, {removed} removed',
+    'build_cache_progress': '[{done}/{total}] {module_name}: {caches} ({seconds:.2f} s)',
+    'build_cache_up_to_date': 'up to date',
+    'build_cache_failed': '[{done}/{total}] {module_name}: failed: {error}',
+    'build_cache_summary': 'Built {caches} cache files for {built} of {total} modules in {seconds:.2f} s',
     'no_verse_ouput': '\nCannon output {reference}:',
     'error': 'Error!',
     'folder_fail': 'Failed to open the folder: {error}',
@@ -99,14 +119,15 @@ default_l10n_strings = {
     'file_created': 'File created: {file}',
     'help_description': 'Command line tool to query MyBible modules.',
     'help_epilog': 'Parameter containing several tokens should be quoted: {bold}mybible-cli -b \"NIV\'11\" -r \"1 Pet 1:1\"{normal}',
-    'help_path': 'path to the folder with MyBible module',
+    'help_path': 'path to the folder with MyBible module (separate several folders with \'{separator}\')',
     'help_list': 'lists available MyBilbe modules',
     'help_simplelist': 'lists available MyBible modules in a simple format',
     'help_modulename': 'name of the MyBible module to use',
     'help_reference': 'Bible reference to output',
     'help_abbr': 'reads Bible book names and abbreviations from a non-default file. With {bold}{italics}--abbr uk{normal} a file named {bold}{italics}uk_mapping.json{normal} located in the configuration folder will be used',
     'help_selfabbr': 'reads Bible book names and abbreviations from the module itself',
-    'help_format': 'formats output with %%-prefixed format string. Available placeholders: f, a, c, v, t, T, z, A, Z, m',
+    'help_allabbr': 'reads Bible book names and abbreviations from all installed modules and mapping files, so a reference can use a book name in any of their languages',
+    'help_format': 'formats output with %%-prefixed format string. Available placeholders: f, a, c, v, t, T, z, A, Z, m, h',
     'help_saveformat': 'specified format string will be applied and saved as default',
     'help_helpformat': 'detailed info on the format string',
     'help_noansi': 'clears out any ANSI escape sequences in the Bible verses output (if %%A or %%Z were used)',
@@ -116,6 +137,35 @@ default_l10n_strings = {
     'help_checktsv': 'reports duplicates in the specified tsv file',
     'help_t2j': 'converts a tsv file to json (to use as a mapping file)',
     'help_gui': 'outputs text in a GUI window',
+    'help_scan': 'finds Bible references in the given text files (or standard input) and prints their offsets and ranges',
+    'help_scan_text': 'prints the text of each reference found with --scan',
+    'help_http': 'serves /modules, /resolve, /verses and /stats over HTTP on the given host and port',
+    'help_memory_budget': 'with --http, keeps the most used Bible modules in memory, up to the given number of megabytes; /stats shows what is loaded',
+    'help_xref': 'prints cross-references from every verse of the reference, taken from the given cross-references module',
+    'help_xref_text': 'prints the text of each cross-reference found with --xref',
+    'help_lexicon': 'adds glosses for the Strong\'s numbers of the verses as footnotes, taken from dictionary modules; several modules are separated with commas',
+    'help_plan': 'prints the readings of a day from a reading plan module; the day is given with --day or --date',
+    'help_day': 'day of the reading plan, starting from 1',
+    'help_date': 'date to find the day of the reading plan for, counting from January 1 (YYYY-MM-DD, today if omitted)',
+    'help_export': 'with --plan, prints the readings of every day of the plan',
+    'help_diff': 'lists verses that were changed, added or removed in MODULE_B compared to MODULE_A',
+    'help_build_cache': 'builds the cache files of all modules or of the given ones in parallel: versification, book names, verse hashes, verse indexes of modules without one, cross-reference and reading plan indexes, the catalog and the merged book name index. Up-to-date files are skipped',
+    'help_max_verses': 'refuses to print a reference that spans more than the given number of verses',
+    'help_count': 'prints the number of verses in the reference instead of the text',
+    'help_merge': 'prints each verse once, merging overlapping and adjacent parts of the reference; \'canonical\' (default) sorts them in Bible order, \'request\' keeps the order they were given in',
+    'help_output': 'prints the verses as formatted text (default), as one JSON document, or as JSON Lines with one verse per line',
+    'help_text_variants': 'comma-separated text variants of each verse in JSON output: text (as %t), raw (as %T), zapped (as %z)',
+    'help_pager': 'shows the text in a pager ($PAGER or less) that starts before the whole reference is read',
+    'help_limit': 'prints at most the given number of verses of the reference',
+    'not_positive_number': '{value} is not a positive whole number',
+    'invalid_host_port': '{value} is not HOST:PORT with a port number from 0 to 65535',
+    'help_offset': 'skips the given number of verses from the start of the reference',
+    'help_cursor': 'continues after the last verse of the previous page',
+    'help_concordance': 'counts the words of the text of the reference (or of the whole module without -r): all together, by book or by chapter',
+    'help_top': 'with --concordance, shows only the N most frequent words (of each book or chapter)',
+    'help_kwic': 'shows each occurrence of the words (separated by commas) with the text around it',
+    'concordance_summary': '{words} words, {distinct} shown',
+    'invalid_keyword': 'not single words: {words} (a word is made of letters, with apostrophes inside)',
     'help_helpformat_message': '''\nAvailable placeholders for the format string:\n\
     \t  %f \t full book name\n\
     \t  %a \t abbreviated book name\n\
@@ -128,11 +178,12 @@ default_l10n_strings = {
     \t  %A \t text of the verse with color output for console; Strong\' numbers are included\n\
     \t  %Z \t the same as above, but without Strong\'s numbers\n\
     \t  %m \t module name\n\
+    \t  %h \t headings before the verse, each followed by a line break; empty for most verses\n\
 Current default format is {bold}{format_string}{normal}\n\
 To save a new default, provide the format with {bold}-F{normal}\n\
 Format string may contain {bold}\\t{normal} and {bold}\\n{normal}\n\
 Each verse in the output is printed on a new line and is formatted individually''',
-        'parser_error': 'Run with the arguments -b/--module_name and -r/--reference, or use one of the following: -L/--list-modules, --simple-list, --helpformat, --open-config-folder, --open-module-folder, --j2t/--json-to-tsv, --check-tsv, --t2j/--tsv-to-json',
+        'parser_error': 'Run with the arguments -b/--module_name and -r/--reference, or use one of the following: -L/--list-modules, --simple-list, --helpformat, --open-config-folder, --open-module-folder, --j2t/--json-to-tsv, --check-tsv, --t2j/--tsv-to-json, --scan, --http, --diff, --plan, --concordance',
     'file_exists_prompt': 'The file \'{file}\' already exists. Do you want to overwrite it? (yes/no): ',
     'yes_no_prompt': 'Please enter \'yes\' or \'no\'',
     'repeated_in_line': 'Repetitions in row {row}: {repeated_string}',
@@ -141,6 +192,10 @@ Each verse in the output is printed on a new line and is formatted individually'
     'gui_copy': 'Copy displayed text',
     'gui_format_verses': 'Format verses',
     'gui_save': 'Save',
+    'http_serving': 'Serving Bible text at {url} (press Ctrl+C to stop)',
+    'module_collision': 'Module \'{module_name}\' is found in several folders, using {module_path} (also in {other_paths})',
+    'ambiguous_book_name': 'Book name \'{name}\' is used for several books ({books}), {book} is taken',
+    'corrected_book_name': 'Book name \'{name}\' is taken as \'{alias}\' ({book})',
 }
 
 # Load l10n data or use defaults
@@ -149,10 +204,29 @@ invalid_path = l10n_strings.get('invalid_path', default_l10n_strings['invalid_pa
 empty_path = l10n_strings.get('empty_path', default_l10n_strings['empty_path'])
 in_path = l10n_strings.get('in_path', default_l10n_strings['in_path'])
 no_module = l10n_strings.get('no_module', default_l10n_strings['no_module'])
+no_xref_module = l10n_strings.get('no_xref_module', default_l10n_strings['no_xref_module'])
+no_dictionary_module = l10n_strings.get('no_dictionary_module', default_l10n_strings['no_dictionary_module'])
+no_plan_module = l10n_strings.get('no_plan_module', default_l10n_strings['no_plan_module'])
 exit_now = l10n_strings.get('exit_now', default_l10n_strings['exit_now'])
 invalid_reference = l10n_strings.get('invalid_reference', default_l10n_strings['invalid_reference'])
+too_many_verses = l10n_strings.get('too_many_verses', default_l10n_strings['too_many_verses'])
+next_page = l10n_strings.get('next_page', default_l10n_strings['next_page'])
+invalid_cursor = l10n_strings.get('invalid_cursor', default_l10n_strings['invalid_cursor'])
+unknown_text_variants = l10n_strings.get('unknown_text_variants', default_l10n_strings['unknown_text_variants'])
+diff_summary = l10n_strings.get('diff_summary', default_l10n_strings['diff_summary'])
+build_cache_progress = l10n_strings.get('build_cache_progress', default_l10n_strings['build_cache_progress'])
+build_cache_up_to_date = l10n_strings.get('build_cache_up_to_date', default_l10n_strings['build_cache_up_to_date'])
+build_cache_failed = l10n_strings.get('build_cache_failed', default_l10n_strings['build_cache_failed'])
+build_cache_summary = l10n_strings.get('build_cache_summary', default_l10n_strings['build_cache_summary'])
 no_verse_ouput = l10n_strings.get('no_verse_ouput', default_l10n_strings['no_verse_ouput'])
 available_modules = l10n_strings.get('available_modules', default_l10n_strings['available_modules'])
+available_xref_modules = l10n_strings.get('available_xref_modules', default_l10n_strings['available_xref_modules'])
+available_dictionary_modules = l10n_strings.get('available_dictionary_modules', default_l10n_strings['available_dictionary_modules'])
+available_plan_modules = l10n_strings.get('available_plan_modules', default_l10n_strings['available_plan_modules'])
+plan_day = l10n_strings.get('plan_day', default_l10n_strings['plan_day'])
+plan_day_evening = l10n_strings.get('plan_day_evening', default_l10n_strings['plan_day_evening'])
+invalid_plan_day = l10n_strings.get('invalid_plan_day', default_l10n_strings['invalid_plan_day'])
+invalid_date = l10n_strings.get('invalid_date', default_l10n_strings['invalid_date'])
 error = l10n_strings.get('error', default_l10n_strings['error'])
 folder_fail = l10n_strings.get('folder_fail', default_l10n_strings['folder_fail'])
 file_fail = l10n_strings.get('file_fail', default_l10n_strings['file_fail'])
@@ -166,6 +240,7 @@ help_modulename = l10n_strings.get('help_modulename', default_l10n_strings['help
 help_reference = l10n_strings.get('help_reference', default_l10n_strings['help_reference'])
 help_abbr = l10n_strings.get('help_abbr', default_l10n_strings['help_abbr'])
 help_selfabbr = l10n_strings.get('help_selfabbr', default_l10n_strings['help_selfabbr'])
+help_allabbr = l10n_strings.get('help_allabbr', default_l10n_strings['help_allabbr'])
 help_format = l10n_strings.get('help_format', default_l10n_strings['help_format'])
 help_saveformat = l10n_strings.get('help_saveformat', default_l10n_strings['help_saveformat'])
 help_helpformat = l10n_strings.get('help_helpformat', default_l10n_strings['help_helpformat'])
@@ -176,6 +251,35 @@ help_j2t = l10n_strings.get('help_j2t', default_l10n_strings['help_j2t'])
 help_checktsv = l10n_strings.get('help_checktsv', default_l10n_strings['help_checktsv'])
 help_t2j = l10n_strings.get('help_t2j', default_l10n_strings['help_t2j'])
 help_gui = l10n_strings.get('help_gui', default_l10n_strings['help_gui'])
+help_scan = l10n_strings.get('help_scan', default_l10n_strings['help_scan'])
+help_scan_text = l10n_strings.get('help_scan_text', default_l10n_strings['help_scan_text'])
+help_http = l10n_strings.get('help_http', default_l10n_strings['help_http'])
+help_memory_budget = l10n_strings.get('help_memory_budget', default_l10n_strings['help_memory_budget'])
+help_xref = l10n_strings.get('help_xref', default_l10n_strings['help_xref'])
+help_xref_text = l10n_strings.get('help_xref_text', default_l10n_strings['help_xref_text'])
+help_lexicon = l10n_strings.get('help_lexicon', default_l10n_strings['help_lexicon'])
+help_plan = l10n_strings.get('help_plan', default_l10n_strings['help_plan'])
+help_day = l10n_strings.get('help_day', default_l10n_strings['help_day'])
+help_date = l10n_strings.get('help_date', default_l10n_strings['help_date'])
+help_export = l10n_strings.get('help_export', default_l10n_strings['help_export'])
+help_diff = l10n_strings.get('help_diff', default_l10n_strings['help_diff'])
+help_build_cache = l10n_strings.get('help_build_cache', default_l10n_strings['help_build_cache'])
+help_max_verses = l10n_strings.get('help_max_verses', default_l10n_strings['help_max_verses'])
+help_count = l10n_strings.get('help_count', default_l10n_strings['help_count'])
+help_merge = l10n_strings.get('help_merge', default_l10n_strings['help_merge'])
+help_output = l10n_strings.get('help_output', default_l10n_strings['help_output'])
+help_text_variants = l10n_strings.get('help_text_variants', default_l10n_strings['help_text_variants'])
+help_pager = l10n_strings.get('help_pager', default_l10n_strings['help_pager'])
+help_limit = l10n_strings.get('help_limit', default_l10n_strings['help_limit'])
+not_positive_number = l10n_strings.get('not_positive_number', default_l10n_strings['not_positive_number'])
+invalid_host_port = l10n_strings.get('invalid_host_port', default_l10n_strings['invalid_host_port'])
+help_offset = l10n_strings.get('help_offset', default_l10n_strings['help_offset'])
+help_cursor = l10n_strings.get('help_cursor', default_l10n_strings['help_cursor'])
+help_concordance = l10n_strings.get('help_concordance', default_l10n_strings['help_concordance'])
+help_top = l10n_strings.get('help_top', default_l10n_strings['help_top'])
+help_kwic = l10n_strings.get('help_kwic', default_l10n_strings['help_kwic'])
+concordance_summary = l10n_strings.get('concordance_summary', default_l10n_strings['concordance_summary'])
+invalid_keyword = l10n_strings.get('invalid_keyword', default_l10n_strings['invalid_keyword'])
 help_helpformat_message = l10n_strings.get('help_helpformat_message', default_l10n_strings['help_helpformat_message'])
 parser_error = l10n_strings.get('parser_error', default_l10n_strings['parser_error'])
 file_exists_prompt = l10n_strings.get('file_exists_prompt', default_l10n_strings['file_exists_prompt'])
@@ -186,139 +290,10 @@ gui_title = l10n_strings.get('gui_title', default_l10n_strings['gui_title'])
 gui_copy = l10n_strings.get('gui_copy', default_l10n_strings['gui_copy'])
 gui_format_verses = l10n_strings.get('gui_format_verses', default_l10n_strings['gui_format_verses'])
 gui_save = l10n_strings.get('gui_save', default_l10n_strings['gui_save'])
-
-# Default book mapping content
-DEFAULT_BOOK_MAPPING = \
-{
-    "10": ["Genesis", "1 Moses", "I Moses", "Gen", "Ge", "Gn", "1M"],
-    "20": ["Exodus", "2 Moses", "II Moses", "Exo", "Exod", "Ex", "2M"],
-    "30": ["Leviticus", "3 Moses", "III Moses", "Lev", "Lv", "Le", "3M"],
-    "40": ["Numbers", "4 Moses", "IV Moses", "Num", "Nu", "Nm", "Nb", "4M"],
-    "50": ["Deuteronomy", "5 Moses", "V Moses", "Deu", "Deut", "Dt", "5M"],
-    "60": ["Joshua", "Jos", "Josh", "Jsh"],
-    "70": ["Judges", "Jdg", "Judg", "Jdgs"],
-    "80": ["Ruth", "Rut", "Ru", "Rth"],
-    "90": ["1 Samuel", "I Samuel", "1Sa", "1Sam", "1 Sm", "I Sam", "I Sm"],
-    "100": ["2 Samuel", "II Samuel", "2Sa", "2Sam", "2 Sm", "II Sam", "II Sm"],
-    "110": ["1 Kings", "I Kings", "1Ki", "1Kgs", "1Kin", "I Ki", "I Kgs", "I Kin"],
-    "120": ["2 Kings", "II Kings", "2Ki", "2Kgs", "2Kin", "II Ki", "II Kgs", "II Kin"],
-    "130": ["1 Chronicles", "I Chronicles", "1Ch", "1Chr", "1 Ch", "1 Chron", "I Ch", "I Chr", "I Chron"],
-    "140": ["2 Chronicles", "II Chronicles", "2Ch", "2Chr", "2 Ch", "2 Chron", "II Ch", "II Chr", "II Chron"],
-    "150": ["Ezra", "Ezr", "Ez"],
-    "160": ["Nehemiah", "Neh", "Ne"],
-    "165": ["1 Esdras", "I Esdras", "1Es", "1Esd", "I Es", "I Esd"],
-    "166": ["2 Esdras", "II Esdras", "2Es", "2Esd", "II Es", "II Esd"],
-    "170": ["Tobit", "Tob"],
-    "180": ["Judith", "Jdt", "Jdth"],
-    "190": ["Esther", "Est", "Esth", "Es"],
-    "192": ["Greek Esther", "Additions to Esther", "Esg", "AddEsth", "EstGr", "GrEsth"],
-    "220": ["Job", "Jb"],
-    "230": ["Psalms", "Psalm", "Psa", "Ps", "Pslm"],
-    "232": ["Psalm 151", "Ps2", "Ps151"],
-    "235": ["Psalms of Solomon", "PSS"],
-    "240": ["Proverbs", "Pro", "Prov", "Prv", "Pr"],
-    "245": ["Odae", "Odas", "Oda"],
-    "250": ["Ecclesiastes", "Qoholeth", "Ecc", "Eccl", "Qoh", "Eccles"],
-    "260": ["Song of Songs", "Song of Solomon", "Canticles of Canticles", "Sng", "Song", "Sg", "SOS", "Cant", "COC"],
-    "270": ["Wisdom of Solomon", "Wis", "Wisd"],
-    "280": ["Sirach", "Ecclesiasticus", "Sir", "Ecclus"],
-    "290": ["Isaiah", "Isa", "Is"],
-    "300": ["Jeremiah", "Jer", "Je", "Jr", "Jrm"],
-    "305": ["Prayer of Azariah", "Azariah", "Aza", "PrAzar", "PrAz", "Azar"],
-    "310": ["Lamentations", "Lam", "La", "Lament"],
-    "315": ["Letter of Jeremiah", "Epistle of Jeremiah", "Lje", "EpJer", "LetJer", "LJ"],
-    "320": ["Baruch", "1 Baruch", "I Baruch", "Bar", "Br"],
-    "321": ["2 Baruch", "2Ba"],
-    "322": ["3 Baruch", "3Ba"],
-    "323": ["Song of the 3 Young Men", "Song of the Three Young Men", "S3Y", "SgThree", "Sg3"],
-    "325": ["Susanna", "Sus"],
-    "330": ["Ezekiel", "Ezk", "Ezek", "Eze"],
-    "340": ["Daniel", "Dan", "Da", "Dn"],
-    "345": ["Bel and the Dragon", "Bel"],
-    "350": ["Hosea", "Hos", "Ho"],
-    "360": ["Joel", "Jol", "Jl"],
-    "370": ["Amos", "Amo", "Am"],
-    "380": ["Obadiah", "Oba", "Obad", "Ob"],
-    "390": ["Jonah", "Jon", "Jona"],
-    "400": ["Micah", "Mic", "Mi", "Mc"],
-    "410": ["Nahum", "Nam", "Nah", "Na"],
-    "420": ["Habakkuk", "Hab", "Hb"],
-    "430": ["Zephaniah", "Zep", "Zp"],
-    "440": ["Haggai", "Hag", "Hg"],
-    "450": ["Zechariah", "Zec", "Zech", "Zch"],
-    "460": ["Malachi", "Mal", "Ml"],
-    "462": ["1 Maccabees", "1Ma", "1Macc", "1Mac", "I Mac", "I Macc"],
-    "464": ["2 Maccabees", "2Ma", "2Macc", "2Mac", "II Mac", "II Macc"],
-    "466": ["3 Maccabees", "3Ma", "3Macc", "3Mac", "III Mac", "III Macc"],
-    "467": ["4 Maccabees", "4Ma", "4Macc", "4Mac", "IV Mac", "IV Macc"],
-    "468": ["2 Esdras", "2Es", "2Esd", "II Es", "II Esd"],
-    "470": ["Matthew", "Mat", "Matt", "Mt"],
-    "480": ["Mark", "Mrk", "Mar", "Mk"],
-    "490": ["Luke", "Luk", "Lk", "Lu"],
-    "500": ["John", "Jhn", "Jn"],
-    "510": ["Acts", "Act", "Ac"],
-    "511": ["Didache", "Did"],
-    "520": ["Romans", "Rom", "Ro", "Rm"],
-    "530": ["1 Corinthians", "I Corinthians", "1Co", "1Cor", "I Co", "I Cor"],
-    "540": ["2 Corinthians", "II Corinthians", "2Co", "2Cor", "II Co", "II Cor"],
-    "550": ["Galatians", "Gal", "Ga"],
-    "560": ["Ephesians", "Eph"],
-    "570": ["Philippians", "Php", "Phil", "Phlp"],
-    "580": ["Colossians", "Col"],
-    "590": ["1 Thessalonians", "I Thessalonians", "1Th", "1Thess", "1Ths", "1 Thes", "I Th", "I Thess", "I Ths", "I Thes"],
-    "600": ["2 Thessalonians", "II Thessalonians", "2Th", "2Thess", "2Ths", "2 Thes", "II Th", "II Thess", "II Ths", "II Thes"],
-    "610": ["1 Timothy", "I Timothy", "1Ti", "1Tim", "I Ti", "I Tim"],
-    "620": ["2 Timothy", "II Timothy", "2Ti", "2Tim", "II Ti", "II Tim"],
-    "630": ["Titus", "Tit", "Tt"],
-    "640": ["Philemon", "Phm", "Phlm"],
-    "650": ["Hebrews", "Heb", "He"],
-    "660": ["James", "Jas", "Jam", "Jms", "Ja"],
-    "670": ["1 Peter", "I Peter", "1Pe", "1Pet", "1 Pt", "I Pe", "I Pet", "I Pt"],
-    "680": ["2 Peter", "II Peter", "2Pe", "2Pet", "2 Pt", "II Pe", "II Pet", "II Pt"],
-    "690": ["1 John", "I John", "1Jn", "I Jn"],
-    "700": ["2 John", "II John", "2Jn", "II Jn"],
-    "710": ["3 John", "III John", "3Jn", "III Jn"],
-    "720": ["Jude", "Jud", "Jd"],
-    "730": ["Revelation", "Apocalypse", "Rev", "Re", "Revel", "Apoc"],
-    "780": ["Letter to the Laodiceans", "Laodiceans", "Lao"],
-    "790": ["Prayer of Manasseh", "Man", "PrMan"]
-}
-
-# Format json data so that each key with its values are on the same separate line
-def custom_json_dump(data):
-    # Create a custom JSON string with each list of values on the same line as its key
-    json_parts = []
-    for key, value_list in data.items():
-        values = ', '.join(json.dumps(v, ensure_ascii=False) for v in value_list)
-        json_parts.append(f'  "{key}": [{values}]')
-    return '{\n' + ',\n'.join(json_parts) + '\n}'
-
-# Variables for prettier text in the console output
-start_bold = "\033[1m"
-start_lightgrey = "\033[0;37m"
-start_lightblue = "\033[94m"
-start_red = "\033[0;31m"
-start_italics = "\033[3m"
-reset_to_normal = "\033[0m"
-
-def ensure_book_mapping_exists(json_file):
-    """Check if the JSON file exists, and if not, write the default content to it."""
-    if not os.path.exists(json_file):
-        with open(json_file, 'w', encoding='utf-8') as file:
-            json_data = custom_json_dump(DEFAULT_BOOK_MAPPING)
-            file.write(json_data)
-
-def load_mapping(json_file):
-    """Load the book mapping from a JSON file."""
-    with open(json_file, 'r', encoding='utf-8') as file:
-        # return json.load(file)
-        mapping = json.load(file)
-
-        normalized_mapping = {}
-        for book_number, names in mapping.items():
-            normalized_mapping[book_number] = [normalize_book_name(name).lower() for name in names]
-
-        return normalized_mapping
+http_serving = l10n_strings.get('http_serving', default_l10n_strings['http_serving'])
+module_collision = l10n_strings.get('module_collision', default_l10n_strings['module_collision'])
+ambiguous_book_name = l10n_strings.get('ambiguous_book_name', default_l10n_strings['ambiguous_book_name'])
+corrected_book_name = l10n_strings.get('corrected_book_name', default_l10n_strings['corrected_book_name'])
 
 # Read config
 def read_config():
@@ -339,14 +314,15 @@ def read_config():
 # Write config
 def write_config(config):
     config_path = get_default_config_path()
-    if not os.path.exists(config_path):
-        os.makedirs(config_path)
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as file:
-        json.dump(config, file, ensure_ascii=False, indent=2)
+    os.makedirs(config_path, exist_ok=True)
+    # Several instances may run at once; a reader must never see a half-written config
+    write_file_atomic(CONFIG_FILE, json.dumps(config, ensure_ascii=False, indent=2))
 
-# Check if folder with modules exists and if it contains sqlite3 files
+# Check if folders with modules exist and if any of them contains sqlite3 files
 def validate_path(path):
-    return os.path.isdir(path) and any(fname.lower().endswith('.sqlite3') for fname in os.listdir(path))
+    folders = split_modules_path(path)
+    return (bool(folders) and all(os.path.isdir(folder) for folder in folders)
+            and any(find_sqlite_files(folder) for folder in folders))
 
 def select_modules_directory():
     """Opens a directory chooser dialog and returns the selected directory."""
@@ -357,23 +333,9 @@ def select_modules_directory():
         selected_dir = "! User-canceled !"
     return selected_dir
 
-# Get only sqlite3 files in the specified directory
-def find_sqlite_files(path):
-    return [f for f in os.listdir(path) if f.lower().endswith('.sqlite3')]
-
-def get_file_hash(file_path):
-    """Generate a hash for the file content."""
-    hasher = hashlib.sha256()
-    with open(file_path, 'rb') as file:
-        buffer = file.read()
-        hasher.update(buffer)
-    return hasher.hexdigest()
-
 def update_installed_modules_file(files_info):
     """Update the installed_modules.json file with the current file info."""
-    with open(INSTALLED_MODULES_FILE, 'w', encoding='utf-8') as file:
-        json_data = custom_json_dump(files_info)
-        file.write(json_data)
+    write_file_atomic(INSTALLED_MODULES_FILE, custom_json_dump(files_info))
 
 def load_installed_modules_file():
     """Load the installed_modules.json file, if it exists."""
@@ -382,89 +344,66 @@ def load_installed_modules_file():
             return json.load(file)
     return None
 
-# Print all bible modules when -L or --list_modules is used
-def list_sqlite_files(path, view):
+def update_catalog(module_paths, infos=None):
+    """Return catalog entries of the Bible modules ({name: path}), saving installed_modules.json if it has changed.
+
+    Catalog entries are [language, name, description, fingerprint]; only new or replaced
+    modules are read again, unless their info is given in infos ({path: {'language': ..., 'description': ...}})."""
     # Load installed modules info if available
     installed_modules = load_installed_modules_file()
+    infos = infos or {}
+    files_info = {}
+    catalog_changed = not installed_modules or set(module_paths) != set(installed_modules.keys())
+    for file, module_path in module_paths.items():
+        fingerprint = get_module_fingerprint(module_path)
+        entry = installed_modules.get(file) if installed_modules else None
+        if entry and entry[3:] == [fingerprint]:
+            files_info[file] = entry
+            continue
+        info = infos.get(module_path) or {field_name: get_info(module_path, field_name) for field_name in ('language', 'description')}
+        files_info[file] = [info['language'] or "N/A", file, info['description'] or "N/A", fingerprint]
+        catalog_changed = True
+
+    # Save new info to installed_modules.json
+    if catalog_changed:
+        update_installed_modules_file(files_info)
+    return files_info
 
-    # Get current files
-    files = find_sqlite_files(path)
-
-    # Remove non-bible modules from the list
-    files = [file for file in files if not any(sub in file for sub in ['crossreferences',
-                                                                       'dictionary',
-                                                                       'subheadings',
-                                                                       'commentaries',
-                                                                       'subheadings',
-                                                                       'plan',
-                                                                       'devotions',
-                                                                       'dictionaries_lookup',
-                                                                       'ReferenceData',
-                                                                       ])]
+# Print all bible modules when -L or --list_modules is used
+def list_sqlite_files(path, view):
+    # Get current Bible modules from all module folders
+    registry = ModuleRegistry(path)
+    module_paths = {name: registry.find(name) for name in registry.names()}
+    files = list(module_paths)
+    for module_name, paths in registry.collisions.items():
+        print(module_collision.format(module_name=module_name, module_path=paths[0], other_paths=', '.join(paths[1:])), file=sys.stderr)
 
     # Output with an extra line break and the number of installed modules
     def output_table(data, headers, files):
         print(available_modules.format(number = len(files)), "\n")
         print_table(data, headers)
-
-    # Create a list of file names for comparison
-    file_names = [os.path.basename(file) for file in files]
-
-    # Check if installed_modules.json exists and contains the same files
-    if installed_modules and set(file_names) == set(installed_modules.keys()):
-        data = [installed_modules[file] for file in file_names]
-        headers = ["Language", "Module", "Description"]
-        data = sorted(data, key=lambda x: x[0])
-        if view == 'fancy':
-            output_table(data, headers, files)
-        else:
-            simplelist = []
-            for bookinfo in data:
-                simplelist.append('\t'.join([element.replace('\n', ' ') for element in bookinfo]))
-            return '\n'.join(simplelist)
+        xref_names = registry.names('crossreferences')
+        if xref_names:
+            print(available_xref_modules.format(modules=', '.join(xref_names)))
+        dictionary_names = registry.names('dictionary')
+        if dictionary_names:
+            print(available_dictionary_modules.format(modules=', '.join(dictionary_names)))
+        plan_names = registry.names('plan')
+        if plan_names:
+            print(available_plan_modules.format(modules=', '.join(plan_names)))
+
+    headers = ["Language", "Module", "Description"]
+    files_info = update_catalog(module_paths)
+
+    # Print the collected data
+    data = sorted((module_info[:3] for module_info in files_info.values()), key=lambda x: x[0])
+    if view == 'fancy':
+        output_table(data, headers, files)
     else:
-        # Collect new info from each module
-        data = []
-        headers = ["Language", "Module", "Description"]
-        files_info = {}
-        for file in files:
-            module_path = os.path.join(path, file)
-            name = os.path.splitext(os.path.basename(file))[0]
-            description = get_info(module_path, 'description') if get_info(module_path, 'description') else "N/A"
-            language = get_info(module_path, 'language') if get_info(module_path, 'language') else "N/A"
-            module_info = [language, name, description]
-            data.append(module_info)
-            files_info[file] = module_info
-
-        # Save new info to installed_modules.json
-        update_installed_modules_file(files_info)
-
-        # Print the collected data
-        data = sorted(data, key=lambda x: x[0])
-        if view == 'fancy':
-            output_table(data, headers, files)
-        else:
-            simplelist = []
-            for bookinfo in data:
-                simplelist.append('\t'.join([element.replace('\n', ' ') for element in bookinfo]))
-            return '\n'.join(simplelist)
-
-# Get info (language and description) from the specified module
-def get_info(module, field_name):
-    # Connect to the SQLite database
-    conn = sqlite3.connect(module)
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT value FROM info WHERE name=?", (field_name,))
-        value = cur.fetchone()
-        if value:  # Check if a result was found
-            return value[0]  # fetchone() returns a tuple, so get the first element
-        else:
-            return None  # No result found
-    except sqlite3.OperationalError as e:
-        return None
-    finally:
-        conn.close()
+        simplelist = []
+        for bookinfo in data:
+            simplelist.append('\t'.join([element.replace('\n', ' ') for element in bookinfo]))
+        return '\n'.join(simplelist)
 
 # Format long text by providing the width in characters
 def wrap_text(text, width):
@@ -517,553 +456,22 @@ def print_table(data, headers, max_width=50):
             print(format_str.format(*line))
         print(separator)
 
-def get_abbrs_file_path(module_name):
-    """Return the path to the JSON file with book names for the given module name."""
-    abbr_dir = os.path.join(get_default_config_path(), 'moduledata')
-    if not os.path.exists(abbr_dir):
-        os.makedirs(abbr_dir)
-    return os.path.join(abbr_dir, f"{module_name}.abbr.json")
-
-def guess_encoding_and_decode(data):
-    # If the data is already a string, just return it
-    if isinstance(data, str):
-        return data, 'original'
-
-    encodings = [
-        'utf-8', 'cp1251', 'latin1', 'cp1252', 'iso-8859-1', 'iso-8859-2', 'iso-8859-5',
-        'iso-8859-15', 'ascii', 'macroman', 'cp850', 'cp437', 'utf-16', 'utf-16le',
-        'utf-16be', 'utf-32', 'utf-32le', 'utf-32be', 'big5', 'gb2312', 'gbk', 'gb18030',
-        'shift_jis', 'euc-jp', 'euc-kr', 'iso-2022-jp', 'iso-2022-kr', 'iso-2022-cn',
-        'koi8-r', 'koi8-u', 'cp1250', 'cp1253', 'cp1254', 'cp1255', 'cp1256', 'cp1257',
-        'cp1258', 'cp852', 'cp866', 'cp874', 'iso-8859-3', 'iso-8859-4', 'iso-8859-6',
-        'iso-8859-7', 'iso-8859-8', 'iso-8859-9', 'windows-1251', 'windows-1250',
-        'windows-1253', 'windows-1254'
-    ]
-
-    for encoding in encodings:
-        try:
-            return data.decode(encoding), encoding
-        except (UnicodeDecodeError, AttributeError):
-            continue
-    return data.decode('utf-8', errors='replace'), 'utf-8'  # Fallback to UTF-8 with error replacement
-
-def extract_abbrs_to_json(module_path, output_path):
-    """Extract verses from the module and write them to the specified JSON file."""
-    abbrs = {}
-    conn = sqlite3.connect(module_path)
+def positive_int(value):
+    """Argument type for page sizes: a whole number of at least 1."""
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT book_number, short_name, long_name FROM books")
-        rows = cur.fetchall()
-        for book_number, short_name, long_name in rows:
-            book_str = str(book_number)
-            short_str, short_encoding = guess_encoding_and_decode(short_name)
-            long_str, long_encoding = guess_encoding_and_decode(long_name)
-            abbrs[book_str] = [long_str, short_str]
-    finally:
-        conn.close()
-
-    with open(output_path, 'w', encoding='utf-8') as file:
-        json_data = custom_json_dump(abbrs)
-        file.write(json_data)
-
-def ensure_abbrs_file(module_name, module_path):
-    """Ensure the the JSON file with book names exists for the given module."""
-    abbrs_file_path = get_abbrs_file_path(module_name)
-    if not os.path.exists(abbrs_file_path):
-        extract_abbrs_to_json(module_path, abbrs_file_path)
-    return abbrs_file_path
-
-def get_allverses_file_path(module_name):
-    """Return the path to the allverses JSON file for the given module name."""
-    allverses_dir = os.path.join(get_default_config_path(), 'moduledata')
-    if not os.path.exists(allverses_dir):
-        os.makedirs(allverses_dir)
-    return os.path.join(allverses_dir, f"{module_name}.allverses.json")
-
-def extract_verses_to_json(module_path, output_path):
-    """Extract verses from the module and write them to the specified JSON file."""
-    verses_data = {}
-    conn = sqlite3.connect(module_path)
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT book_number, chapter, verse FROM verses")
-        rows = cur.fetchall()
-        for book_number, chapter, verse in rows:
-            book_str = str(book_number)
-            chapter_str = str(chapter)
-            if book_str not in verses_data:
-                verses_data[book_str] = {}
-            if chapter_str not in verses_data[book_str]:
-                verses_data[book_str][chapter_str] = 0
-            verses_data[book_str][chapter_str] += 1
-    finally:
-        conn.close()
-
-    with open(output_path, 'w', encoding='utf-8') as file:
-        json.dump(verses_data, file, ensure_ascii=False, indent=2)
-
-def ensure_allverses_file(module_name, module_path):
-    """Ensure the allverses JSON file exists for the given module."""
-    allverses_file_path = get_allverses_file_path(module_name)
-    if not os.path.exists(allverses_file_path):
-        extract_verses_to_json(module_path, allverses_file_path)
-    return allverses_file_path
-
-def load_verses_count(filename):
-    with open(filename, 'r', encoding='utf-8') as file:
-        return json.load(file)
-
-# Helper function to get book number
-def get_book_number(book_name, mapping):
-    for book_number, names in mapping.items():
-        for name in names:
-            if book_name == normalize_book_name(name):
-                return int(book_number)
-    raise ValueError(f"Unknown book name: {book_name}")
-
-# Helper function to get the last verse of a chapter
-def get_last_verse(book_number, chapter, verses_count):
-    return verses_count[str(book_number)].get(str(chapter), 1)
-
-# Helper function to get the last chapter of a book
-def get_last_chapter(book_number, verses_count):
-    return max(int(chapter) for chapter in verses_count[str(book_number)].keys())
-
-# Normalize book name by removing spaces and periods
-def normalize_book_name(book_name):
-    book_name = re.sub(r'[\u0020\u00A0\u1680\u2000-\u200A\u202F\u205F\u3000\u200B\u200C\u200D\u2060\uFEFF]+|\.', '', book_name)
-    return book_name
-
-# A reference could be copied from somewhere and contain different spaces and dashes.
-def replace_funny_spaces(string):
-    string = re.sub(r'[\u0020\u00A0\u1680\u2000-\u200A\u202F\u205F\u3000\u200B\u200C\u200D\u2060\uFEFF]+', ' ', string)
-    string = re.sub(r'[\u2010\u2013\u2014-]', '-', string)
-    string = re.sub(r'[\u2018\u2019\u201B\u2032\u02BC\u275C\uFF07\'`]', "'", string)
-    return string
-
-# Parse a reference part to get book, chapter, and verse
-def parse_reference_part(part, mapping, verses_count, abbrs_mapping, prev_book=None, prev_chapter=None, prev_verse=None, prev_was_verse=False, book_explicit=False):
-    tokens = part.strip().split()
-
-    if not tokens:
-        print(invalid_reference)
-        raise ValueError("Invalid reference format")
-
-
-    book_number = None
-    for i in range(len(tokens), 0, -1):
-        possible_book_name = ' '.join(tokens[:i])
-        possible_book_name_normalized = normalize_book_name(possible_book_name)
-        try:
-            book_number = get_book_number(possible_book_name_normalized, mapping)
-            book_explicit = True
-            tokens = tokens[i:]
-            break
-        except ValueError:
-            continue
-
-    if not book_number:
-        if prev_book:
-            book_number = prev_book
-            book_explicit = False
-        else:
-            return invalid_reference, None, None, None, None, None
-
-    if str(book_number) not in abbrs_mapping.keys():
-        return invalid_reference, None, None, None, None, None
-
-    chapter = None
-    verse = None
-
-    if tokens:
-        chapter_verse = tokens[0]
-        if ':' in chapter_verse:
-            chapter, verse = map(int, chapter_verse.split(':'))
-            prev_was_verse = True
-        else:
-            if book_number != prev_book or book_explicit:
-                chapter = int(chapter_verse)
-                verse = 1
-                prev_was_verse = False
-            elif prev_was_verse:
-                verse = int(chapter_verse)
-                chapter = prev_chapter
-            else:
-                chapter = int(chapter_verse)
-    else:
-        if book_number != prev_book or book_explicit:
-            chapter = 1
-            verse = 1
-        else:
-            if prev_chapter:
-                chapter = prev_chapter
-            else:
-                chapter = 1
-            if prev_verse:
-                verse = prev_verse
-            else:
-                verse = 1
-
-    if verse is None:
-        verse = 1
-
-    if chapter is None:
-        chapter = 1
-
-    if ':' in part:
-        end_chapter = chapter
-        end_verse = verse
-        prev_was_verse = True
-    else:
-        if book_number != prev_book or book_explicit:
-            if len(tokens) > 0:
-                end_chapter = chapter
-            else:
-                end_chapter = get_last_chapter(book_number, verses_count)
-            end_verse = get_last_verse(book_number, end_chapter, verses_count)
-        else:
-            if prev_was_verse:
-                end_chapter = chapter
-                end_verse = verse
-            else:
-                end_chapter = chapter
-                end_verse = get_last_verse(book_number, chapter, verses_count)
-                prev_was_verse = False
-
-    return book_number, chapter, verse, end_chapter, end_verse, prev_was_verse
-
-# Substitute semicolons with commas and the closest book name to the left
-def substitute_semicolons(reference):
-    parts = reference.split(';')
-    if len(parts) == 1:
-        return reference
-    def is_letter(char):
-        return unicodedata.category(char).startswith('L')
-    pattern = r'^\d*\w+'
-    book_names =[]
-    new_reference = ''
-    for index, part in enumerate(parts):
-        part = part.strip()
-        matches = re.findall(pattern, part)
-        filtered_matches = [match for match in matches if is_letter(match[-1])]
-        if filtered_matches:
-            book_names.append(filtered_matches[-1])
-            new_reference += f"{part}, "
-        else:
-            book_name = book_names[index-1]
-            book_names.append(book_name)
-            new_reference += f"{book_name} {part}, "
-    new_reference = new_reference.strip()[:-1]
-    return new_reference
-
-# Calculate the range
-def parse_range(reference, mapping, verses_count, abbrs_mapping):
-    reference = substitute_semicolons(reference)
-    parts = reference.split(',')
-    ranges = []
-    prev_end_book = prev_end_chapter = prev_end_verse = None
-    start_book = start_chapter = start_verse = end_book = end_chapter = end_verse = None
-    prev_was_verse = False
-    book_explicit = False
-
-    for part in parts:
-        subranges = part.split('-')
-        subrange_results = []
-
-        for i, subrange in enumerate(subranges):
-            if i == 0:
-                result = parse_reference_part(subrange, mapping, verses_count, abbrs_mapping, prev_end_book, prev_end_chapter, prev_end_verse, prev_was_verse)
-                if result[0] == invalid_reference:
-                    return invalid_reference
-                start_book, start_chapter, start_verse, end_chapter, end_verse, prev_was_verse = result
-            else:
-                if ' ' in subrange or subrange.isalpha():
-                    result = parse_reference_part(subrange, mapping, verses_count, abbrs_mapping)
-                    if result[0] == invalid_reference:
-                        return invalid_reference
-                    start_book, start_chapter, start_verse, end_chapter, end_verse, prev_was_verse = result
-                else:
-                    start_book = prev_end_book
-                    if ':' in subrange:
-                        chapter, verse = map(int, subrange.split(':'))
-                        start_chapter = end_chapter = chapter
-                        start_verse = end_verse = verse
-                        prev_was_verse = True
-                    else:
-                        number = int(subrange)
-                        if start_book != prev_end_book or book_explicit:
-                            start_chapter = number
-                            start_verse = 1
-                            end_chapter = get_last_chapter(start_book, verses_count)
-                            end_verse = get_last_verse(start_book, end_chapter, verses_count)
-                            prev_was_verse = False
-                        else:
-                            if prev_was_verse:
-                                start_chapter = prev_end_chapter
-                                start_verse = end_verse = number
-                            else:
-                                start_chapter = end_chapter = number
-                                start_verse = 1
-                                end_verse = get_last_verse(start_book, number, verses_count)
-                                prev_was_verse = False
-
-            subrange_results.append({
-                "start": {"book": start_book, "chapter": start_chapter, "verse": start_verse},
-                "end": {"book": start_book, "chapter": end_chapter, "verse": end_verse}
-            })
-            prev_end_book, prev_end_chapter, prev_end_verse = start_book, end_chapter, end_verse
-
-        if subrange_results:
-            ranges.append({
-                "start": subrange_results[0]["start"],
-                "end": subrange_results[-1]["end"]
-            })
-
-    return ranges
-
-def calculate_verses_in_range(ranges, allverses_data):
-    def verses_in_book(book, start_chapter=1, start_verse=1, end_chapter=None, end_verse=None):
-        total_verses = 0
-        chapters = allverses_data[str(book)]
-
-        if end_chapter is None:
-            end_chapter = max(int(ch) for ch in chapters.keys())
-        if end_verse is None:
-            end_verse = chapters[str(end_chapter)]
-
-        for chapter in range(start_chapter, end_chapter + 1):
-            chapter_str = str(chapter)
-            if chapter == start_chapter and chapter == end_chapter:
-                total_verses += end_verse - start_verse + 1
-            elif chapter == start_chapter:
-                total_verses += chapters[chapter_str] - start_verse + 1
-            elif chapter == end_chapter:
-                total_verses += end_verse
-            else:
-                total_verses += chapters[chapter_str]
-
-        return total_verses
-
-    verses_counts = []
-
-    for range_ in ranges:
-        start = range_['start']
-        end = range_['end']
-
-        if start['book'] == end['book']:
-            verses_count = verses_in_book(start['book'], start['chapter'], start['verse'], end['chapter'], end['verse'])
-        else:
-            total_verses = 0
-            total_verses += verses_in_book(start['book'], start['chapter'], start['verse'])
-            current_book = start['book'] + 1
-
-            while current_book < end['book']:
-                if str(current_book) in allverses_data:
-                    total_verses += verses_in_book(current_book)
-                current_book += 1
-
-            total_verses += verses_in_book(end['book'], 1, 1, end['chapter'], end['verse'])
-            verses_count = total_verses
-
-        verses_counts.append(verses_count)
-
-    return verses_counts
-
-def query_verses(module_path, ranges):
-    conn = sqlite3.connect(module_path)
-    cur = conn.cursor()
-
-    def query_single_verse(book, chapter, verse):
-        cur.execute("""
-            SELECT book_number, chapter, verse, text
-            FROM verses
-            WHERE book_number=? AND chapter=? AND verse=?
-            ORDER BY book_number, chapter, verse
-        """, (book, chapter, verse))
-        return cur.fetchall()
-
-    def query_multi_verse(book, start_chapter, start_verse, end_chapter=None, end_verse=None):
-        if end_chapter is None:
-            end_chapter = start_chapter
-        if end_verse is None:
-            end_verse = start_verse
-
-        cur.execute("""
-            SELECT book_number, chapter, verse, text
-            FROM verses
-            WHERE book_number=? AND (chapter > ? OR (chapter = ? AND verse >= ?))
-            AND (chapter < ? OR (chapter = ? AND verse <= ?))
-            ORDER BY book_number, chapter, verse
-        """, (book, start_chapter, start_chapter, start_verse, end_chapter, end_chapter, end_verse))
-        return cur.fetchall()
-
-    def query_book(book):
-        cur.execute("""
-            SELECT book_number, chapter, verse, text
-            FROM verses
-            WHERE book_number=?
-            ORDER BY book_number, chapter, verse
-        """, (book,))
-        return cur.fetchall()
-
-    verses_data = []
-
-    for range_ in ranges:
-        start = range_['start']
-        end = range_['end']
-
-        if start['book'] == end['book']:
-            verses_data.extend(query_multi_verse(start['book'], start['chapter'], start['verse'], end['chapter'], end['verse']))
-        else:
-            # Query from start verse to the end of the start book
-            verses_data.extend(query_multi_verse(start['book'], start['chapter'], start['verse']))
-
-            # Query all intermediate books
-            current_book = start['book'] + 1
-            while current_book < end['book']:
-                verses_data.extend(query_book(current_book))
-                current_book += 1
-
-            # Query from start of end book to the end verse
-            verses_data.extend(query_multi_verse(end['book'], 1, 1, end['chapter'], end['verse']))
-
-    conn.close()
-    return verses_data
-
-def format_output(format_string, data, abbrs_file_path, module_name):
-    # Define the mapping for known format specifiers
-    book_number = data[0]
-    chapter = data[1]
-    verse = data[2]
-    raw_text = data[3]
-    format_map = {
-        '%b': book_number,
-        '%c': chapter,
-        '%v': verse,
-        '%T': raw_text,
-        '%m': module_name
-    }
-
-    # Replace format specifiers in the format_string
-    result = format_string
-    for key, value in format_map.items():
-        if key in result:
-            result = result.replace(key, str(value))
-
-    book_names = get_book_name(abbrs_file_path, book_number)
-    # Handle custom format specifiers
-    result = result.replace('%f', book_names[0])  # full book name
-    result = result.replace('%a', book_names[1])  # abbreviated book name
-    result = result.replace('%z', zap_full(raw_text))
-    result = result.replace('%t', zap_text(raw_text))
-    result = result.replace('%A', ansi_format_text(raw_text))
-    result = result.replace('%Z', ansi_format_no_strong(raw_text))
-    result = re.sub(r'\\t', '\t', result)
-    result = re.sub(r'\\n', '\n', result)
-
-    return result
-
-def get_book_name(abbrs_file_path, book_number):
-    with open(abbrs_file_path, 'r', encoding='utf-8') as file:
-        data = json.load(file)
-    values = data.get(str(book_number))
-    if values is not None:
-        return values
-    else:
-        return book_number
-
-def remove_ansi_esc_seq(string):
-    ansi_escape = re.compile(r'\x1B\[[0-9;]*[mK]')
-    return ansi_escape.sub('', string)
-
-def zap_text(string):
-    """Remove everything from the verse except the actual biblical text"""
-    paragraph_break = r'<pb/>'
-    line_break = r'<br/>'
-    strong_numbers = r'<([SGH])>[^>]*</\1>'
-    j_words = r'</?J>'
-    note_markers = r'</?n>'
-    emph_markers = r'</?e>'
-    insert_markers = r'</?i>'
-    footnotes = r'<f>\[[^\]]*\]</f>'
-    headings = r'<h>[^>]*</h>'
-    indent_end = r'</t>'
-    indent_begin = r'<t>'
-
-    string = re.sub(paragraph_break, '\n', string).strip()
-    string = re.sub(line_break, '\n', string).strip()
-    string = re.sub(strong_numbers, '', string)
-    string = re.sub(j_words, '', string)
-    string = re.sub(note_markers, '', string)
-    string = re.sub(emph_markers, '', string)
-    string = re.sub(insert_markers, '', string)
-    string = re.sub(footnotes, '', string)
-    string = re.sub(headings, '', string)
-    string = re.sub(indent_end, '', string)
-    string = re.sub(indent_begin, '\n    ', string)
-
-    return string
-
-def zap_full(string):
-    string =  zap_text(string)
-
-    notes = r'\{[^}]*\}'
-    line_break = r'\n'
-    multiple_spaces =r'\s+'
-
-    string = re.sub(notes, '', string)
-    string = re.sub(line_break, '', string)
-    string = re.sub(multiple_spaces, ' ', string)
-
-    return string.strip()
-
-def ansi_format_text(string):
-    """Format text with ANSI escape sequences for pretty console output"""
-    paragraph_break = r'<pb/>'
-    line_break = r'<br/>'
-    strong_begin = r'<([SGH])>'
-    strong_end = r'</[SGH]>'
-    j_words_begin = r'<J>'
-    j_words_end = r'</J>'
-    note_begin = r'<n>'
-    note_end = r'</n>'
-    emph_begin = r'<e>'
-    emph_end = r'</e>'
-    insert_begin = r'<i>'
-    insert_end = r'</i>'
-    footnotes = r'<f>\[\d+\]</f>'
-    headings = r'<h>[^>]*</h>'
-    indent_end = r'</t>'
-    indent_begin = r'<t>'
-
-    string = re.sub(paragraph_break, '\n', string).strip()
-    string = re.sub(line_break, '\n', string).strip()
-    string = re.sub(strong_begin, rf'{start_lightblue}{start_italics}<\1', string)
-    string = re.sub(strong_end, f'>{reset_to_normal}', string)
-    string = re.sub(j_words_begin, f'{start_red}', string)
-    string = re.sub(j_words_end, f'{reset_to_normal}', string)
-    string = re.sub(note_begin, f'{start_lightgrey}{start_italics}', string)
-    string = re.sub(note_end, f'{reset_to_normal}', string)
-    string = re.sub(emph_begin, f'{start_bold}', string)
-    string = re.sub(emph_end, f'{reset_to_normal}', string)
-    string = re.sub(insert_begin, f'{start_italics}', string)
-    string = re.sub(insert_end, f'{reset_to_normal}', string)
-    string = re.sub(footnotes, '', string)
-    string = re.sub(headings, '', string)
-    string = re.sub(indent_end, '', string)
-    string = re.sub(indent_begin, '\n    ', string)
-
-    return string
-
-def ansi_format_no_strong(string):
-    """Remove Strong's numbers from console output with ANSI escape sequences"""
-    string = ansi_format_text(string)
-    strong_number = re.compile(r'\x1B\[94m\x1B\[3m<[SGH][^>]*>\x1B\[0m')
-
-    string = strong_number.sub('', string)
-
-    return string
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(not_positive_number.format(value=value))
+    return number
+
+def host_port(value):
+    """Argument type for --http: HOST:PORT (or :PORT, or PORT) as (host, port), with 'localhost' as the default host."""
+    host, _, port = value.rpartition(':')
+    if not port.isdigit() or int(port) > 65535:
+        raise argparse.ArgumentTypeError(invalid_host_port.format(value=value))
+    return host or 'localhost', int(port)
 
 def open_folder(folder_path):
     try:
@@ -1076,6 +484,32 @@ def open_folder(folder_path):
     except Exception as e:
         print(f"{error}", folder_fail.format(error = str(e)))
 
+# Show the output in a pager as soon as the first lines are ready. The pager reads from a pipe,
+# so verses are only fetched and formatted as fast as the user scrolls through them
+def page_output(chunks):
+    pager = os.environ.get('PAGER') or ('more' if os.name == 'nt' else 'less')
+    env = dict(os.environ)
+    # R keeps ANSI colours, F quits right away if everything fits on one screen, X leaves the text on the screen
+    env.setdefault('LESS', 'FRX')
+    try:
+        process = subprocess.Popen(shlex.split(pager, posix=os.name != 'nt'), stdin=subprocess.PIPE,
+                                   encoding='utf-8', errors='replace', bufsize=1, env=env)
+    except OSError:
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+        return
+    try:
+        for chunk in chunks:
+            process.stdin.write(chunk)
+        process.stdin.close()
+    except OSError:
+        # The pager was closed before the end; stop fetching
+        pass
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        process.wait()
+
 def json_to_tsv(json_file):
     if not os.path.exists(json_file):
         print(file_fail.format(file=json_file))
@@ -1179,7 +613,7 @@ def main():
     )
     parser.add_argument(
         "-p", "--path",
-        help=help_path
+        help=help_path.format(separator=os.pathsep)
     )
     parser.add_argument(
         "-L", "--list-modules",
@@ -1208,6 +642,11 @@ def main():
         action="store_true",
         help=help_selfabbr
     )
+    parser.add_argument(
+        "--all-abbr",
+        action="store_true",
+        help=help_allabbr
+    )
     parser.add_argument(
         "-f", "--format",
         help=help_format
@@ -1253,6 +692,150 @@ def main():
         action='store_true',
         help=help_gui
     )
+    parser.add_argument(
+        "--scan",
+        nargs='*',
+        metavar='FILE',
+        help=help_scan
+    )
+    parser.add_argument(
+        "--scan-text",
+        action='store_true',
+        help=help_scan_text
+    )
+    parser.add_argument(
+        "--http",
+        type=host_port,
+        metavar='HOST:PORT',
+        help=help_http
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=0,
+        metavar='MB',
+        help=help_memory_budget
+    )
+    parser.add_argument(
+        "--xref",
+        metavar='MODULE_NAME',
+        help=help_xref
+    )
+    parser.add_argument(
+        "--xref-text",
+        action='store_true',
+        help=help_xref_text
+    )
+    parser.add_argument(
+        "--lexicon",
+        metavar='MODULE_NAMES',
+        help=help_lexicon
+    )
+    parser.add_argument(
+        "--plan",
+        metavar='MODULE_NAME',
+        help=help_plan
+    )
+    parser.add_argument(
+        "--day",
+        type=int,
+        metavar='N',
+        help=help_day
+    )
+    parser.add_argument(
+        "--date",
+        nargs='?',
+        const='today',
+        metavar='YYYY-MM-DD',
+        help=help_date
+    )
+    parser.add_argument(
+        "--export",
+        action='store_true',
+        help=help_export
+    )
+    parser.add_argument(
+        "--diff",
+        nargs=2,
+        metavar=('MODULE_A', 'MODULE_B'),
+        help=help_diff
+    )
+    parser.add_argument(
+        "--build-cache",
+        nargs='*',
+        metavar='MODULE_NAME',
+        help=help_build_cache
+    )
+    parser.add_argument(
+        "--concordance",
+        nargs='?',
+        const='word',
+        choices=['word', 'book', 'chapter'],
+        help=help_concordance
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        metavar='N',
+        help=help_top
+    )
+    parser.add_argument(
+        "--kwic",
+        metavar='WORDS',
+        help=help_kwic
+    )
+    parser.add_argument(
+        "--max-verses",
+        type=int,
+        metavar='N',
+        help=help_max_verses
+    )
+    parser.add_argument(
+        "--count",
+        action='store_true',
+        help=help_count
+    )
+    parser.add_argument(
+        "--output",
+        choices=['text', 'json', 'jsonl'],
+        default='text',
+        help=help_output
+    )
+    parser.add_argument(
+        "--text-variants",
+        default='text',
+        metavar='VARIANTS',
+        help=help_text_variants.replace('%', '%%')
+    )
+    parser.add_argument(
+        "--pager",
+        action='store_true',
+        help=help_pager
+    )
+    parser.add_argument(
+        "--merge",
+        nargs='?',
+        const='canonical',
+        choices=['canonical', 'request'],
+        help=help_merge
+    )
+    parser.add_argument(
+        "--limit",
+        type=positive_int,
+        metavar='N',
+        help=help_limit
+    )
+    parser.add_argument(
+        "--offset",
+        type=int,
+        metavar='N',
+        default=0,
+        help=help_offset
+    )
+    parser.add_argument(
+        "--cursor",
+        help=help_cursor
+    )
 
     # Check config file existence and update path if needed
     config = read_config()
@@ -1274,14 +857,15 @@ def main():
     if not valid_path and not any([args.helpformat, args.open_config_folder, args.j2t, args.t2j, args.check_tsv]):
         # Validate the path to the modules (if -p is specified or no/wrong value is recorded in the config)
         while not validate_path(modules_path):
-            if not os.path.isdir(modules_path):
+            folders = split_modules_path(modules_path)
+            if not folders or not all(os.path.isdir(folder) for folder in folders):
                 print(invalid_path.format(modules_path=modules_path))
-            elif not find_sqlite_files(modules_path):
+            else:
                 print(empty_path.format(modules_path=modules_path))
             input_path = select_modules_directory() if args.gui else input(f"{in_path}\n").strip()
             if input_path == "! User-canceled !":
                 return
-            modules_path = resolve_home(input_path)
+            modules_path = os.pathsep.join(resolve_home(folder) for folder in split_modules_path(input_path))
 
             # Save the valid path to the config file
         config['modules_path'] = modules_path
@@ -1316,7 +900,8 @@ def main():
 
     # Handle the --open-module-folder argument
     if args.open_module_folder:
-        open_folder(modules_path)
+        for folder in split_modules_path(modules_path):
+            open_folder(folder)
         return
 
     # Handle the --json-to-tsv argument
@@ -1345,7 +930,7 @@ def main():
         if args.format:
             format_string = args.format
         if not format_string:
-            format_string = config.get('format_string') if config.get('format_string') else "%f %c:%v: %t (%m)"
+            format_string = config.get('format_string') if config.get('format_string') else DEFAULT_FORMAT_STRING
         return format_string
     format_string = update_format_string()
 
@@ -1363,6 +948,91 @@ def main():
         print(helpformat_message)
         return
 
+    # Handle the --http argument (serve lookups to other local tools)
+    if args.http:
+        host, port = args.http
+        registry = ModuleRegistry(modules_path, memory_budget=args.memory_budget * 1024 ** 2)
+        server = make_http_server(registry, host, port, module_name, format_string)
+        print(http_serving.format(url=f"http://{host}:{port}"))
+        # Modules added or replaced while serving are picked up without a restart
+        with ModuleWatcher(registry):
+            try:
+                server.serve_forever()
+            finally:
+                server.server_close()
+        return
+
+    # Handle the --build-cache argument (build the cache files of modules ahead of the first lookups)
+    if args.build_cache is not None:
+        registry = ModuleRegistry(modules_path)
+        if args.build_cache:
+            selected_paths = []
+            for cache_module_name in args.build_cache:
+                # A name selects the module of each type, e.g. a Bible with its subheadings
+                found = [registry.find(cache_module_name, kind) for kind in ('bible', *NON_BIBLE_MODULE_MARKERS)]
+                if not any(found):
+                    print(no_module.format(module_name=cache_module_name, modules_path=modules_path), file=sys.stderr)
+                selected_paths.extend(module_path for module_path in found if module_path)
+        else:
+            selected_paths = registry.module_paths()
+        start = time.perf_counter()
+        results = []
+        infos = {}
+        failed = set()
+        for done, (module_path, built, info, seconds) in enumerate(warm_module_caches(selected_paths), 1):
+            module_name = get_module_name(module_path)
+            if built is None:
+                print(build_cache_failed.format(done=done, total=len(selected_paths), module_name=module_name, error=info), file=sys.stderr)
+                failed.add(module_path)
+                continue
+            infos[module_path] = info
+            results.append((module_name, built, seconds))
+            print(build_cache_progress.format(done=done, total=len(selected_paths), module_name=module_name,
+                                              caches=', '.join(built) or build_cache_up_to_date, seconds=seconds), file=sys.stderr)
+        update_catalog({name: registry.find(name) for name in registry.names() if registry.find(name) not in failed}, infos)
+        if not args.build_cache:
+            registry.alias_index()
+        if results:
+            print_table([[module_name, ', '.join(built) or build_cache_up_to_date, f"{seconds:.2f}"]
+                         for module_name, built, seconds in sorted(results, key=lambda result: -result[2])],
+                        ["Module", "Caches", "Seconds"])
+        print(build_cache_summary.format(caches=sum(len(built) for _, built, _ in results), built=sum(1 for _, built, _ in results if built),
+                                         total=len(selected_paths), seconds=time.perf_counter() - start))
+        return
+
+    # Handle the --diff argument (list verses that differ between two modules)
+    if args.diff:
+        registry = ModuleRegistry(modules_path)
+        modules = []
+        for diff_module_name in args.diff:
+            if not registry.find(diff_module_name):
+                print(no_module.format(module_name=diff_module_name, modules_path=modules_path))
+                return
+            modules.append(registry.get(diff_module_name))
+        module_a, module_b = modules
+        statuses = {'changed': '~', 'added': '+', 'removed': '-'}
+        counts = dict.fromkeys(statuses, 0)
+
+        def diff_records():
+            for status, book_number, chapter, verse in diff_verse_hashes(module_a.verse_hashes, module_b.verse_hashes):
+                counts[status] += 1
+                names = (module_b if status == 'added' else module_a).book_names.get(str(book_number), [str(book_number)])
+                yield {'status': status, 'book_number': book_number, 'full_name': names[0], 'chapter': chapter, 'verse': verse}
+
+        if args.output == 'text':
+            for record in diff_records():
+                print(f"{statuses[record['status']]}\t{record['book_number']}:{record['chapter']}:{record['verse']}\t{record['full_name']} {record['chapter']}:{record['verse']}")
+            print(diff_summary.format(module_a=module_a.name, module_b=module_b.name, **counts), file=sys.stderr)
+        else:
+            metadata = {'module_a': module_a.name, 'module_b': module_b.name}
+            if args.output == 'json':
+                chunks = iter_json_document(metadata, diff_records())
+            else:
+                chunks = iter_json_lines(metadata, diff_records(), 'difference')
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+        return
+
     # Ensure required arguments if --list-modules is not used
     def report_args_error():
         parser.error(parser_error)
@@ -1574,6 +1244,25 @@ def main():
             dropdown_menu.grid(row=2, column=0, padx=(10, 10), pady=(0, 10))
             dropdown_var.trace_add("write", update_text)  # Refresh text when selection changes
 
+            # Modules added, removed or replaced while the window is open show up in the dropdown.
+            # The watcher thread only queues the changes; Tk widgets are updated from the main loop
+            module_changes = queue.Queue()
+            ModuleWatcher(ModuleRegistry(modules_path), on_change=module_changes.put).start()
+
+            def refresh_dropdown():
+                changed = False
+                while not module_changes.empty():
+                    module_changes.get_nowait()
+                    changed = True
+                if changed:
+                    menu = dropdown_menu['menu']
+                    menu.delete(0, 'end')
+                    for item in list_sqlite_files(modules_path, 'simple').splitlines():
+                        menu.add_command(label=item, command=tk._setit(dropdown_var, item))
+                root.after(500, refresh_dropdown)
+
+            root.after(500, refresh_dropdown)
+
         # Run the program with initial arguments
         def update_arguments(argument, value):
             format_arg = ['-f', '--format', '-F', '--save-format']
@@ -1608,15 +1297,14 @@ def main():
     # Handle the --module_name argument
     if args.module_name:
         module_name = args.module_name
-        module_file = None
-        for file in find_sqlite_files(modules_path):
-            if os.path.splitext(file)[0].lower() == module_name.lower():
-                module_file = file
-                break
-        if not module_file:
+        registry = ModuleRegistry(modules_path)
+        if not registry.find(module_name):
             print(no_module.format(module_name=module_name, modules_path=modules_path))
             return
-        module_path = os.path.join(modules_path, module_file)
+        module = registry.get(module_name)
+        if module_name.lower() in registry.collisions:
+            paths = registry.collisions[module_name.lower()]
+            print(module_collision.format(module_name=module_name, module_path=paths[0], other_paths=', '.join(paths[1:])), file=sys.stderr)
     else:
         report_args_error()
         return
@@ -1624,43 +1312,308 @@ def main():
     # Handle the --abbr argument (non-default mapping of book names and abbreviations for the reference)
     if args.abbr:
         mapping_file = os.path.join(get_default_config_path(), f'{args.abbr}_mapping.json')
+        mapping = load_mapping(mapping_file)
     else:
-        mapping_file = BOOKMAPPING_FILE
+        mapping = module.mapping
 
     # Handle the --self-abbr argument (book names and abbreviations for the reference are taken from the module)
     if args.self_abbr:
-        mapping_file = ensure_abbrs_file(module_name, module_path)
-        if not os.path.exists(mapping_file):
-            mapping_file = BOOKMAPPING_FILE
-
-    # Handle the --reference argument
-    if args.reference:
-        reference = replace_funny_spaces(args.reference).lower()
-        reference = re.sub(r'[\[\(<]+|[\.,:\-–—\]\)>]+$', '', reference)
-        allverses_file_path = ensure_allverses_file(module_name, module_path)
-        abbrs_file_path = ensure_abbrs_file(module_name, module_path)
-        verses_count = load_verses_count(allverses_file_path)
-        ranges = parse_range(reference, load_mapping(mapping_file), verses_count, load_mapping(abbrs_file_path))
-        if isinstance(ranges, str) and ranges == invalid_reference:
-            print("✘", no_verse_ouput.format(reference=args.reference), ranges.lower())
+        mapping = module.abbrs_mapping
+
+    # Handle the --all-abbr argument (book names and abbreviations of all installed modules and mapping files)
+    if args.all_abbr:
+        mapping = registry.alias_index()
+
+    def add_headings(verses, ranges):
+        """Merge headings of the module and its companion subheadings module into the verse rows."""
+        subheadings = registry.get(module.name, 'subheadings') if registry.find(module.name, 'subheadings') else None
+        return module.with_headings(verses, ranges, subheadings)
+
+    # Headings are only read when they are shown
+    show_headings = '%h' in format_string
+
+    # Handle the --scan argument (find references in free text from files or stdin)
+    if args.scan is not None:
+        abbrs_mapping = module.abbrs_mapping
+        # Only books present in the module are looked for; the module's own names are recognized too
+        scan_mapping = compile_mapping({book: mapping['books'].get(book, []) + names
+                                        for book, names in abbrs_mapping['books'].items()})
+        scan_mapping['max_tokens'] = max(mapping['max_tokens'], abbrs_mapping['max_tokens'])
+        pattern = build_scan_pattern(scan_mapping['books'])
+        parsed_references = {}
+
+        def scan_source(source, lines):
+            for start, end, matched, reference in scan_references(lines, pattern):
+                if reference not in parsed_references:
+                    try:
+                        parsed_references[reference] = module.resolve(reference, scan_mapping)
+                    except InvalidReferenceError:
+                        parsed_references[reference] = None
+                ranges = parsed_references[reference]
+                if ranges is None:
+                    continue
+                canonical_ranges = ','.join(format_canonical_range(range_) for range_ in ranges)
+                print('\t'.join([source, str(start), str(end), matched, canonical_ranges]))
+                if args.scan_text:
+                    verses = module.iter_verses(ranges)
+                    if show_headings:
+                        verses = add_headings(verses, ranges)
+                    for formatted_output in module.render(verses, format_string, args.noansi):
+                        print(formatted_output)
+
+        for source in args.scan or ['-']:
+            if source == '-':
+                sys.stdin.reconfigure(encoding='utf-8', errors='replace')
+                scan_source(source, sys.stdin)
+            elif os.path.isfile(source):
+                with open(source, 'r', encoding='utf-8', errors='replace') as file:
+                    scan_source(source, file)
+            else:
+                print(file_fail.format(file=source), file=sys.stderr)
+        return
+
+    text_variants = [variant.strip() for variant in args.text_variants.split(',') if variant.strip()]
+    if not text_variants or any(variant not in TEXT_VARIANTS for variant in text_variants):
+        parser.error(unknown_text_variants.format(variants=args.text_variants))
+
+    # Handle the --plan argument (readings of a day from a reading plan module)
+    if args.plan:
+        if not registry.find(args.plan, 'plan'):
+            print(no_plan_module.format(module_name=args.plan, modules_path=modules_path))
             return
-        number_of_verses = calculate_verses_in_range(ranges, verses_count)
-        verses_data = query_verses(module_path, ranges)
-        for verse in verses_data:
-            formatted_output = format_output(format_string, verse, abbrs_file_path, module_name)
-            if args.noansi:
-                formatted_output = remove_ansi_esc_seq(formatted_output)
-            print(formatted_output)
-            continue
+        plan = registry.get(args.plan, 'plan')
+
+        def readable_readings(readings):
+            return '; '.join(format_readable_range(range_, module.book_names)
+                             for range_ in plan_readings_to_ranges(readings, module.verses_count))
+
+        if args.export:
+            # The whole plan is streamed from the module, one day at a time
+            if args.output == 'text':
+                for day, evening, readings in plan.iter_days():
+                    print((plan_day_evening if evening else plan_day).format(day=day, reference=readable_readings(readings)))
+            else:
+                records = ({'day': day, 'evening': evening, 'reference': readable_readings(readings),
+                            'ranges': plan_readings_to_ranges(readings, module.verses_count)}
+                           for day, evening, readings in plan.iter_days())
+                metadata = {'module': module.name, 'plan': plan.name, 'length': plan.length}
+                if args.output == 'json':
+                    chunks = iter_json_document(metadata, records, 'days')
+                else:
+                    chunks = iter_json_lines(metadata, records, 'day')
+                for chunk in chunks:
+                    sys.stdout.write(chunk)
+            return
+
+        if args.day is not None:
+            day = args.day
+        else:
+            try:
+                date = datetime.date.today() if args.date in (None, 'today') else datetime.date.fromisoformat(args.date)
+            except ValueError:
+                parser.error(invalid_date.format(date=args.date))
+            day = plan.day_for_date(date)
+        if str(day) not in plan.days:
+            print(invalid_plan_day.format(day=day, plan=plan.name, length=plan.length))
+            return
+
+    # Handle the --reference argument (--concordance and --kwic read the whole module without it)
+    if args.reference or args.plan or args.concordance or args.kwic:
+        reference = args.reference
+        # With --output json/jsonl errors are reported as JSON too, so pipelines can parse every answer
+        def report_reference_error(message):
+            if args.output == 'text':
+                print("✘", no_verse_ouput.format(reference=reference), message)
+            else:
+                print(json.dumps({'module': module.name, 'reference': reference, 'error': message.strip()}, ensure_ascii=False))
+
+        if args.plan:
+            # The day's readings go through the same pipeline as a reference
+            readings = plan.readings(day)
+            ranges = plan_readings_to_ranges(readings, module.verses_count)
+            reference = readable_readings(readings)
+        elif not args.reference:
+            ranges = [whole_module_range(module.verses_count)]
+        else:
+            try:
+                ranges = module.resolve(args.reference, mapping, fuzzy=True)
+            except InvalidReferenceError:
+                report_reference_error(invalid_reference.lower())
+                return
+            def book_label(book_number):
+                return module.book_names.get(str(book_number), [None])[0] or str(book_number)
+            for name, alias, book_number in find_corrected_book_names(clean_reference(args.reference), mapping):
+                print(corrected_book_name.format(name=name, alias=alias, book=book_label(book_number)), file=sys.stderr)
+            for name in find_ambiguous_book_names(clean_reference(args.reference), mapping, fuzzy=True):
+                book_labels = [book_label(book_number) for book_number in mapping['ambiguous'][name]]
+                print(ambiguous_book_name.format(name=name, books=', '.join(book_labels), book=book_labels[0]), file=sys.stderr)
+        if args.merge:
+            ranges = module.normalize(ranges, args.merge)
+
+        # Handle the --concordance and --kwic arguments (word frequencies and keywords in context)
+        if args.concordance or args.kwic:
+            # Merged ranges in Bible order: every verse is read once and each book or chapter comes in one piece
+            ranges = module.normalize(ranges)
+            book_names = module.book_names
+            def group_label(book_number, chapter):
+                label = book_names.get(str(book_number), [str(book_number)])[0]
+                return label if chapter is None else f"{label} {chapter}"
+            metadata = {'module': module.name, 'reference': reference, 'ranges': ranges}
+            if args.kwic:
+                keywords = [word.strip() for word in args.kwic.split(',') if word.strip()]
+                # A keyword is looked for as one whole word; 'word1' would otherwise quietly become 'word'
+                invalid_keywords = [word for word in keywords if normalize_keyword(word) is None]
+                if invalid_keywords:
+                    report_reference_error(invalid_keyword.format(words=', '.join(invalid_keywords)))
+                    return
+                lines = concordance(module.path, ranges, module.verses_count, keywords=keywords)
+                if args.output == 'text':
+                    for book_number, chapter, verse, left, word, right in lines:
+                        position = {'book': book_number, 'chapter': chapter, 'verse': verse}
+                        print(f"{format_readable_range({'start': position, 'end': position}, book_names)}\t"
+                              f"{left.rstrip():>{KWIC_WIDTH}} [{word}] {right.lstrip()}")
+                    return
+                metadata['words'] = keywords
+                records = ({'book_number': book_number, 'chapter': chapter, 'verse': verse, 'left': left, 'word': word, 'right': right}
+                           for book_number, chapter, verse, left, word, right in lines)
+                record_type, list_name = 'occurrence', 'occurrences'
+            else:
+                groups = concordance(module.path, ranges, module.verses_count, args.concordance, args.top)
+                if args.output == 'text':
+                    total = shown = 0
+                    for book_number, chapter, group_total, words in groups:
+                        prefix = '' if args.concordance == 'word' else f"{group_label(book_number, chapter)}\t"
+                        for word, count in words:
+                            print(f"{prefix}{count}\t{word}")
+                        total += group_total
+                        shown += len(words)
+                    print(concordance_summary.format(words=total, distinct=shown), file=sys.stderr)
+                    return
+                metadata.update({'by': args.concordance, 'top': args.top})
+                records = ({'book_number': book_number, 'chapter': chapter, 'count': group_total,
+                            'words': [{'word': word, 'count': count} for word, count in words]}
+                           for book_number, chapter, group_total, words in groups)
+                record_type, list_name = 'group', 'groups'
+            if args.output == 'json':
+                chunks = iter_json_document(metadata, records, list_name)
+            else:
+                chunks = iter_json_lines(metadata, records, record_type)
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            return
+        dictionaries = []
+        if args.lexicon:
+            for dictionary_name in [name.strip() for name in args.lexicon.split(',') if name.strip()]:
+                if not registry.find(dictionary_name, 'dictionary'):
+                    report_reference_error(no_dictionary_module.format(module_name=dictionary_name, modules_path=modules_path))
+                    return
+                dictionaries.append(registry.get(dictionary_name, 'dictionary'))
+
+        # Handle the --xref argument (cross-references from every verse of the reference)
+        if args.xref:
+            if not registry.find(args.xref, 'crossreferences'):
+                report_reference_error(no_xref_module.format(module_name=args.xref, modules_path=modules_path))
+                return
+            xref_module = registry.get(args.xref, 'crossreferences')
+            crossreferences = xref_module.lookup(ranges)
+            targets = [item['target'] for item in crossreferences]
+            # Texts of all targets are read together in one pass over the Bible module
+            target_verses = module.verses_by_range(targets) if args.xref_text else [[] for _ in targets]
+            if args.output == 'text':
+                for item, verses in zip(crossreferences, target_verses):
+                    source = item['source']
+                    source_range = {'start': source, 'end': source}
+                    print(f"{format_readable_range(source_range, module.book_names)}\t{format_readable_range(item['target'], module.book_names)}\t{item['votes']}")
+                    for formatted_output in module.render(verses, format_string, args.noansi):
+                        print(formatted_output)
+            else:
+                metadata = {'module': module.name, 'crossreferences': xref_module.name, 'reference': reference, 'ranges': ranges,
+                            'count': len(crossreferences)}
+                records = []
+                for item, verses in zip(crossreferences, target_verses):
+                    record = dict(item, reference=format_readable_range(item['target'], module.book_names))
+                    if args.xref_text:
+                        record['verses'] = [verse_record(module, row, text_variants) for row in verses]
+                    records.append(record)
+                if args.output == 'json':
+                    chunks = iter_json_document(metadata, records)
+                else:
+                    chunks = iter_json_lines(metadata, records, 'crossreference')
+                for chunk in chunks:
+                    sys.stdout.write(chunk)
+            return
+        # Range sizes come from the versification, so oversized requests are caught before any query
+        number_of_verses = sum(module.count_verses(ranges))
+        if args.count:
+            print(number_of_verses)
+            return
+        if args.max_verses is not None and number_of_verses > args.max_verses:
+            report_reference_error(too_many_verses.format(count=number_of_verses, limit=args.max_verses))
+            return
+        paged = args.limit is not None or args.offset or args.cursor
+        next_cursor = None
+        if paged:
+            # Show one page; the cursor lets the next call continue right after it without re-reading
+            limit = args.limit if args.limit is not None else max(number_of_verses, 1)
+            try:
+                verses, total, next_cursor = module.page(ranges, limit, max(args.offset, 0), args.cursor)
+            except InvalidCursorError:
+                report_reference_error(invalid_cursor)
+                return
+            shown = len(verses)
+        else:
+            verses = module.iter_verses(ranges)
+        # JSON records always carry their headings, fetched with one query for the whole request
+        if show_headings or args.output != 'text':
+            verses = add_headings(verses, ranges)
+        lexicon = {}
+        if dictionaries:
+            # All distinct numbers of the passage are resolved together, with one query per dictionary
+            verses = list(verses)
+            strong_prefix = module.info('strong_numbers_prefix')
+            lexicon = lookup_strong_numbers(collect_strong_numbers(verses, strong_prefix), dictionaries)
+
+        if args.output == 'text':
+            chunks = (f"{formatted_output}\n" for formatted_output in module.render(verses, format_string, args.noansi))
+            if lexicon:
+                footnotes = ''.join(f"{format_lexicon_entry(number, entry)}\n" for number, entry in lexicon.items())
+                chunks = itertools.chain(chunks, ['\n', footnotes])
+        else:
+            metadata = {'module': module.name, 'reference': reference, 'ranges': ranges, 'count': number_of_verses}
+            if args.plan:
+                metadata.update({'plan': plan.name, 'day': day})
+            if paged:
+                metadata['next_cursor'] = next_cursor
+            if dictionaries:
+                metadata['lexicon'] = lexicon
+            records = (verse_record(module, row, text_variants) for row in verses)
+            if dictionaries:
+                records = (dict(record, strong_numbers=collect_strong_numbers([row], strong_prefix))
+                           for record, row in zip(records, verses))
+            write_json = iter_json_document if args.output == 'json' else iter_json_lines
+            chunks = write_json(metadata, records)
+        if args.pager and sys.stdout.isatty():
+            page_output(chunks)
+        else:
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+        if next_cursor and args.output == 'text':
+            print(next_page.format(shown=shown, total=total, cursor=next_cursor), file=sys.stderr)
     else:
         report_args_error()
         return
 
-    if not args.module_name or not args.reference:
+    if not args.module_name or not (args.reference or args.plan or args.concordance or args.kwic):
         report_args_error()
 
 if __name__ == "__main__":
+    # Process pool workers of a frozen executable must not run main() again
+    multiprocessing.freeze_support()
     try:
         main()
     except KeyboardInterrupt:
         print(exit_now)
+    except BrokenPipeError:
+        # The output was piped into a program that stopped reading it (e.g. head); what's left to flush goes nowhere
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
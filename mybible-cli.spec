@@ -8,6 +8,7 @@ a = Analysis(
     datas=[
         ('icons', 'icons'),
         ('mybible-cli.py', '.'),
+        ('mybible.py', '.'),
     ],
     hiddenimports=[],
     hookspath=[],
@@ -0,0 +1,3353 @@
+"""Library interface to MyBible modules.
+
+Everything mybible-cli does with modules is available here without the command
+line: resolving references, fetching verses and formatting them. Importing this
+module has no side effects; files in the config folder are only created when a
+function that needs them is called.
+
+    registry = ModuleRegistry('/path/to/modules')
+    module = registry.get('KJV+')
+    ranges = module.resolve('Jn 3:16-18')
+    for line in module.render(module.iter_verses(ranges), '%a %c:%v %z'):
+        print(line)
+"""
+import base64
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import pathlib
+import pickle
+import re
+import shutil
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+import unicodedata
+import urllib.parse
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has byte-range locks in msvcrt instead
+    fcntl = None
+    import msvcrt
+
+try:
+    # Optional: lets ModuleWatcher sleep until a modules folder changes (Linux only)
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+# Config location (APP_NAME) is a folder name under ~/.config
+APP_NAME = 'mybible-cli'
+def get_default_config_path():
+    if os.name == 'nt':
+        return os.path.join(os.getenv('APPDATA'), APP_NAME)
+    elif os.name == 'posix':
+        if 'darwin' in os.sys.platform:
+            return os.path.join(os.path.expanduser('~'), 'Library', 'Application Support', APP_NAME)
+        else:
+            return os.path.join(os.path.expanduser('~'), '.config', APP_NAME)
+
+BOOKMAPPING_FILE = os.path.join(get_default_config_path(), 'mapping.json')
+
+# Format string used when none is given or saved
+DEFAULT_FORMAT_STRING = "%f %c:%v: %t (%m)"
+
+# Returned by parse_range() when a reference cannot be resolved in the module
+INVALID_REFERENCE = 'INVALID_REFERENCE'
+
+# Default book mapping content
+DEFAULT_BOOK_MAPPING = \
+{
+    "10": ["Genesis", "1 Moses", "I Moses", "Gen", "Ge", "Gn", "1M"],
+    "20": ["Exodus", "2 Moses", "II Moses", "Exo", "Exod", "Ex", "2M"],
+    "30": ["Leviticus", "3 Moses", "III Moses", "Lev", "Lv", "Le", "3M"],
+    "40": ["Numbers", "4 Moses", "IV Moses", "Num", "Nu", "Nm", "Nb", "4M"],
+    "50": ["Deuteronomy", "5 Moses", "V Moses", "Deu", "Deut", "Dt", "5M"],
+    "60": ["Joshua", "Jos", "Josh", "Jsh"],
+    "70": ["Judges", "Jdg", "Judg", "Jdgs"],
+    "80": ["Ruth", "Rut", "Ru", "Rth"],
+    "90": ["1 Samuel", "I Samuel", "1Sa", "1Sam", "1 Sm", "I Sam", "I Sm"],
+    "100": ["2 Samuel", "II Samuel", "2Sa", "2Sam", "2 Sm", "II Sam", "II Sm"],
+    "110": ["1 Kings", "I Kings", "1Ki", "1Kgs", "1Kin", "I Ki", "I Kgs", "I Kin"],
+    "120": ["2 Kings", "II Kings", "2Ki", "2Kgs", "2Kin", "II Ki", "II Kgs", "II Kin"],
+    "130": ["1 Chronicles", "I Chronicles", "1Ch", "1Chr", "1 Ch", "1 Chron", "I Ch", "I Chr", "I Chron"],
+    "140": ["2 Chronicles", "II Chronicles", "2Ch", "2Chr", "2 Ch", "2 Chron", "II Ch", "II Chr", "II Chron"],
+    "150": ["Ezra", "Ezr", "Ez"],
+    "160": ["Nehemiah", "Neh", "Ne"],
+    "165": ["1 Esdras", "I Esdras", "1Es", "1Esd", "I Es", "I Esd"],
+    "166": ["2 Esdras", "II Esdras", "2Es", "2Esd", "II Es", "II Esd"],
+    "170": ["Tobit", "Tob"],
+    "180": ["Judith", "Jdt", "Jdth"],
+    "190": ["Esther", "Est", "Esth", "Es"],
+    "192": ["Greek Esther", "Additions to Esther", "Esg", "AddEsth", "EstGr", "GrEsth"],
+    "220": ["Job", "Jb"],
+    "230": ["Psalms", "Psalm", "Psa", "Ps", "Pslm"],
+    "232": ["Psalm 151", "Ps2", "Ps151"],
+    "235": ["Psalms of Solomon", "PSS"],
+    "240": ["Proverbs", "Pro", "Prov", "Prv", "Pr"],
+    "245": ["Odae", "Odas", "Oda"],
+    "250": ["Ecclesiastes", "Qoholeth", "Ecc", "Eccl", "Qoh", "Eccles"],
+    "260": ["Song of Songs", "Song of Solomon", "Canticles of Canticles", "Sng", "Song", "Sg", "SOS", "Cant", "COC"],
+    "270": ["Wisdom of Solomon", "Wis", "Wisd"],
+    "280": ["Sirach", "Ecclesiasticus", "Sir", "Ecclus"],
+    "290": ["Isaiah", "Isa", "Is"],
+    "300": ["Jeremiah", "Jer", "Je", "Jr", "Jrm"],
+    "305": ["Prayer of Azariah", "Azariah", "Aza", "PrAzar", "PrAz", "Azar"],
+    "310": ["Lamentations", "Lam", "La", "Lament"],
+    "315": ["Letter of Jeremiah", "Epistle of Jeremiah", "Lje", "EpJer", "LetJer", "LJ"],
+    "320": ["Baruch", "1 Baruch", "I Baruch", "Bar", "Br"],
+    "321": ["2 Baruch", "2Ba"],
+    "322": ["3 Baruch", "3Ba"],
+    "323": ["Song of the 3 Young Men", "Song of the Three Young Men", "S3Y", "SgThree", "Sg3"],
+    "325": ["Susanna", "Sus"],
+    "330": ["Ezekiel", "Ezk", "Ezek", "Eze"],
+    "340": ["Daniel", "Dan", "Da", "Dn"],
+    "345": ["Bel and the Dragon", "Bel"],
+    "350": ["Hosea", "Hos", "Ho"],
+    "360": ["Joel", "Jol", "Jl"],
+    "370": ["Amos", "Amo", "Am"],
+    "380": ["Obadiah", "Oba", "Obad", "Ob"],
+    "390": ["Jonah", "Jon", "Jona"],
+    "400": ["Micah", "Mic", "Mi", "Mc"],
+    "410": ["Nahum", "Nam", "Nah", "Na"],
+    "420": ["Habakkuk", "Hab", "Hb"],
+    "430": ["Zephaniah", "Zep", "Zp"],
+    "440": ["Haggai", "Hag", "Hg"],
+    "450": ["Zechariah", "Zec", "Zech", "Zch"],
+    "460": ["Malachi", "Mal", "Ml"],
+    "462": ["1 Maccabees", "1Ma", "1Macc", "1Mac", "I Mac", "I Macc"],
+    "464": ["2 Maccabees", "2Ma", "2Macc", "2Mac", "II Mac", "II Macc"],
+    "466": ["3 Maccabees", "3Ma", "3Macc", "3Mac", "III Mac", "III Macc"],
+    "467": ["4 Maccabees", "4Ma", "4Macc", "4Mac", "IV Mac", "IV Macc"],
+    "468": ["2 Esdras", "2Es", "2Esd", "II Es", "II Esd"],
+    "470": ["Matthew", "Mat", "Matt", "Mt"],
+    "480": ["Mark", "Mrk", "Mar", "Mk"],
+    "490": ["Luke", "Luk", "Lk", "Lu"],
+    "500": ["John", "Jhn", "Jn"],
+    "510": ["Acts", "Act", "Ac"],
+    "511": ["Didache", "Did"],
+    "520": ["Romans", "Rom", "Ro", "Rm"],
+    "530": ["1 Corinthians", "I Corinthians", "1Co", "1Cor", "I Co", "I Cor"],
+    "540": ["2 Corinthians", "II Corinthians", "2Co", "2Cor", "II Co", "II Cor"],
+    "550": ["Galatians", "Gal", "Ga"],
+    "560": ["Ephesians", "Eph"],
+    "570": ["Philippians", "Php", "Phil", "Phlp"],
+    "580": ["Colossians", "Col"],
+    "590": ["1 Thessalonians", "I Thessalonians", "1Th", "1Thess", "1Ths", "1 Thes", "I Th", "I Thess", "I Ths", "I Thes"],
+    "600": ["2 Thessalonians", "II Thessalonians", "2Th", "2Thess", "2Ths", "2 Thes", "II Th", "II Thess", "II Ths", "II Thes"],
+    "610": ["1 Timothy", "I Timothy", "1Ti", "1Tim", "I Ti", "I Tim"],
+    "620": ["2 Timothy", "II Timothy", "2Ti", "2Tim", "II Ti", "II Tim"],
+    "630": ["Titus", "Tit", "Tt"],
+    "640": ["Philemon", "Phm", "Phlm"],
+    "650": ["Hebrews", "Heb", "He"],
+    "660": ["James", "Jas", "Jam", "Jms", "Ja"],
+    "670": ["1 Peter", "I Peter", "1Pe", "1Pet", "1 Pt", "I Pe", "I Pet", "I Pt"],
+    "680": ["2 Peter", "II Peter", "2Pe", "2Pet", "2 Pt", "II Pe", "II Pet", "II Pt"],
+    "690": ["1 John", "I John", "1Jn", "I Jn"],
+    "700": ["2 John", "II John", "2Jn", "II Jn"],
+    "710": ["3 John", "III John", "3Jn", "III Jn"],
+    "720": ["Jude", "Jud", "Jd"],
+    "730": ["Revelation", "Apocalypse", "Rev", "Re", "Revel", "Apoc"],
+    "780": ["Letter to the Laodiceans", "Laodiceans", "Lao"],
+    "790": ["Prayer of Manasseh", "Man", "PrMan"]
+}
+
+# Format json data so that each key with its values are on the same separate line
+def custom_json_dump(data):
+    # Create a custom JSON string with each list of values on the same line as its key
+    json_parts = []
+    for key, value_list in data.items():
+        values = ', '.join(json.dumps(v, ensure_ascii=False) for v in value_list)
+        json_parts.append(f'  "{key}": [{values}]')
+    return '{\n' + ',\n'.join(json_parts) + '\n}'
+
+# Variables for prettier text in the console output
+start_bold = "\033[1m"
+start_lightgrey = "\033[0;37m"
+start_lightblue = "\033[94m"
+start_red = "\033[0;31m"
+start_italics = "\033[3m"
+reset_to_normal = "\033[0m"
+
+def write_file_atomic(file_path, data):
+    """Write text (as UTF-8) or bytes to a file so that readers see the old or the new content, never a part of it."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or '.', prefix=f".{os.path.basename(file_path)}.", suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+@contextlib.contextmanager
+def file_lock(file_path):
+    """Hold an advisory lock on file_path + '.lock' while a file is built.
+
+    Concurrent processes building the same cache file wait for the first one and
+    then find the file ready. The lock file is left in place; removing it could let
+    two processes lock different files."""
+    with open(f"{file_path}.lock", 'a+b') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def ensure_book_mapping_exists(json_file):
+    """Check if the JSON file exists, and if not, write the default content to it."""
+    if not os.path.exists(json_file):
+        os.makedirs(os.path.dirname(json_file), exist_ok=True)
+        with file_lock(json_file):
+            if not os.path.exists(json_file):
+                write_file_atomic(json_file, custom_json_dump(DEFAULT_BOOK_MAPPING))
+
+def compile_mapping(mapping):
+    """Prepare a book mapping for lookups: normalized names per book, a dict of all names and a hint on how many tokens a name can take."""
+    books = {}
+    aliases = {}
+    max_tokens = 1
+    for book_number, names in mapping.items():
+        # Book names read from a module may be NULL
+        names = [name for name in names if name]
+        books[book_number] = [normalize_book_name(name).lower() for name in names]
+        for name, normalized_name in zip(names, books[book_number]):
+            # The first book listing a name wins, as with the former linear search
+            aliases.setdefault(normalized_name, int(book_number))
+            # One more token in case a number is typed apart from the name ("1 Co" for "1Co")
+            max_tokens = max(max_tokens, len(name.split()) + 1)
+    return {'books': books, 'aliases': aliases, 'max_tokens': max_tokens}
+
+def get_compiled_mapping_path(json_file):
+    """Return the path to the compiled form of a mapping file."""
+    return f"{json_file}.pickle"
+
+def load_mapping(json_file):
+    """Load the book mapping from a JSON file, reusing its compiled form while the file is unchanged."""
+    compiled_file = get_compiled_mapping_path(json_file)
+    file_stat = os.stat(json_file)
+    source = [file_stat.st_size, file_stat.st_mtime_ns]
+    if os.path.exists(compiled_file):
+        try:
+            with open(compiled_file, 'rb') as file:
+                compiled = pickle.load(file)
+            if compiled.get('source') == source:
+                return compiled['mapping']
+        except Exception:
+            # A truncated or incompatible cache (unpickling may raise almost anything) is rebuilt from the JSON
+            pass
+
+    with open(json_file, 'r', encoding='utf-8') as file:
+        mapping = compile_mapping(json.load(file))
+    try:
+        write_file_atomic(compiled_file, pickle.dumps({'source': source, 'mapping': mapping}, protocol=pickle.HIGHEST_PROTOCOL))
+    except OSError:
+        pass
+    return mapping
+
+def list_mapping_files(config_path=None):
+    """Return the default mapping file followed by the '<prefix>_mapping.json' files of the configuration folder."""
+    config_path = config_path or get_default_config_path()
+    files = [os.path.join(config_path, 'mapping.json')] if os.path.exists(os.path.join(config_path, 'mapping.json')) else []
+    if os.path.isdir(config_path):
+        files.extend(os.path.join(config_path, f) for f in sorted(os.listdir(config_path)) if f.endswith('_mapping.json'))
+    return files
+
+def find_mapping_file(prefix, config_path=None):
+    """Return the path of '<prefix>_mapping.json' if it is one of the mapping files of the configuration folder, or None."""
+    for file_path in list_mapping_files(config_path):
+        if os.path.basename(file_path) == f'{prefix}_mapping.json':
+            return file_path
+    return None
+
+def get_alias_index_path():
+    """Return the path to the merged index of book names of all modules and mapping files."""
+    index_dir = os.path.join(get_default_config_path(), 'moduledata')
+    os.makedirs(index_dir, exist_ok=True)
+    return os.path.join(index_dir, 'aliases.pickle')
+
+def get_alias_index_fingerprint(module_paths, mapping_files):
+    """Fingerprint the sources of the alias index, so that an added, removed or changed module or mapping file invalidates it."""
+    fingerprint = []
+    for file_path in mapping_files:
+        file_stat = os.stat(file_path)
+        fingerprint.append([file_path, f"{file_stat.st_size}-{file_stat.st_mtime_ns}"])
+    for module_path in module_paths:
+        fingerprint.append([module_path, get_module_fingerprint(module_path)])
+    return fingerprint
+
+def build_alias_index(sources):
+    """Merge book mappings ({book_number: [names]}) into one compiled mapping.
+
+    The result has the keys of compile_mapping() and 'ambiguous': the names used
+    for different books by different sources, with their book numbers, the chosen
+    one first. Names of the first source (the default mapping) keep their book;
+    other names go to the book most sources agree on, ties to the one seen first."""
+    books = {}
+    votes = {}
+    max_tokens = 1
+    for source_index, mapping in enumerate(sources):
+        voted = set()
+        for book_number, names in mapping.items():
+            book_names = books.setdefault(str(book_number), [])
+            for name in names:
+                # long_name and short_name may be NULL in a module
+                if not name:
+                    continue
+                normalized_name = normalize_book_name(name).lower()
+                if not normalized_name:
+                    continue
+                if normalized_name not in book_names:
+                    book_names.append(normalized_name)
+                # A source votes once for each book it uses a name for
+                if (normalized_name, book_number) not in voted:
+                    voted.add((normalized_name, book_number))
+                    vote = votes.setdefault(normalized_name, {}).setdefault(int(book_number), [source_index == 0, 0])
+                    vote[1] += 1
+                max_tokens = max(max_tokens, len(name.split()) + 1)
+
+    aliases = {}
+    ambiguous = {}
+    for normalized_name, book_votes in votes.items():
+        # The sort is stable with reverse=True too, so tied books keep the order they were seen in
+        ranked = sorted(book_votes, key=book_votes.get, reverse=True)
+        if len(ranked) > 1:
+            ambiguous[normalized_name] = ranked
+        aliases[normalized_name] = ranked[0]
+    return {'books': books, 'aliases': aliases, 'max_tokens': max_tokens, 'ambiguous': ambiguous}
+
+def read_alias_source(file_path):
+    """Read the book names of a mapping file or of a Bible module; a module that can't be read has none."""
+    if file_path.lower().endswith('.json'):
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    try:
+        return load_book_names(ensure_abbrs_file(get_module_name(file_path), file_path))
+    except (sqlite3.DatabaseError, OSError):
+        return {}
+
+def load_alias_index(module_paths, fingerprint=None, config_path=None):
+    """Load the merged book names of all mapping files and the given Bible modules, building the index if a source has changed.
+
+    The index is kept as a pickled compiled mapping, so a reference is resolved with
+    the usual dictionary lookups whatever the number of sources."""
+    mapping_files = list_mapping_files(config_path)
+    if fingerprint is None:
+        fingerprint = get_alias_index_fingerprint(module_paths, mapping_files)
+    index_path = get_alias_index_path()
+
+    def load():
+        try:
+            with open(index_path, 'rb') as file:
+                info = pickle.load(file)
+            if info.get('fingerprint') == fingerprint:
+                return info['index']
+        except Exception:
+            # A truncated or incompatible index is built again, as in load_mapping()
+            pass
+        return None
+
+    index = load()
+    if index is None:
+        with file_lock(index_path):
+            # Another process may have built the index while this one waited
+            index = load()
+            if index is None:
+                index = build_alias_index(read_alias_source(file_path) for file_path in mapping_files + list(module_paths))
+                write_file_atomic(index_path, pickle.dumps({'fingerprint': fingerprint, 'index': index}, protocol=pickle.HIGHEST_PROTOCOL))
+    return index
+
+# Get sqlite3 files in the specified directory, including modules packed in zip and gz archives.
+# Modules inside a zip archive are listed as 'KJV.zip/KJV.SQLite3'; plain files come first
+def find_sqlite_files(path):
+    files = []
+    archived_files = []
+    for f in sorted(os.listdir(path)):
+        lower = f.lower()
+        if lower.endswith('.sqlite3') or lower.endswith('.sqlite3.gz'):
+            (archived_files if lower.endswith('.gz') else files).append(f)
+        elif lower.endswith('.zip'):
+            archived_files.extend(f"{f}/{member}" for member in list_zip_modules(os.path.join(path, f)))
+    return files + archived_files
+
+def list_zip_modules(archive_path):
+    """List the modules in a zip archive using only its index."""
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            return [info.filename for info in archive.infolist()
+                    if not info.is_dir() and info.filename.lower().endswith('.sqlite3')]
+    except (OSError, zipfile.BadZipFile):
+        return []
+
+def split_archive_path(module_path):
+    """Split the path to an archived module into the archive path and the member name.
+
+    Returns (None, None) for a plain module file."""
+    match = re.search(r'\.zip[\\/]', module_path, re.IGNORECASE)
+    if match:
+        return module_path[:match.start() + 4], module_path[match.end():]
+    if module_path.lower().endswith('.gz'):
+        return module_path, os.path.basename(module_path)[:-3]
+    return None, None
+
+def get_module_name(module_path):
+    """Return the module name: the file name without the extension and the archive suffix."""
+    member = split_archive_path(module_path)[1]
+    return os.path.splitext(os.path.basename(member or module_path))[0]
+
+# Extracted copies of archived modules are kept until the cache grows beyond this many bytes
+MODULE_CACHE_SIZE_LIMIT = 2 * 1024 ** 3
+
+module_cache_lock = threading.Lock()
+
+def get_module_cache_path():
+    return os.path.join(get_default_config_path(), 'modulecache')
+
+def get_module_file(module_path, cache_size_limit=MODULE_CACHE_SIZE_LIMIT):
+    """Return a path SQLite can open, extracting an archived module into the cache on first use.
+
+    Each extracted copy lives in its own folder named after the archive fingerprint,
+    so a changed archive is extracted again and the stale copy ages out of the cache.
+    The folder's modification time marks when the copy was last used."""
+    archive_path, member = split_archive_path(module_path)
+    if archive_path is None:
+        return module_path
+    archive_stat = os.stat(archive_path)
+    key = hashlib.sha1(
+        f"{os.path.abspath(archive_path)}\0{member}\0{archive_stat.st_size}-{archive_stat.st_mtime_ns}".encode('utf-8')
+    ).hexdigest()[:20]
+    entry_path = os.path.join(get_module_cache_path(), key)
+    file_path = os.path.join(entry_path, os.path.basename(member))
+    with module_cache_lock:
+        if os.path.exists(file_path):
+            os.utime(entry_path)
+            return file_path
+
+        os.makedirs(entry_path, exist_ok=True)
+        with file_lock(file_path):
+            # Another process may have extracted the module while this one waited
+            if os.path.exists(file_path):
+                return file_path
+            temp_path = f"{file_path}.{os.getpid()}.part"
+            try:
+                if archive_path.lower().endswith('.zip'):
+                    with zipfile.ZipFile(archive_path) as archive, archive.open(member) as source, open(temp_path, 'wb') as target:
+                        shutil.copyfileobj(source, target, 1024 * 1024)
+                else:
+                    with gzip.open(archive_path, 'rb') as source, open(temp_path, 'wb') as target:
+                        shutil.copyfileobj(source, target, 1024 * 1024)
+                # The copy keeps the archive's timestamp, so its fingerprint survives re-extraction
+                os.utime(temp_path, ns=(archive_stat.st_atime_ns, archive_stat.st_mtime_ns))
+                os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.replace(temp_path, file_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        evict_module_cache(cache_size_limit, keep=entry_path)
+    return file_path
+
+def remove_cache_entry(entry_path):
+    for file_name in os.listdir(entry_path):
+        file_path = os.path.join(entry_path, file_name)
+        os.chmod(file_path, stat.S_IWUSR | stat.S_IRUSR)
+        os.remove(file_path)
+    os.rmdir(entry_path)
+
+def evict_module_cache(size_limit=MODULE_CACHE_SIZE_LIMIT, keep=None):
+    """Delete the least recently used extracted modules until the cache fits into size_limit bytes."""
+    cache_path = get_module_cache_path()
+    entries = []
+    total_size = 0
+    for key in os.listdir(cache_path):
+        entry_path = os.path.join(cache_path, key)
+        try:
+            size = sum(os.path.getsize(os.path.join(entry_path, file_name)) for file_name in os.listdir(entry_path))
+            entries.append((os.stat(entry_path).st_mtime_ns, size, entry_path))
+        except OSError:
+            continue
+        total_size += size
+
+    for _, size, entry_path in sorted(entries):
+        if total_size <= size_limit:
+            break
+        if entry_path == keep:
+            continue
+        try:
+            remove_cache_entry(entry_path)
+        except OSError:
+            # Still open by another process on Windows; try again next time
+            continue
+        total_size -= size
+
+def open_module_file(module_path, check_same_thread=True):
+    """Connect to the module file. Extracted copies of archived modules are opened read-only."""
+    file_path = get_module_file(module_path)
+    if file_path == module_path:
+        return sqlite3.connect(module_path, check_same_thread=check_same_thread)
+    uri = f"{pathlib.Path(file_path).resolve().as_uri()}?mode=ro&immutable=1"
+    return sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+
+# Module file names containing any of these belong to other MyBible module types
+NON_BIBLE_MODULE_MARKERS = [
+    'crossreferences',
+    'dictionary',
+    'subheadings',
+    'commentaries',
+    'plan',
+    'devotions',
+    'dictionaries_lookup',
+    'ReferenceData',
+]
+
+def split_modules_path(modules_path):
+    """Split the modules path setting into folders; several folders are separated with os.pathsep."""
+    return [folder for folder in modules_path.split(os.pathsep) if folder]
+
+def is_bible_module(file_name):
+    return not any(marker in file_name for marker in NON_BIBLE_MODULE_MARKERS)
+
+def get_module_kind(file_name):
+    """Return the type of the module from its file name: 'bible' or one of NON_BIBLE_MODULE_MARKERS."""
+    for marker in NON_BIBLE_MODULE_MARKERS:
+        if marker in file_name:
+            return marker
+    return 'bible'
+
+def get_module_kind_name(module_path):
+    """Return the name of the module among modules of its type, e.g. 'KJV+' for 'KJV+.crossreferences.SQLite3'."""
+    name = get_module_name(module_path)
+    suffix = f".{get_module_kind(os.path.basename(module_path))}"
+    if suffix != '.bible' and name.lower().endswith(suffix.lower()):
+        name = name[:-len(suffix)]
+    return name
+
+def get_file_hash(file_path):
+    """Generate a hash for the file content."""
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        buffer = file.read()
+        hasher.update(buffer)
+    return hasher.hexdigest()
+
+# Get info (language and description) from the specified module
+def get_info(module, field_name):
+    # Connect to the SQLite database
+    conn = connect_module(module)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT value FROM info WHERE name=?", (field_name,))
+        value = cur.fetchone()
+        if value:  # Check if a result was found
+            return value[0]  # fetchone() returns a tuple, so get the first element
+        else:
+            return None  # No result found
+    except sqlite3.OperationalError as e:
+        return None
+    finally:
+        conn.close()
+
+def get_abbrs_file_path(module_name):
+    """Return the path to the JSON file with book names for the given module name."""
+    abbr_dir = os.path.join(get_default_config_path(), 'moduledata')
+    os.makedirs(abbr_dir, exist_ok=True)
+    return os.path.join(abbr_dir, f"{module_name}.abbr.json")
+
+def get_module_fingerprint(module_path):
+    """Return a cheap fingerprint of the module file (or its archive) based on size and modification time."""
+    file_stat = os.stat(split_archive_path(module_path)[0] or module_path)
+    return f"{file_stat.st_size}-{file_stat.st_mtime_ns}"
+
+def get_encoding_file_path(module_path):
+    """Return the path to the JSON file with the detected text encoding of the module."""
+    encoding_dir = os.path.join(get_default_config_path(), 'moduledata')
+    os.makedirs(encoding_dir, exist_ok=True)
+    return os.path.join(encoding_dir, f"{get_module_name(module_path)}.encoding.json")
+
+# Legacy single-byte encodings seen in MyBible modules, most likely first
+MODULE_ENCODINGS = [
+    'cp1251', 'cp1252', 'cp1250', 'koi8-r', 'koi8-u', 'cp1253', 'cp1254', 'cp1255',
+    'cp1256', 'cp1257', 'cp1258', 'cp866', 'cp874', 'iso-8859-5', 'iso-8859-2',
+    'iso-8859-7', 'iso-8859-8', 'iso-8859-9', 'iso-8859-15', 'macroman', 'cp850',
+    'cp437', 'latin1'
+]
+
+# Scripts that share byte ranges can only be told apart by the module's language
+LANGUAGE_ENCODINGS = {
+    'ru': 'cp1251', 'uk': 'cp1251', 'be': 'cp1251', 'bg': 'cp1251', 'sr': 'cp1251', 'mk': 'cp1251',
+    'pl': 'cp1250', 'cs': 'cp1250', 'sk': 'cp1250', 'hu': 'cp1250', 'hr': 'cp1250', 'sl': 'cp1250', 'ro': 'cp1250',
+    'el': 'cp1253', 'grc': 'cp1253', 'tr': 'cp1254', 'he': 'cp1255', 'hbo': 'cp1255', 'ar': 'cp1256', 'fa': 'cp1256',
+    'lt': 'cp1257', 'lv': 'cp1257', 'et': 'cp1257', 'vi': 'cp1258', 'th': 'cp874'
+}
+
+def score_decoded_text(text):
+    """Rate how plausible the decoded text is as natural language.
+
+    Each word containing non-ASCII characters scores its length if all its letters
+    belong to one script and the letter case looks natural, and loses its length
+    otherwise. Mojibake typically mixes scripts, cases and symbols within a word."""
+    score = 0
+    for word in re.findall(r'[^\s\d<>/\[\](){}.,;:!?\-"\'«»]+', text):
+        non_ascii = [char for char in word if ord(char) > 127]
+        if not non_ascii:
+            continue
+        letters = [char for char in word if char.isalpha()]
+        scripts = {unicodedata.name(char, 'UNKNOWN').split()[0] for char in non_ascii if char.isalpha()}
+        plausible = (
+            len(letters) == len(word)
+            and len(scripts) == 1
+            and (word.islower() or word.isupper() or word.istitle() or word.lower() == word.upper())
+            and not (scripts == {'LATIN'} and len(non_ascii) * 2 > len(letters))
+        )
+        score += len(word) if plausible else -len(word)
+    return score
+
+def detect_module_encoding(module_path, sample_size=256):
+    """Detect the text encoding of the module from a sample of book names and verses."""
+    conn = open_module_file(module_path)
+    conn.text_factory = bytes
+    samples = []
+    encodings = MODULE_ENCODINGS
+    try:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT value FROM info WHERE name='language'")
+            language = cur.fetchone()
+            if language and language[0]:
+                preferred = LANGUAGE_ENCODINGS.get(language[0].decode('ascii', errors='ignore').strip().lower())
+                if preferred:
+                    encodings = [preferred] + [encoding for encoding in MODULE_ENCODINGS if encoding != preferred]
+        except sqlite3.OperationalError:
+            pass
+        try:
+            cur.execute("SELECT short_name, long_name FROM books")
+            for short_name, long_name in cur.fetchall():
+                samples.extend([short_name, long_name])
+        except sqlite3.OperationalError:
+            pass
+        try:
+            # Pick rows spread evenly over the table instead of only the first book
+            cur.execute("SELECT max(rowid) FROM verses")
+            max_rowid = cur.fetchone()[0] or 0
+            step = max(1, max_rowid // sample_size)
+            rowids = list(range(1, max_rowid + 1, step))[:sample_size]
+            placeholders = ','.join('?' * len(rowids))
+            cur.execute(f"SELECT text FROM verses WHERE rowid IN ({placeholders})", rowids)
+            samples.extend(row[0] for row in cur.fetchall())
+        except sqlite3.OperationalError:
+            pass
+        # Subheadings and dictionary modules have neither books nor verses
+        for query in ["SELECT subheading FROM subheadings LIMIT ?", "SELECT definition FROM dictionary LIMIT ?"]:
+            if samples:
+                break
+            try:
+                cur.execute(query, (sample_size,))
+                samples.extend(row[0] for row in cur.fetchall())
+            except sqlite3.OperationalError:
+                pass
+    finally:
+        conn.close()
+
+    sample = b'\n'.join(value if isinstance(value, bytes) else str(value).encode('utf-8')
+                        for value in samples if value is not None)
+    try:
+        sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    best_encoding, best_score = 'utf-8', None
+    for encoding in encodings:
+        try:
+            score = score_decoded_text(sample.decode(encoding))
+        except UnicodeDecodeError:
+            continue
+        # Ties go to the encoding listed first
+        if best_score is None or score > best_score:
+            best_encoding, best_score = encoding, score
+    return best_encoding
+
+def get_module_encoding(module_path):
+    """Return the text encoding of the module, detecting it once per module fingerprint."""
+    encoding_file_path = get_encoding_file_path(module_path)
+    fingerprint = get_module_fingerprint(module_path)
+
+    def load_encoding():
+        if os.path.exists(encoding_file_path):
+            with open(encoding_file_path, 'r', encoding='utf-8') as file:
+                encoding_info = json.load(file)
+            if encoding_info.get('fingerprint') == fingerprint:
+                return encoding_info['encoding']
+        return None
+
+    encoding = load_encoding()
+    if encoding:
+        return encoding
+    with file_lock(encoding_file_path):
+        # Another process may have detected the encoding while this one waited
+        encoding = load_encoding()
+        if encoding:
+            return encoding
+        encoding_info = {
+            'fingerprint': fingerprint,
+            'encoding': detect_module_encoding(module_path)
+        }
+        write_file_atomic(encoding_file_path, json.dumps(encoding_info, ensure_ascii=False, indent=2))
+    return encoding_info['encoding']
+
+def set_text_encoding(conn, encoding):
+    """Decode all text read through the connection with the given encoding."""
+    if encoding != 'utf-8':
+        conn.text_factory = lambda data: data.decode(encoding, errors='replace')
+    return conn
+
+def connect_module(module_path, check_same_thread=True):
+    """Open the module so that all text is decoded with the module's own encoding."""
+    encoding = get_module_encoding(module_path)
+    return set_text_encoding(open_module_file(module_path, check_same_thread=check_same_thread), encoding)
+
+def is_module_cache_stale(cache_file_path, module_path):
+    """Check if a cache file is missing or older than the module's encoding record."""
+    # The record is made first, so a cache file built now is not older than it
+    get_module_encoding(module_path)
+    if not os.path.exists(cache_file_path):
+        return True
+    return os.path.getmtime(cache_file_path) < os.path.getmtime(get_encoding_file_path(module_path))
+
+def extract_abbrs_to_json(module_path, output_path):
+    """Extract verses from the module and write them to the specified JSON file."""
+    abbrs = {}
+    conn = connect_module(module_path)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT book_number, short_name, long_name FROM books")
+        rows = cur.fetchall()
+        for book_number, short_name, long_name in rows:
+            book_str = str(book_number)
+            # Either name may be NULL; the other one stands in for it
+            abbrs[book_str] = [long_name or short_name, short_name or long_name]
+    finally:
+        conn.close()
+
+    write_file_atomic(output_path, custom_json_dump(abbrs))
+
+def ensure_abbrs_file(module_name, module_path):
+    """Ensure the the JSON file with book names exists for the given module."""
+    abbrs_file_path = get_abbrs_file_path(module_name)
+    if is_module_cache_stale(abbrs_file_path, module_path):
+        with file_lock(abbrs_file_path):
+            # Another process may have built the file while this one waited
+            if is_module_cache_stale(abbrs_file_path, module_path):
+                extract_abbrs_to_json(module_path, abbrs_file_path)
+    return abbrs_file_path
+
+def get_allverses_file_path(module_name):
+    """Return the path to the allverses JSON file for the given module name."""
+    allverses_dir = os.path.join(get_default_config_path(), 'moduledata')
+    os.makedirs(allverses_dir, exist_ok=True)
+    return os.path.join(allverses_dir, f"{module_name}.allverses.json")
+
+def extract_verses_to_json(module_path, output_path):
+    """Extract verses from the module and write them to the specified JSON file."""
+    verses_data = {}
+    conn = open_module_file(module_path)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT book_number, chapter, verse FROM verses")
+        rows = cur.fetchall()
+        for book_number, chapter, verse in rows:
+            book_str = str(book_number)
+            chapter_str = str(chapter)
+            if book_str not in verses_data:
+                verses_data[book_str] = {}
+            if chapter_str not in verses_data[book_str]:
+                verses_data[book_str][chapter_str] = 0
+            verses_data[book_str][chapter_str] += 1
+    finally:
+        conn.close()
+
+    write_file_atomic(output_path, json.dumps(verses_data, ensure_ascii=False, indent=2))
+
+def ensure_allverses_file(module_name, module_path):
+    """Ensure the allverses JSON file exists for the given module."""
+    allverses_file_path = get_allverses_file_path(module_name)
+    if is_module_cache_stale(allverses_file_path, module_path):
+        with file_lock(allverses_file_path):
+            # Another process may have built the file while this one waited
+            if is_module_cache_stale(allverses_file_path, module_path):
+                extract_verses_to_json(module_path, allverses_file_path)
+    return allverses_file_path
+
+def load_verses_count(filename):
+    with open(filename, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def get_verses_index_path(module_path):
+    """Return the path to the SQLite file with an indexed copy of the verses of a module."""
+    index_dir = os.path.join(get_default_config_path(), 'moduledata')
+    os.makedirs(index_dir, exist_ok=True)
+    return os.path.join(index_dir, f"{get_module_name(module_path)}.verses.sqlite3")
+
+def get_schema_file_path(module_name):
+    """Return the path to the JSON file recording how the module's tables are indexed."""
+    schema_dir = os.path.join(get_default_config_path(), 'moduledata')
+    os.makedirs(schema_dir, exist_ok=True)
+    return os.path.join(schema_dir, f"{module_name}.schema.json")
+
+def has_verse_index(conn):
+    """Check if SQLite can look verse ranges up with an index."""
+    plan = conn.execute("""
+        EXPLAIN QUERY PLAN
+        SELECT text FROM verses WHERE book_number=? AND chapter=? AND verse>=?
+    """, (0, 0, 0)).fetchall()
+    return any(('INDEX' in row[-1] or 'PRIMARY KEY' in row[-1]) and 'book_number=' in row[-1] for row in plan)
+
+def is_verses_indexed(module_path):
+    """Check whether range lookups in the module use an index, asking SQLite once per module fingerprint."""
+    def check():
+        conn = open_module_file(module_path)
+        try:
+            return has_verse_index(conn)
+        except sqlite3.OperationalError:
+            # No verses table, so nothing to index
+            return True
+        finally:
+            conn.close()
+
+    return ensure_fingerprinted_json(get_schema_file_path(get_module_name(module_path)), get_module_fingerprint(module_path),
+                                     'verses_indexed', check)
+
+def build_verses_index(module_path, index_path):
+    """Copy the verses table into a sidecar database stored in (book_number, chapter, verse) order.
+
+    The copy is a WITHOUT ROWID table, so the primary key B-tree holds the text as
+    well and a range is read without going back to the table. Text is copied as
+    stored and decoded with the module's encoding as before. Of verses stored
+    twice, the first one is kept."""
+    temp_path = f"{index_path}.{os.getpid()}.part"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        source = open_module_file(module_path)
+        source.text_factory = bytes
+        try:
+            rows = source.execute("SELECT book_number, chapter, verse, text FROM verses")
+            index = sqlite3.connect(temp_path)
+            try:
+                index.execute("""
+                    CREATE TABLE verses(book_number numeric, chapter numeric, verse numeric, text text,
+                        PRIMARY KEY (book_number, chapter, verse)) WITHOUT ROWID
+                """)
+                index.executemany("INSERT OR IGNORE INTO verses VALUES (?, ?, ?, CAST(? AS TEXT))", rows)
+                index.execute("CREATE TABLE info(name text, value text)")
+                index.execute("INSERT INTO info VALUES ('fingerprint', ?)", (get_module_fingerprint(module_path),))
+                index.commit()
+            finally:
+                index.close()
+        finally:
+            source.close()
+        os.replace(temp_path, index_path)
+    except BaseException:
+        # A failed build leaves nothing behind in moduledata, like write_file_atomic()
+        for path in (temp_path, f"{temp_path}-journal"):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+def is_index_current(index_path, module_path):
+    """Check if a sidecar index exists and was made from the current module file."""
+    if not os.path.exists(index_path):
+        return False
+    conn = sqlite3.connect(index_path)
+    try:
+        fingerprint = conn.execute("SELECT value FROM info WHERE name='fingerprint'").fetchone()
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        conn.close()
+    return bool(fingerprint) and fingerprint[0] == get_module_fingerprint(module_path)
+
+def ensure_verses_index(module_path):
+    """Build the indexed copy of the module's verses if it is missing or stale, and return its path."""
+    index_path = get_verses_index_path(module_path)
+    if not is_index_current(index_path, module_path):
+        with file_lock(index_path):
+            # Another process may have built the index while this one waited
+            if not is_index_current(index_path, module_path):
+                build_verses_index(module_path, index_path)
+    return index_path
+
+def connect_verses(module_path, check_same_thread=True):
+    """Open the module for verse lookups.
+
+    If the module has no index for range lookups, its indexed copy is attached and
+    a temporary view shadows the module's verses table, so the same queries seek
+    in the copy instead of scanning the module. The module file is never changed."""
+    conn = connect_module(module_path, check_same_thread=check_same_thread)
+    if not is_verses_indexed(module_path):
+        try:
+            index_path = ensure_verses_index(module_path)
+        except (sqlite3.DatabaseError, OSError):
+            # The module is still readable, only slower
+            return conn
+        conn.execute("ATTACH DATABASE ? AS verses_index", (index_path,))
+        conn.execute("CREATE TEMP VIEW verses AS SELECT book_number, chapter, verse, text FROM verses_index.verses")
+    return conn
+
+def get_hashes_file_path(module_name):
+    """Return the path to the JSON file with verse hashes for the given module name."""
+    hashes_dir = os.path.join(get_default_config_path(), 'moduledata')
+    os.makedirs(hashes_dir, exist_ok=True)
+    return os.path.join(hashes_dir, f"{module_name}.hashes.json")
+
+def hash_text(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+def extract_verse_hashes(module_path):
+    """Hash the raw text of every verse and every chapter of the module.
+
+    Returns {'book:chapter': [chapter_hash, {verse: verse_hash}]}. Text is hashed after
+    decoding, so the same text stored in different encodings gets the same hashes."""
+    chapters = {}
+    conn = connect_module(module_path)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT book_number, chapter, verse, text FROM verses ORDER BY book_number, chapter, verse")
+        for book_number, chapter, verse, text in cur:
+            chapter_key = f"{book_number}:{chapter}"
+            if chapter_key not in chapters:
+                chapters[chapter_key] = {}
+            chapters[chapter_key][str(verse)] = hash_text(text or '')
+    finally:
+        conn.close()
+    return {
+        chapter_key: [hash_text(''.join(f"{verse}:{verse_hash};" for verse, verse_hash in verses.items())), verses]
+        for chapter_key, verses in chapters.items()
+    }
+
+def ensure_fingerprinted_json(file_path, fingerprint, field, build):
+    """Return data saved in a JSON file for the module fingerprint, building and saving it if the file is missing or stale.
+
+    The data is built under a file lock, so concurrent processes build it once."""
+    def load():
+        if os.path.exists(file_path):
+            with open(file_path, 'r', encoding='utf-8') as file:
+                info = json.load(file)
+            if info.get('fingerprint') == fingerprint:
+                return info
+        return None
+
+    info = load()
+    if info is None:
+        with file_lock(file_path):
+            # Another process may have built the file while this one waited
+            info = load()
+            if info is None:
+                info = {'fingerprint': fingerprint, field: build()}
+                write_file_atomic(file_path, json.dumps(info, separators=(',', ':')))
+    return info[field]
+
+def ensure_verse_hashes(module_name, module_path):
+    """Load the verse hashes of the module, computing them again if the module has changed."""
+    return ensure_fingerprinted_json(get_hashes_file_path(module_name), get_module_fingerprint(module_path),
+                                     'chapters', lambda: extract_verse_hashes(module_path))
+
+def diff_verse_hashes(hashes_a, hashes_b):
+    """Yield (status, book_number, chapter, verse) for each verse that differs, in Bible order.
+
+    status is 'changed', 'added' (only in B) or 'removed' (only in A). Verses are only
+    compared in chapters whose chapter hashes differ."""
+    def chapter_order(chapter_key):
+        return tuple(int(number) for number in chapter_key.split(':'))
+
+    for chapter_key in sorted(hashes_a.keys() | hashes_b.keys(), key=chapter_order):
+        chapter_a = hashes_a.get(chapter_key)
+        chapter_b = hashes_b.get(chapter_key)
+        if chapter_a and chapter_b and chapter_a[0] == chapter_b[0]:
+            continue
+        book_number, chapter = chapter_order(chapter_key)
+        verses_a = chapter_a[1] if chapter_a else {}
+        verses_b = chapter_b[1] if chapter_b else {}
+        for verse in sorted(verses_a.keys() | verses_b.keys(), key=int):
+            if verse not in verses_b:
+                yield 'removed', book_number, chapter, int(verse)
+            elif verse not in verses_a:
+                yield 'added', book_number, chapter, int(verse)
+            elif verses_a[verse] != verses_b[verse]:
+                yield 'changed', book_number, chapter, int(verse)
+
+# Helper function to get book number
+def get_book_number(book_name, mapping):
+    book_number = mapping['aliases'].get(book_name)
+    if book_number is None:
+        raise ValueError(f"Unknown book name: {book_name}")
+    return book_number
+
+# Helper function to get the last verse of a chapter
+def get_last_verse(book_number, chapter, verses_count):
+    return verses_count[str(book_number)].get(str(chapter), 1)
+
+# Helper function to get the last chapter of a book
+def get_last_chapter(book_number, verses_count):
+    return max(int(chapter) for chapter in verses_count[str(book_number)].keys())
+
+# Helper function to get the range of all the books of a versification
+def whole_module_range(verses_count):
+    book_numbers = sorted(int(book_number) for book_number in verses_count)
+    last_chapter = get_last_chapter(book_numbers[-1], verses_count)
+    return {'start': {'book': book_numbers[0], 'chapter': 1, 'verse': 1},
+            'end': {'book': book_numbers[-1], 'chapter': last_chapter,
+                    'verse': get_last_verse(book_numbers[-1], last_chapter, verses_count)}}
+
+# Normalize book name by removing spaces and periods
+def normalize_book_name(book_name):
+    book_name = re.sub(r'[\u0020\u00A0\u1680\u2000-\u200A\u202F\u205F\u3000\u200B\u200C\u200D\u2060\uFEFF]+|\.', '', book_name)
+    return book_name
+
+# A reference could be copied from somewhere and contain different spaces and dashes.
+def replace_funny_spaces(string):
+    string = re.sub(r'[\u0020\u00A0\u1680\u2000-\u200A\u202F\u205F\u3000\u200B\u200C\u200D\u2060\uFEFF]+', ' ', string)
+    string = re.sub(r'[\u2010\u2013\u2014-]', '-', string)
+    string = re.sub(r'[\u2018\u2019\u201B\u2032\u02BC\u275C\uFF07\'`]', "'", string)
+    return string
+
+# Book names shorter than this are too close to other names to be corrected
+FUZZY_MIN_LENGTH = 4
+
+def get_max_edit_distance(name):
+    """Number of typos tolerated in a book name of this length."""
+    if len(name) < FUZZY_MIN_LENGTH:
+        return 0
+    return 1 if len(name) < 8 else 2
+
+def bounded_edit_distance(a, b, max_distance):
+    """Levenshtein distance between a and b, or max_distance + 1 if it is larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+def get_trigrams(name):
+    """Count the trigrams of a name padded at both ends."""
+    padded = f"\0\0{name}\0\0"
+    trigrams = {}
+    for i in range(len(padded) - 2):
+        trigram = padded[i:i + 3]
+        trigrams[trigram] = trigrams.get(trigram, 0) + 1
+    return trigrams
+
+class FuzzyBookIndex:
+    """Trigram index of the names of a compiled mapping for typo-tolerant lookups.
+
+    Names within the edit distance share most of their trigrams with the typed
+    name, so only the few names passing that count are compared in full."""
+
+    def __init__(self, aliases):
+        self.aliases = aliases
+        self.names = list(aliases)
+        self.postings = {}
+        for name_id, name in enumerate(self.names):
+            for trigram, count in get_trigrams(name).items():
+                self.postings.setdefault(trigram, []).append((name_id, count))
+
+    def search(self, name, max_distance):
+        """Return (distance, name) for the names within max_distance, closest first."""
+        shared = {}
+        for trigram, count in get_trigrams(name).items():
+            for name_id, name_count in self.postings.get(trigram, ()):
+                shared[name_id] = shared.get(name_id, 0) + min(count, name_count)
+        matches = []
+        for name_id, shared_count in shared.items():
+            candidate = self.names[name_id]
+            # Each edit changes at most three trigrams
+            if shared_count < max(len(candidate), len(name)) + 2 - 3 * max_distance:
+                continue
+            distance = bounded_edit_distance(name, candidate, max_distance)
+            if distance <= max_distance:
+                matches.append((distance, candidate))
+        return sorted(matches)
+
+    def match(self, name):
+        """Return (book_number, name) for the closest name if all the closest names are of one book, else None."""
+        max_distance = get_max_edit_distance(name)
+        if not max_distance:
+            return None
+        matches = self.search(name, max_distance)
+        if not matches:
+            return None
+        best = [candidate for distance, candidate in matches if distance == matches[0][0]]
+        if len({self.aliases[candidate] for candidate in best}) > 1:
+            return None
+        return self.aliases[best[0]], best[0]
+
+# Number of compiled mappings whose fuzzy indexes are kept
+FUZZY_INDEX_CACHE_SIZE = 8
+
+# id(mapping) -> (mapping, FuzzyBookIndex), most recently used last; the mapping is kept to check the id wasn't reused
+fuzzy_indexes = collections.OrderedDict()
+fuzzy_indexes_lock = threading.Lock()
+
+def get_fuzzy_index(mapping):
+    """Return the fuzzy index of a compiled mapping, building it on the first miss.
+
+    Indexes are kept apart from the mappings, which are pickled as they are, for the
+    last FUZZY_INDEX_CACHE_SIZE mappings used."""
+    with fuzzy_indexes_lock:
+        entry = fuzzy_indexes.get(id(mapping))
+        if entry is not None and entry[0] is mapping:
+            fuzzy_indexes.move_to_end(id(mapping))
+            return entry[1]
+    index = FuzzyBookIndex(mapping['aliases'])
+    with fuzzy_indexes_lock:
+        fuzzy_indexes[id(mapping)] = (mapping, index)
+        while len(fuzzy_indexes) > FUZZY_INDEX_CACHE_SIZE:
+            fuzzy_indexes.popitem(last=False)
+    return index
+
+def match_book_name(tokens, mapping, fuzzy=False):
+    """Find the longest book name at the start of the tokens.
+
+    Returns (book_number, number of tokens taken, normalized name, name in the mapping),
+    or (None, 0, None, None). If no name matches exactly and fuzzy is true, a name
+    with a few typos is matched to the closest name of the mapping."""
+    candidates = [(i, normalize_book_name(' '.join(tokens[:i]))) for i in range(min(len(tokens), mapping['max_tokens']), 0, -1)]
+    for i, possible_book_name_normalized in candidates:
+        try:
+            return get_book_number(possible_book_name_normalized, mapping), i, possible_book_name_normalized, possible_book_name_normalized
+        except ValueError:
+            continue
+    if fuzzy:
+        for i, possible_book_name_normalized in candidates:
+            # Chapter and verse numbers are not part of a misspelled name
+            if not possible_book_name_normalized[-1:].isalpha():
+                continue
+            match = get_fuzzy_index(mapping).match(possible_book_name_normalized)
+            if match:
+                return match[0], i, possible_book_name_normalized, match[1]
+    return None, 0, None, None
+
+def iter_book_name_matches(reference, mapping, fuzzy=False):
+    """Yield (typed name, name in the mapping, book_number) for the book names of a cleaned reference."""
+    for part in substitute_semicolons(reference).split(','):
+        for subrange in part.split('-'):
+            book_number, _, name, alias = match_book_name(subrange.split(), mapping, fuzzy)
+            if book_number is not None:
+                yield name, alias, book_number
+
+def find_ambiguous_book_names(reference, mapping, fuzzy=False):
+    """Return the book names of a cleaned reference that the mapping flags as used for several books."""
+    ambiguous = mapping.get('ambiguous')
+    if not ambiguous:
+        return []
+    names = []
+    for _, alias, _ in iter_book_name_matches(reference, mapping, fuzzy):
+        if alias in ambiguous and alias not in names:
+            names.append(alias)
+    return names
+
+def find_corrected_book_names(reference, mapping):
+    """Return (typed name, name in the mapping, book_number) for the misspelled book names of a cleaned reference."""
+    corrections = []
+    for name, alias, book_number in iter_book_name_matches(reference, mapping, fuzzy=True):
+        if name != alias and (name, alias, book_number) not in corrections:
+            corrections.append((name, alias, book_number))
+    return corrections
+
+# Parse a reference part to get book, chapter, and verse
+def parse_reference_part(part, mapping, verses_count, abbrs_mapping, prev_book=None, prev_chapter=None, prev_verse=None, prev_was_verse=False, book_explicit=False, fuzzy=False):
+    tokens = part.strip().split()
+
+    if not tokens:
+        raise ValueError("Invalid reference format")
+
+
+    book_number, book_tokens, _, _ = match_book_name(tokens, mapping, fuzzy)
+    if book_number:
+        book_explicit = True
+        tokens = tokens[book_tokens:]
+
+    if not book_number:
+        if prev_book:
+            book_number = prev_book
+            book_explicit = False
+        else:
+            return INVALID_REFERENCE, None, None, None, None, None
+
+    if str(book_number) not in abbrs_mapping['books']:
+        return INVALID_REFERENCE, None, None, None, None, None
+
+    chapter = None
+    verse = None
+
+    if tokens:
+        chapter_verse = tokens[0]
+        if ':' in chapter_verse:
+            chapter, verse = map(int, chapter_verse.split(':'))
+            prev_was_verse = True
+        else:
+            if book_number != prev_book or book_explicit:
+                chapter = int(chapter_verse)
+                verse = 1
+                prev_was_verse = False
+            elif prev_was_verse:
+                verse = int(chapter_verse)
+                chapter = prev_chapter
+            else:
+                chapter = int(chapter_verse)
+    else:
+        if book_number != prev_book or book_explicit:
+            chapter = 1
+            verse = 1
+        else:
+            if prev_chapter:
+                chapter = prev_chapter
+            else:
+                chapter = 1
+            if prev_verse:
+                verse = prev_verse
+            else:
+                verse = 1
+
+    if verse is None:
+        verse = 1
+
+    if chapter is None:
+        chapter = 1
+
+    if ':' in part:
+        end_chapter = chapter
+        end_verse = verse
+        prev_was_verse = True
+    else:
+        if book_number != prev_book or book_explicit:
+            if len(tokens) > 0:
+                end_chapter = chapter
+            else:
+                end_chapter = get_last_chapter(book_number, verses_count)
+            end_verse = get_last_verse(book_number, end_chapter, verses_count)
+        else:
+            if prev_was_verse:
+                end_chapter = chapter
+                end_verse = verse
+            else:
+                end_chapter = chapter
+                end_verse = get_last_verse(book_number, chapter, verses_count)
+                prev_was_verse = False
+
+    return book_number, chapter, verse, end_chapter, end_verse, prev_was_verse
+
+# Substitute semicolons with commas and the closest book name to the left
+def substitute_semicolons(reference):
+    parts = reference.split(';')
+    if len(parts) == 1:
+        return reference
+    def is_letter(char):
+        return unicodedata.category(char).startswith('L')
+    pattern = r'^\d*\w+'
+    book_names =[]
+    new_reference = ''
+    for index, part in enumerate(parts):
+        part = part.strip()
+        matches = re.findall(pattern, part)
+        filtered_matches = [match for match in matches if is_letter(match[-1])]
+        if filtered_matches:
+            book_names.append(filtered_matches[-1])
+            new_reference += f"{part}, "
+        else:
+            book_name = book_names[index-1]
+            book_names.append(book_name)
+            new_reference += f"{book_name} {part}, "
+    new_reference = new_reference.strip()[:-1]
+    return new_reference
+
+# Calculate the range
+def parse_range(reference, mapping, verses_count, abbrs_mapping, fuzzy=False):
+    reference = substitute_semicolons(reference)
+    parts = reference.split(',')
+    ranges = []
+    prev_end_book = prev_end_chapter = prev_end_verse = None
+    start_book = start_chapter = start_verse = end_book = end_chapter = end_verse = None
+    prev_was_verse = False
+    book_explicit = False
+
+    for part in parts:
+        subranges = part.split('-')
+        subrange_results = []
+
+        for i, subrange in enumerate(subranges):
+            if i == 0:
+                result = parse_reference_part(subrange, mapping, verses_count, abbrs_mapping, prev_end_book, prev_end_chapter, prev_end_verse, prev_was_verse, fuzzy=fuzzy)
+                if result[0] == INVALID_REFERENCE:
+                    return INVALID_REFERENCE
+                start_book, start_chapter, start_verse, end_chapter, end_verse, prev_was_verse = result
+            else:
+                if ' ' in subrange or subrange.isalpha():
+                    result = parse_reference_part(subrange, mapping, verses_count, abbrs_mapping, fuzzy=fuzzy)
+                    if result[0] == INVALID_REFERENCE:
+                        return INVALID_REFERENCE
+                    start_book, start_chapter, start_verse, end_chapter, end_verse, prev_was_verse = result
+                else:
+                    start_book = prev_end_book
+                    if ':' in subrange:
+                        chapter, verse = map(int, subrange.split(':'))
+                        start_chapter = end_chapter = chapter
+                        start_verse = end_verse = verse
+                        prev_was_verse = True
+                    else:
+                        number = int(subrange)
+                        if start_book != prev_end_book or book_explicit:
+                            start_chapter = number
+                            start_verse = 1
+                            end_chapter = get_last_chapter(start_book, verses_count)
+                            end_verse = get_last_verse(start_book, end_chapter, verses_count)
+                            prev_was_verse = False
+                        else:
+                            if prev_was_verse:
+                                start_chapter = prev_end_chapter
+                                start_verse = end_verse = number
+                            else:
+                                start_chapter = end_chapter = number
+                                start_verse = 1
+                                end_verse = get_last_verse(start_book, number, verses_count)
+                                prev_was_verse = False
+
+            subrange_results.append({
+                "start": {"book": start_book, "chapter": start_chapter, "verse": start_verse},
+                "end": {"book": start_book, "chapter": end_chapter, "verse": end_verse}
+            })
+            prev_end_book, prev_end_chapter, prev_end_verse = start_book, end_chapter, end_verse
+
+        if subrange_results:
+            ranges.append({
+                "start": subrange_results[0]["start"],
+                "end": subrange_results[-1]["end"]
+            })
+
+    return ranges
+
+# Characters dropped by normalize_book_name(), allowed anywhere inside a book name in scanned text
+BOOK_NAME_SEPARATORS = r'[\u0020\u00A0\u1680\u2000-\u200A\u202F\u205F\u3000\u200B\u200C\u200D\u2060\uFEFF.]'
+
+def build_alias_trie(mapping):
+    """Build a character trie over all normalized book names and abbreviations."""
+    trie = {}
+    for names in mapping.values():
+        for name in names:
+            if not name:
+                continue
+            node = trie
+            for char in name:
+                node = node.setdefault(char, {})
+            node[''] = True
+    return trie
+
+def trie_to_regex(node):
+    """Turn the alias trie into an equivalent regular expression so matching runs in the regex engine."""
+    alternatives = []
+    for char, child in sorted(node.items()):
+        if char == '':
+            continue
+        if child.keys() == {''}:
+            alternatives.append(re.escape(char))
+        else:
+            alternatives.append(re.escape(char) + BOOK_NAME_SEPARATORS + '*' + trie_to_regex(child))
+    if not alternatives:
+        return ''
+    pattern = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+    if '' in node:
+        pattern = f'(?:{pattern})?'
+    return pattern
+
+def build_scan_pattern(mapping):
+    """Compile the book name automaton followed by the chapter:verse grammar used by parse_range()."""
+    chapter_verse = r'\d+(?::\d+)?'
+    subrange = chapter_verse + r'(?:\s*[\u2010\u2013\u2014-]\s*' + chapter_verse + r')?'
+    reference = subrange + r'(?:\s*[,;]\s*' + subrange + r')*'
+    book = trie_to_regex(build_alias_trie(mapping))
+    return re.compile(rf'(?<!\w)(?P<book>{book}){BOOK_NAME_SEPARATORS}*(?P<chapters>{reference})(?![\d:])', re.IGNORECASE)
+
+def scan_references(lines, pattern):
+    """Find reference candidates in the text line by line.
+
+    Yields the start and end character offsets within the whole text, the matched string
+    and the same reference with the book name and numbers separated for parse_range().
+    Only capitalized book names are taken to avoid matching words like 'am' or 'is' in prose."""
+    offset = 0
+    for line in lines:
+        for match in pattern.finditer(line):
+            matched = match.group(0)
+            if matched[0].isalpha() and not matched[0].isupper():
+                continue
+            reference = f"{match.group('book')} {match.group('chapters')}"
+            yield offset + match.start(), offset + match.end(), matched, reference
+        offset += len(line)
+
+def format_canonical_range(range_):
+    """Format a range as book:chapter:verse-book:chapter:verse using MyBible book numbers."""
+    start = range_['start']
+    end = range_['end']
+    return f"{start['book']}:{start['chapter']}:{start['verse']}-{end['book']}:{end['chapter']}:{end['verse']}"
+
+def format_readable_range(range_, book_names):
+    """Format a range with the full book name, e.g. 'John 3:16-18' or 'Genesis 50:26-Exodus 1:2'."""
+    start = range_['start']
+    end = range_['end']
+    start_name = book_names.get(str(start['book']), [str(start['book'])])[0]
+    text = f"{start_name} {start['chapter']}:{start['verse']}"
+    if end['book'] != start['book']:
+        end_name = book_names.get(str(end['book']), [str(end['book'])])[0]
+        return f"{text}-{end_name} {end['chapter']}:{end['verse']}"
+    if end['chapter'] != start['chapter']:
+        return f"{text}-{end['chapter']}:{end['verse']}"
+    if end['verse'] != start['verse']:
+        return f"{text}-{end['verse']}"
+    return text
+
+class Versification:
+    """Dense ordinals of all verses in a module, built from per-chapter verse counts.
+
+    Verses are numbered from 0 in canonical order using prefix sums of the chapter
+    lengths, so the size of a range and the order of two verses are plain arithmetic."""
+
+    def __init__(self, verses_count):
+        self.chapters = []
+        self.offsets = []
+        self._chapter_index = {}
+        total = 0
+        for book in sorted(verses_count, key=int):
+            for chapter in sorted(verses_count[book], key=int):
+                key = (int(book), int(chapter))
+                self._chapter_index[key] = len(self.chapters)
+                self.chapters.append(key)
+                self.offsets.append(total)
+                total += verses_count[book][chapter]
+        # The extra offset makes the length of every chapter offsets[i + 1] - offsets[i]
+        self.offsets.append(total)
+        self.total = total
+
+    def first_ordinal(self, book, chapter, verse):
+        """Ordinal of the first verse at or after the position."""
+        i = self._chapter_index.get((book, chapter))
+        if i is None:
+            return self.offsets[bisect.bisect_left(self.chapters, (book, chapter))]
+        return min(self.offsets[i] + max(verse, 1) - 1, self.offsets[i + 1])
+
+    def last_ordinal(self, book, chapter, verse):
+        """Ordinal of the last verse at or before the position."""
+        i = self._chapter_index.get((book, chapter))
+        if i is None:
+            return self.offsets[bisect.bisect_left(self.chapters, (book, chapter))] - 1
+        return min(self.offsets[i] + verse, self.offsets[i + 1]) - 1
+
+    def bounds(self, range_):
+        """First and last ordinals of a range; the range is empty if first > last."""
+        start = range_['start']
+        end = range_['end']
+        return (self.first_ordinal(start['book'], start['chapter'], start['verse']),
+                self.last_ordinal(end['book'], end['chapter'], end['verse']))
+
+    def range_size(self, range_):
+        first, last = self.bounds(range_)
+        return max(0, last - first + 1)
+
+    def contains(self, range_, book, chapter, verse):
+        first, last = self.bounds(range_)
+        return first <= self.first_ordinal(book, chapter, verse) <= last
+
+    def location(self, ordinal):
+        """Book, chapter and verse numbers of the verse with the ordinal."""
+        i = bisect.bisect_right(self.offsets, ordinal) - 1
+        book, chapter = self.chapters[i]
+        return book, chapter, ordinal - self.offsets[i] + 1
+
+    def locate(self, ranges, offset):
+        """Find the verse offset verses into the ranges as (range index, (book, chapter, verse)).
+
+        Returns (len(ranges), None) if the ranges have fewer verses."""
+        for range_index, range_ in enumerate(ranges):
+            first, last = self.bounds(range_)
+            size = max(0, last - first + 1)
+            if offset < size:
+                return range_index, self.location(first + offset)
+            offset -= size
+        return len(ranges), None
+
+def normalize_ranges(ranges, versification, order='canonical'):
+    """Coalesce overlapping and adjacent ranges so that every verse is fetched only once.
+
+    With order='canonical' the result is sorted in Bible order. With order='request'
+    the ranges keep the order they were asked for, and each verse stays at the place
+    where it was first requested. Verses next to each other across a chapter or book
+    boundary count as adjacent according to the versification."""
+    def point_key(point):
+        return (point['book'], point['chapter'], point['verse'])
+
+    def touches(end, start):
+        # The next interval starts before or right after the verse that ends the previous one
+        return (start <= (end[0], end[1], end[2] + 1)
+                or versification.first_ordinal(*start) <= versification.last_ordinal(*end) + 1)
+
+    def insert_interval(merged, start, end):
+        """Insert into a sorted list of disjoint intervals, merging as needed."""
+        bisect.insort(merged, [start, end])
+        result = []
+        for interval in merged:
+            if result and touches(result[-1][1], interval[0]):
+                result[-1][1] = max(result[-1][1], interval[1])
+            else:
+                result.append(interval)
+        merged[:] = result
+
+    intervals = [(point_key(range_['start']), point_key(range_['end'])) for range_ in ranges]
+    intervals = [interval for interval in intervals if interval[0] <= interval[1]]
+
+    merged = []
+    if order == 'canonical':
+        for start, end in intervals:
+            insert_interval(merged, start, end)
+    elif order == 'request':
+        covered = []
+        for start, end in intervals:
+            # Cut out what earlier ranges already cover
+            pieces = []
+            piece_start = start
+            for covered_start, covered_end in covered:
+                if covered_start > end or covered_end < piece_start:
+                    continue
+                if covered_start > piece_start:
+                    pieces.append([piece_start, (covered_start[0], covered_start[1], covered_start[2] - 1)])
+                piece_start = (covered_end[0], covered_end[1], covered_end[2] + 1)
+            if piece_start <= end:
+                pieces.append([piece_start, end])
+            for piece in pieces:
+                if merged and piece[0] > merged[-1][1] and touches(merged[-1][1], piece[0]):
+                    merged[-1][1] = piece[1]
+                else:
+                    merged.append(piece)
+            insert_interval(covered, start, end)
+    else:
+        raise ValueError(f"Unknown order: {order}")
+
+    return [{
+        "start": {"book": start[0], "chapter": start[1], "verse": start[2]},
+        "end": {"book": end[0], "chapter": end[1], "verse": end[2]}
+    } for start, end in merged]
+
+def calculate_verses_in_range(ranges, allverses_data):
+    versification = allverses_data if isinstance(allverses_data, Versification) else Versification(allverses_data)
+    return [versification.range_size(range_) for range_ in ranges]
+
+def fetch_verses(conn, ranges):
+    """Yield (book_number, chapter, verse, text) rows for the ranges as they are read from the database."""
+    cur = conn.cursor()
+
+    def query_single_verse(book, chapter, verse):
+        cur.execute("""
+            SELECT book_number, chapter, verse, text
+            FROM verses
+            WHERE book_number=? AND chapter=? AND verse=?
+            ORDER BY book_number, chapter, verse
+        """, (book, chapter, verse))
+        return cur
+
+    def query_multi_verse(book, start_chapter, start_verse, end_chapter=None, end_verse=None):
+        if end_chapter is None:
+            end_chapter = start_chapter
+        if end_verse is None:
+            end_verse = start_verse
+
+        cur.execute("""
+            SELECT book_number, chapter, verse, text
+            FROM verses
+            WHERE book_number=? AND (chapter > ? OR (chapter = ? AND verse >= ?))
+            AND (chapter < ? OR (chapter = ? AND verse <= ?))
+            ORDER BY book_number, chapter, verse
+        """, (book, start_chapter, start_chapter, start_verse, end_chapter, end_chapter, end_verse))
+        return cur
+
+    def query_across_books(start, end):
+        cur.execute("""
+            SELECT book_number, chapter, verse, text
+            FROM verses
+            WHERE (book_number, chapter, verse) BETWEEN (?, ?, ?) AND (?, ?, ?)
+            ORDER BY book_number, chapter, verse
+        """, (start['book'], start['chapter'], start['verse'], end['book'], end['chapter'], end['verse']))
+        return cur
+
+    for range_ in ranges:
+        start = range_['start']
+        end = range_['end']
+
+        if start['book'] == end['book']:
+            yield from query_multi_verse(start['book'], start['chapter'], start['verse'], end['chapter'], end['verse'])
+        else:
+            # One index range scan from the start verse to the end verse, whatever books lie between
+            yield from query_across_books(start, end)
+
+def fetch_verses_from(conn, ranges, range_index, position=None, after=False, limit=-1):
+    """Yield (range index, row) pairs from a position in ranges[range_index] onwards.
+
+    Reading starts at position (or just after it), or at the start of the range if no
+    position is given, and continues through the following ranges. Each range is read
+    with a keyset query on verses_index, so a page deep into a long passage costs the
+    same as the first one."""
+    cur = conn.cursor()
+    for i in range(range_index, len(ranges)):
+        if limit == 0:
+            return
+        start = ranges[i]['start']
+        end = ranges[i]['end']
+        if i == range_index and position:
+            operator = '>' if after else '>='
+            start_key = tuple(position)
+        else:
+            operator = '>='
+            start_key = (start['book'], start['chapter'], start['verse'])
+        cur.execute(f"""
+            SELECT book_number, chapter, verse, text
+            FROM verses
+            WHERE (book_number, chapter, verse) {operator} (?, ?, ?)
+            AND (book_number, chapter, verse) <= (?, ?, ?)
+            ORDER BY book_number, chapter, verse
+            LIMIT ?
+        """, (*start_key, end['book'], end['chapter'], end['verse'], limit))
+        rows = cur.fetchall()
+        for row in rows:
+            yield i, row
+        if limit > 0:
+            limit -= len(rows)
+
+def get_ranges_key(ranges):
+    """Short hash of the ranges that ties a cursor to the reference it was issued for."""
+    return hashlib.sha1(','.join(format_canonical_range(range_) for range_ in ranges).encode('ascii')).hexdigest()[:8]
+
+def encode_cursor(ranges, range_index, book, chapter, verse):
+    """Encode the last delivered verse as an opaque continuation cursor."""
+    token = f"{get_ranges_key(ranges)}.{range_index}.{book}.{chapter}.{verse}"
+    return base64.urlsafe_b64encode(token.encode('ascii')).decode('ascii').rstrip('=')
+
+def decode_cursor(ranges, cursor):
+    """Return (range index, (book, chapter, verse)) from a cursor issued for the same ranges."""
+    try:
+        token = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        key, range_index, book, chapter, verse = token.split('.')
+        range_index, position = int(range_index), (int(book), int(chapter), int(verse))
+    except ValueError:
+        raise InvalidCursorError(cursor) from None
+    if key != get_ranges_key(ranges) or not 0 <= range_index < len(ranges):
+        raise InvalidCursorError(cursor)
+    return range_index, position
+
+def query_verses(module_path, ranges):
+    conn = connect_verses(module_path)
+    try:
+        return list(fetch_verses(conn, ranges))
+    finally:
+        conn.close()
+
+def get_range_condition(ranges, columns=('book_number', 'chapter', 'verse')):
+    """Return an SQL condition matching every verse in the ranges and its parameters."""
+    columns = ', '.join(columns)
+    condition = ' OR '.join([f'({columns}) BETWEEN (?, ?, ?) AND (?, ?, ?)'] * len(ranges))
+    params = []
+    for range_ in ranges:
+        start = range_['start']
+        end = range_['end']
+        params.extend([start['book'], start['chapter'], start['verse'], end['book'], end['chapter'], end['verse']])
+    return condition, params
+
+# Tables with section headings and the column with the title: 'stories' in Bible
+# modules, 'subheadings' in companion *.subheadings.SQLite3 modules
+HEADING_TABLES = {
+    'stories': 'title',
+    'subheadings': 'subheading',
+}
+
+def get_heading_tables(conn):
+    """Return (table, title column, order column) for each heading table of the module."""
+    tables = []
+    for table, title_column in HEADING_TABLES.items():
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if title_column not in columns:
+            title_column = 'title' if 'title' in columns else None
+        if title_column:
+            order_column = 'order_if_several' if 'order_if_several' in columns else 'rowid'
+            tables.append((table, title_column, order_column))
+    return tables
+
+def fetch_headings(conn, ranges, tables):
+    """Return (book_number, chapter, verse, title) rows of headings in the ranges in Bible order.
+
+    Each table is read with one query for all the ranges."""
+    if not ranges or not tables:
+        return []
+    condition, params = get_range_condition(ranges)
+    results = [conn.execute(f"""
+        SELECT book_number, chapter, verse, {title_column}
+        FROM {table}
+        WHERE {condition}
+        ORDER BY book_number, chapter, verse, {order_column}
+    """, params).fetchall() for table, title_column, order_column in tables]
+    return list(heapq.merge(*results, key=lambda row: row[:3]))
+
+def attach_headings(verses, headings):
+    """Yield verse rows with a fifth item: the list of headings that precede the verse.
+
+    headings must be sorted like fetch_headings() returns them. Verses and headings
+    are walked together in one pass; only when the verses go back (ranges kept in
+    request order) the position in the headings is found again by bisection.
+    Inline <h> headings of the verse text come after those from the tables."""
+    keys = [tuple(heading[:3]) for heading in headings]
+    i = 0
+    previous = None
+    for row in verses:
+        key = tuple(row[:3])
+        if previous is not None and key < previous:
+            i = bisect.bisect_left(keys, key)
+        previous = key
+        while i < len(keys) and keys[i] < key:
+            i += 1
+        titles = []
+        j = i
+        while j < len(keys) and keys[j] == key:
+            titles.append(headings[j][3])
+            j += 1
+        if '<h>' in row[3]:
+            titles.extend(re.findall(r'<h>([^>]*)</h>', row[3]))
+        if titles:
+            titles = [zap_full(title) for title in dict.fromkeys(titles) if title]
+        yield (*row[:4], titles)
+
+def format_output(format_string, data, book_names, module_name):
+    # Define the mapping for known format specifiers
+    book_number = data[0]
+    chapter = data[1]
+    verse = data[2]
+    raw_text = data[3]
+    format_map = {
+        '%b': book_number,
+        '%c': chapter,
+        '%v': verse,
+        '%T': raw_text,
+        '%m': module_name
+    }
+
+    # Replace format specifiers in the format_string
+    result = format_string
+    for key, value in format_map.items():
+        if key in result:
+            result = result.replace(key, str(value))
+
+    names = book_names.get(str(book_number), [str(book_number), str(book_number)])
+    # Handle custom format specifiers
+    result = result.replace('%f', names[0] or str(book_number))  # full book name
+    result = result.replace('%a', names[1] or str(book_number))  # abbreviated book name
+    result = result.replace('%z', zap_full(raw_text))
+    result = result.replace('%t', zap_text(raw_text))
+    result = result.replace('%A', ansi_format_text(raw_text))
+    result = result.replace('%Z', ansi_format_no_strong(raw_text))
+    # Headings before the verse, one per line; rows without the headings item have none
+    result = result.replace('%h', ''.join(f"{title}\n" for title in (data[4] if len(data) > 4 else [])))
+    result = re.sub(r'\\t', '\t', result)
+    result = re.sub(r'\\n', '\n', result)
+
+    return result
+
+def load_book_names(abbrs_file_path):
+    """Load full and short book names of the module keyed by book number."""
+    with open(abbrs_file_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def remove_ansi_esc_seq(string):
+    ansi_escape = re.compile(r'\x1B\[[0-9;]*[mK]')
+    return ansi_escape.sub('', string)
+
+def zap_text(string):
+    """Remove everything from the verse except the actual biblical text"""
+    paragraph_break = r'<pb/>'
+    line_break = r'<br/>'
+    strong_numbers = r'<([SGH])>[^>]*</\1>'
+    j_words = r'</?J>'
+    note_markers = r'</?n>'
+    emph_markers = r'</?e>'
+    insert_markers = r'</?i>'
+    footnotes = r'<f>\[[^\]]*\]</f>'
+    headings = r'<h>[^>]*</h>'
+    indent_end = r'</t>'
+    indent_begin = r'<t>'
+
+    string = re.sub(paragraph_break, '\n', string).strip()
+    string = re.sub(line_break, '\n', string).strip()
+    string = re.sub(strong_numbers, '', string)
+    string = re.sub(j_words, '', string)
+    string = re.sub(note_markers, '', string)
+    string = re.sub(emph_markers, '', string)
+    string = re.sub(insert_markers, '', string)
+    string = re.sub(footnotes, '', string)
+    string = re.sub(headings, '', string)
+    string = re.sub(indent_end, '', string)
+    string = re.sub(indent_begin, '\n    ', string)
+
+    return string
+
+def zap_full(string):
+    string =  zap_text(string)
+
+    notes = r'\{[^}]*\}'
+    line_break = r'\n'
+    multiple_spaces =r'\s+'
+
+    string = re.sub(notes, '', string)
+    string = re.sub(line_break, '', string)
+    string = re.sub(multiple_spaces, ' ', string)
+
+    return string.strip()
+
+def ansi_format_text(string):
+    """Format text with ANSI escape sequences for pretty console output"""
+    paragraph_break = r'<pb/>'
+    line_break = r'<br/>'
+    strong_begin = r'<([SGH])>'
+    strong_end = r'</[SGH]>'
+    j_words_begin = r'<J>'
+    j_words_end = r'</J>'
+    note_begin = r'<n>'
+    note_end = r'</n>'
+    emph_begin = r'<e>'
+    emph_end = r'</e>'
+    insert_begin = r'<i>'
+    insert_end = r'</i>'
+    footnotes = r'<f>\[\d+\]</f>'
+    headings = r'<h>[^>]*</h>'
+    indent_end = r'</t>'
+    indent_begin = r'<t>'
+
+    string = re.sub(paragraph_break, '\n', string).strip()
+    string = re.sub(line_break, '\n', string).strip()
+    string = re.sub(strong_begin, rf'{start_lightblue}{start_italics}<\1', string)
+    string = re.sub(strong_end, f'>{reset_to_normal}', string)
+    string = re.sub(j_words_begin, f'{start_red}', string)
+    string = re.sub(j_words_end, f'{reset_to_normal}', string)
+    string = re.sub(note_begin, f'{start_lightgrey}{start_italics}', string)
+    string = re.sub(note_end, f'{reset_to_normal}', string)
+    string = re.sub(emph_begin, f'{start_bold}', string)
+    string = re.sub(emph_end, f'{reset_to_normal}', string)
+    string = re.sub(insert_begin, f'{start_italics}', string)
+    string = re.sub(insert_end, f'{reset_to_normal}', string)
+    string = re.sub(footnotes, '', string)
+    string = re.sub(headings, '', string)
+    string = re.sub(indent_end, '', string)
+    string = re.sub(indent_begin, '\n    ', string)
+
+    return string
+
+def ansi_format_no_strong(string):
+    """Remove Strong's numbers from console output with ANSI escape sequences"""
+    string = ansi_format_text(string)
+    strong_number = re.compile(r'\x1B\[94m\x1B\[3m<[SGH][^>]*>\x1B\[0m')
+
+    string = strong_number.sub('', string)
+
+    return string
+
+class InvalidReferenceError(ValueError):
+    """Raised when a reference cannot be resolved in a module."""
+
+class InvalidCursorError(ValueError):
+    """Raised when a continuation cursor is malformed or was issued for another reference."""
+
+class UnknownMappingError(LookupError):
+    """Raised when no mapping file of the configuration folder has the requested prefix."""
+
+# Brackets and punctuation around a reference copied from a text
+def clean_reference(reference):
+    reference = replace_funny_spaces(reference).lower()
+    return re.sub(r'[\[\(<]+|[\.,:\-–—\]\)>]+$', '', reference)
+
+# Names of in-memory databases are unique within the process
+memory_database_ids = itertools.count(1)
+
+class BibleModule:
+    """A MyBible module opened for repeated lookups.
+
+    Versification, book names and the book mapping are loaded on first use and
+    kept until the handle is closed. Connections are pooled, so a handle can be
+    shared by several threads. load_into_memory() moves lookups to an in-memory
+    copy of the module."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = get_module_name(path)
+        self._lock = threading.RLock()
+        self._idle_connections = []
+        self._verses_count = None
+        self._versification = None
+        self._verse_hashes = None
+        self._heading_tables = None
+        self._abbrs_file_path = None
+        self._book_names = None
+        self._abbrs_mapping = None
+        # (fingerprint of the mapping file, mapping)
+        self._mapping = None
+        # (URI, connection keeping the database alive, size in bytes) while loaded into memory
+        self._memory = None
+        # Where each open connection reads from: None for the module file, or the in-memory database URI
+        self._connection_sources = {}
+        # Set by close(); connections released after that are closed instead of pooled
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def fingerprint(self):
+        return get_module_fingerprint(self.path)
+
+    @property
+    def verses_count(self):
+        """Number of verses in each chapter of each book."""
+        with self._lock:
+            if self._verses_count is None:
+                self._verses_count = load_verses_count(ensure_allverses_file(self.name, self.path))
+            return self._verses_count
+
+    @property
+    def verse_hashes(self):
+        """Hashes of each verse and chapter, cached next to the other module data."""
+        with self._lock:
+            if self._verse_hashes is None:
+                self._verse_hashes = ensure_verse_hashes(self.name, self.path)
+            return self._verse_hashes
+
+    @property
+    def versification(self):
+        """Verse ordinals for constant-time range sizes."""
+        with self._lock:
+            if self._versification is None:
+                self._versification = Versification(self.verses_count)
+            return self._versification
+
+    def normalize(self, ranges, order='canonical'):
+        """Merge overlapping and adjacent ranges, sorted in Bible order or kept in request order."""
+        return normalize_ranges(ranges, self.versification, order)
+
+    def count_verses(self, ranges):
+        """Number of verses in each range, computed without querying the module."""
+        return calculate_verses_in_range(ranges, self.versification)
+
+    @property
+    def abbrs_file_path(self):
+        with self._lock:
+            if self._abbrs_file_path is None:
+                self._abbrs_file_path = ensure_abbrs_file(self.name, self.path)
+            return self._abbrs_file_path
+
+    @property
+    def book_names(self):
+        """Full and short book names from the module keyed by book number."""
+        with self._lock:
+            if self._book_names is None:
+                self._book_names = load_book_names(self.abbrs_file_path)
+            return self._book_names
+
+    @property
+    def abbrs_mapping(self):
+        """Book mapping built from the module's own book names."""
+        with self._lock:
+            if self._abbrs_mapping is None:
+                self._abbrs_mapping = load_mapping(self.abbrs_file_path)
+            return self._abbrs_mapping
+
+    @property
+    def mapping(self):
+        """Default book mapping used to resolve references, loaded again when the mapping file changes."""
+        with self._lock:
+            ensure_book_mapping_exists(BOOKMAPPING_FILE)
+            fingerprint = get_module_fingerprint(BOOKMAPPING_FILE)
+            if self._mapping is None or self._mapping[0] != fingerprint:
+                self._mapping = (fingerprint, load_mapping(BOOKMAPPING_FILE))
+            return self._mapping[1]
+
+    def acquire_connection(self):
+        """Take an idle connection from the pool or open a new one."""
+        with self._lock:
+            if self._idle_connections:
+                return self._idle_connections.pop()
+            source = self._memory[0] if self._memory else None
+        if source:
+            conn = set_text_encoding(sqlite3.connect(source, uri=True, check_same_thread=False), get_module_encoding(self.path))
+        else:
+            conn = connect_verses(self.path, check_same_thread=False)
+        with self._lock:
+            self._connection_sources[conn] = source
+        return conn
+
+    def release_connection(self, conn):
+        with self._lock:
+            # Connections opened before the module was loaded into or dropped from memory are not reused,
+            # and neither are those of a closed handle (e.g. one dropped by ModuleRegistry.refresh())
+            if not self._closed and self._connection_sources.get(conn) == (self._memory[0] if self._memory else None):
+                self._idle_connections.append(conn)
+                return
+            self._connection_sources.pop(conn, None)
+        conn.close()
+
+    @property
+    def memory_size(self):
+        """Bytes taken by the in-memory copy of the module, 0 if it is read from disk."""
+        memory = self._memory
+        return memory[2] if memory else 0
+
+    def load_into_memory(self):
+        """Copy the module into an in-memory database and read it from there; return the size of the copy.
+
+        The copy is made with SQLite's backup API and shared by all connections of
+        the handle. A module without a verse index gets one in the copy."""
+        with self._lock:
+            if self._memory:
+                return self._memory[2]
+        uri = f"file:mybible-{next(memory_database_ids)}?mode=memory&cache=shared"
+        holder = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        try:
+            source = open_module_file(self.path)
+            try:
+                source.backup(holder)
+            finally:
+                source.close()
+            if not is_verses_indexed(self.path):
+                holder.execute("CREATE INDEX verses_memory_index ON verses(book_number, chapter, verse)")
+                holder.commit()
+            size = holder.execute("PRAGMA page_count").fetchone()[0] * holder.execute("PRAGMA page_size").fetchone()[0]
+        except BaseException:
+            holder.close()
+            raise
+        with self._lock:
+            if self._memory:
+                # Another thread was quicker
+                holder.close()
+                return self._memory[2]
+            self._memory = (uri, holder, size)
+            connections, self._idle_connections = self._idle_connections, []
+            for conn in connections:
+                self._connection_sources.pop(conn, None)
+        for conn in connections:
+            conn.close()
+        return size
+
+    def unload_from_memory(self):
+        """Drop the in-memory copy and read the module from disk again."""
+        with self._lock:
+            memory, self._memory = self._memory, None
+            if memory is None:
+                return
+            connections = [conn for conn in self._idle_connections if self._connection_sources.get(conn) == memory[0]]
+            self._idle_connections = [conn for conn in self._idle_connections if conn not in connections]
+            for conn in connections:
+                self._connection_sources.pop(conn, None)
+        for conn in connections:
+            conn.close()
+        # The memory is freed when connections still in use are released
+        memory[1].close()
+
+    def info(self, field_name):
+        return get_info(self.path, field_name)
+
+    def resolve(self, reference, mapping=None, fuzzy=False):
+        """Resolve a reference to a list of ranges, using the default book mapping unless another compiled mapping is given.
+
+        With fuzzy, misspelled book names are corrected (see match_book_name())."""
+        try:
+            ranges = parse_range(clean_reference(reference), mapping or self.mapping, self.verses_count, self.abbrs_mapping, fuzzy)
+        except (ValueError, KeyError) as e:
+            raise InvalidReferenceError(reference) from e
+        if ranges == INVALID_REFERENCE:
+            raise InvalidReferenceError(reference)
+        return ranges
+
+    def iter_verses(self, ranges):
+        """Yield (book_number, chapter, verse, text) rows for the ranges."""
+        conn = self.acquire_connection()
+        try:
+            yield from fetch_verses(conn, ranges)
+        finally:
+            self.release_connection(conn)
+
+    def headings(self, ranges, subheadings=None):
+        """Return (book_number, chapter, verse, title) headings in the ranges in Bible order.
+
+        Headings come from the module's own stories table and, if given, from a
+        companion SubheadingsModule; each source is read with one query."""
+        conn = self.acquire_connection()
+        try:
+            with self._lock:
+                if self._heading_tables is None:
+                    self._heading_tables = get_heading_tables(conn)
+            headings = fetch_headings(conn, ranges, self._heading_tables)
+        finally:
+            self.release_connection(conn)
+        if subheadings is not None:
+            headings = list(heapq.merge(headings, subheadings.headings(ranges), key=lambda row: row[:3]))
+        return headings
+
+    def with_headings(self, verses, ranges, subheadings=None):
+        """Yield the verse rows read for the ranges with the list of their headings as a fifth item."""
+        return attach_headings(verses, self.headings(ranges, subheadings))
+
+    def verses_by_range(self, ranges):
+        """Return the rows of each range as a separate list, read in a single pass."""
+        verses = [[] for _ in ranges]
+        conn = self.acquire_connection()
+        try:
+            for range_index, row in fetch_verses_from(conn, ranges, 0):
+                verses[range_index].append(row)
+        finally:
+            self.release_connection(conn)
+        return verses
+
+    def page(self, ranges, limit, offset=0, cursor=None):
+        """Return one page of verses as (rows, total, next_cursor).
+
+        The page starts right after the verse encoded in the cursor, or offset verses
+        into the ranges if there is no cursor. total is the size of the whole reference
+        and next_cursor is None on the last page. limit must be at least 1."""
+        if limit < 1:
+            raise ValueError(f"Page size must be at least 1: {limit}")
+        total = sum(self.count_verses(ranges))
+        if cursor:
+            range_index, position = decode_cursor(ranges, cursor)
+            after = True
+        else:
+            range_index, position = self.versification.locate(ranges, offset)
+            after = False
+        conn = self.acquire_connection()
+        try:
+            # One extra row tells whether there is a next page
+            rows = list(fetch_verses_from(conn, ranges, range_index, position, after, limit + 1))
+        finally:
+            self.release_connection(conn)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last_range_index, last_row = rows[-1]
+            next_cursor = encode_cursor(ranges, last_range_index, *last_row[:3])
+        return [row for _, row in rows], total, next_cursor
+
+    def render(self, verses, format_string=DEFAULT_FORMAT_STRING, noansi=False):
+        """Yield each verse formatted with the %-prefixed format string."""
+        for verse in verses:
+            formatted_output = format_output(format_string, verse, self.book_names, self.name)
+            if noansi:
+                formatted_output = remove_ansi_esc_seq(formatted_output)
+            yield formatted_output
+
+    def close(self):
+        """Close idle connections and drop the in-memory copy; connections in use are closed when released."""
+        self.unload_from_memory()
+        with self._lock:
+            self._closed = True
+            connections, self._idle_connections = self._idle_connections, []
+            for conn in connections:
+                self._connection_sources.pop(conn, None)
+        for conn in connections:
+            conn.close()
+
+def get_crossreferences_index_path(module_path):
+    """Return the path to the SQLite file with an indexed copy of a cross-references module."""
+    index_dir = os.path.join(get_default_config_path(), 'moduledata')
+    os.makedirs(index_dir, exist_ok=True)
+    return os.path.join(index_dir, f"{get_module_name(module_path)}.index.sqlite3")
+
+def has_source_index(conn):
+    """Check if SQLite can look cross-references up by source verse with an index."""
+    plan = conn.execute("""
+        EXPLAIN QUERY PLAN
+        SELECT * FROM cross_references WHERE book=? AND chapter=? AND verse>=?
+    """, (0, 0, 0)).fetchall()
+    return any('INDEX' in row[-1] and 'book=' in row[-1] for row in plan)
+
+def build_crossreferences_index(module_path, index_path):
+    """Copy the cross_references table into a sidecar database indexed by source verse."""
+    source = open_module_file(module_path)
+    try:
+        columns = {row[1] for row in source.execute("PRAGMA table_info(cross_references)")}
+        votes = 'votes' if 'votes' in columns else '0'
+        rows = source.execute(f"""
+            SELECT book, chapter, verse, verse_end, book_to, chapter_to, verse_to_start, verse_to_end, {votes}
+            FROM cross_references
+        """)
+        temp_path = f"{index_path}.{os.getpid()}.part"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        index = sqlite3.connect(temp_path)
+        try:
+            index.execute("""
+                CREATE TABLE cross_references(book numeric, chapter numeric, verse numeric, verse_end numeric,
+                    book_to numeric, chapter_to numeric, verse_to_start numeric, verse_to_end numeric, votes numeric)
+            """)
+            index.executemany("INSERT INTO cross_references VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            index.execute("CREATE INDEX cross_references_source ON cross_references(book, chapter, verse)")
+            index.execute("CREATE TABLE info(name text, value text)")
+            index.execute("INSERT INTO info VALUES ('fingerprint', ?)", (get_module_fingerprint(module_path),))
+            index.commit()
+        finally:
+            index.close()
+    finally:
+        source.close()
+    os.replace(temp_path, index_path)
+
+class CrossReferencesModule:
+    """A MyBible cross-references module (*.crossreferences.SQLite3).
+
+    Lookups go to the module itself if it has an index on the source verse, and
+    otherwise to an indexed copy built once per module fingerprint."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = get_module_kind_name(path)
+        self._lock = threading.RLock()
+        self._conn = None
+        # Column (or constant) read as votes: modules without the column are read with 0 votes
+        self._votes = None
+        # Whether the source of a cross-reference can span several verses (the verse_end column)
+        self._has_verse_end = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _open_index(self, index_path):
+        """Open the indexed copy of the module if it was made from the current module file."""
+        if not os.path.exists(index_path):
+            return None
+        conn = sqlite3.connect(index_path, check_same_thread=False)
+        fingerprint = conn.execute("SELECT value FROM info WHERE name='fingerprint'").fetchone()
+        if not fingerprint or fingerprint[0] != get_module_fingerprint(self.path):
+            conn.close()
+            return None
+        return conn
+
+    def connection(self):
+        with self._lock:
+            if self._conn is None:
+                conn = open_module_file(self.path, check_same_thread=False)
+                if not has_source_index(conn):
+                    conn.close()
+                    index_path = get_crossreferences_index_path(self.path)
+                    conn = self._open_index(index_path)
+                    if conn is None:
+                        with file_lock(index_path):
+                            # Another process may have built the index while this one waited
+                            conn = self._open_index(index_path)
+                            if conn is None:
+                                build_crossreferences_index(self.path, index_path)
+                                conn = sqlite3.connect(index_path, check_same_thread=False)
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(cross_references)")}
+                self._votes = 'votes' if 'votes' in columns else '0'
+                self._has_verse_end = 'verse_end' in columns
+                self._conn = conn
+            return self._conn
+
+    def lookup(self, ranges):
+        """Return cross-references from every verse in the ranges, found with one query.
+
+        Each item is a dict with 'source' (book, chapter, verse), the 'target' range in
+        the same form as parse_range() returns and 'votes'. Items are sorted by source
+        verse and then by votes, most voted first. A source spanning several verses
+        (verse to verse_end) is found from any of them; its 'source' is its first verse."""
+        if not ranges:
+            return []
+        conditions, params = get_range_condition(ranges, ('book', 'chapter', 'verse'))
+        with self._lock:
+            conn = self.connection()
+            if self._has_verse_end:
+                # Sources starting inside a range are matched above; a span starting before a range covers its first verse
+                conditions += ''.join(' OR (book=? AND chapter=? AND verse<? AND verse_end>=?)' for _ in ranges)
+                for range_ in ranges:
+                    start = range_['start']
+                    params.extend([start['book'], start['chapter'], start['verse'], start['verse']])
+            rows = conn.execute(f"""
+                SELECT book, chapter, verse, book_to, chapter_to, verse_to_start, verse_to_end, {self._votes} AS votes
+                FROM cross_references
+                WHERE {conditions}
+                ORDER BY book, chapter, verse, votes DESC
+            """, params).fetchall()
+        return [{
+            'source': {'book': book, 'chapter': chapter, 'verse': verse},
+            'target': {
+                'start': {'book': book_to, 'chapter': chapter_to, 'verse': verse_to_start},
+                'end': {'book': book_to, 'chapter': chapter_to, 'verse': verse_to_end or verse_to_start},
+            },
+            'votes': votes,
+        } for book, chapter, verse, book_to, chapter_to, verse_to_start, verse_to_end, votes in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._votes = None
+                self._has_verse_end = False
+
+class SubheadingsModule:
+    """A MyBible subheadings module (*.subheadings.SQLite3) with section headings for a Bible module of the same name."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = get_module_kind_name(path)
+        self._lock = threading.RLock()
+        self._conn = None
+        self._tables = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def headings(self, ranges):
+        """Return (book_number, chapter, verse, title) headings in the ranges in Bible order."""
+        with self._lock:
+            if self._conn is None:
+                self._conn = connect_module(self.path, check_same_thread=False)
+                self._tables = get_heading_tables(self._conn)
+            return fetch_headings(self._conn, ranges, self._tables)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+STRONG_NUMBER_PATTERN = re.compile(r'<([SGH])>([^<]*)</\1>')
+
+def normalize_strong_number(number, book_number, prefix=None):
+    """Return a Strong's number as 'H7225' or 'G25'.
+
+    Numbers without a letter get the module's strong_numbers_prefix, or H in the
+    Old Testament and G in the New Testament."""
+    number = number.strip().upper()
+    if number[:1] in ('H', 'G'):
+        prefix, number = number[0], number[1:]
+    elif not prefix:
+        prefix = 'H' if book_number < 470 else 'G'
+    return f"{prefix}{number.lstrip('0') or '0'}"
+
+def collect_strong_numbers(verses, prefix=None):
+    """Return the distinct Strong's numbers of the verse rows in the order they first appear."""
+    numbers = {}
+    for row in verses:
+        for tag, number in STRONG_NUMBER_PATTERN.findall(row[3]):
+            if number.strip():
+                numbers[normalize_strong_number(number, row[0], tag if tag != 'S' else prefix)] = None
+    return list(numbers)
+
+def strip_html(string):
+    """Remove HTML tags of dictionary definitions and collapse white space."""
+    return re.sub(r'\s+', ' ', re.sub(r'<[^>]+>', ' ', string or '')).strip()
+
+class DictionaryModule:
+    """A MyBible dictionary module (*.dictionary.SQLite3), used as a lexicon of Strong's numbers.
+
+    Entries are kept in an LRU cache, so numbers repeated across requests are not
+    looked up again; the numbers missing from it are resolved with one query."""
+
+    # Number of entries kept in the cache of each module
+    cache_size = 4096
+    # Numbers per query: each binds two topics (H430 and H0430), which must stay within
+    # the limit of 999 parameters of SQLite builds before 3.32
+    batch_size = 999 // 2
+
+    def __init__(self, path):
+        self.path = path
+        self.name = get_module_kind_name(path)
+        self._lock = threading.RLock()
+        self._conn = None
+        self._columns = None
+        self._cache = collections.OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connection(self):
+        with self._lock:
+            if self._conn is None:
+                self._conn = connect_module(self.path, check_same_thread=False)
+                self._columns = {row[1] for row in self._conn.execute("PRAGMA table_info(dictionary)")}
+            return self._conn
+
+    def lookup(self, numbers):
+        """Return {number: entry} for the Strong's numbers found in the dictionary.
+
+        An entry is a dict with 'topic', 'gloss' and, if the module has them,
+        'lexeme' and 'transliteration'."""
+        with self._lock:
+            missing = [number for number in dict.fromkeys(numbers) if number not in self._cache]
+            for i in range(0, len(missing), self.batch_size):
+                self._cache.update(self._fetch(missing[i:i + self.batch_size]))
+            entries = {}
+            for number in numbers:
+                if number in self._cache:
+                    self._cache.move_to_end(number)
+                    if self._cache[number] is not None:
+                        entries[number] = self._cache[number]
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return entries
+
+    def _fetch(self, numbers):
+        """Look the numbers up with one IN (...) query; numbers not found map to None."""
+        conn = self.connection()
+        # Topics are written both as H430 and H0430 in different dictionaries
+        topics = {}
+        for number in numbers:
+            topics[number] = number
+            topics[f"{number[0]}{number[1:].zfill(4)}"] = number
+        columns = ['topic', 'definition'] + [column for column in ('lexeme', 'transliteration', 'short_definition') if column in self._columns]
+        placeholders = ','.join('?' * len(topics))
+        rows = conn.execute(f"SELECT {', '.join(columns)} FROM dictionary WHERE topic IN ({placeholders})", list(topics)).fetchall()
+        entries = dict.fromkeys(numbers)
+        for row in rows:
+            values = dict(zip(columns, row))
+            number = topics[values['topic']]
+            if entries[number] is not None:
+                continue
+            entry = {'topic': values['topic']}
+            for column in ('lexeme', 'transliteration'):
+                if values.get(column):
+                    entry[column] = values[column].strip()
+            entry['gloss'] = strip_html(values.get('short_definition') or values['definition'])
+            entries[number] = entry
+        return entries
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+def lookup_strong_numbers(numbers, dictionaries):
+    """Resolve Strong's numbers with several dictionary modules; the first one that has a number wins."""
+    entries = {}
+    for dictionary in dictionaries:
+        missing = [number for number in numbers if number not in entries]
+        if not missing:
+            break
+        for number, entry in dictionary.lookup(missing).items():
+            entries[number] = dict(entry, dictionary=dictionary.name)
+    return {number: entries[number] for number in numbers if number in entries}
+
+def format_lexicon_entry(number, entry, max_length=160):
+    """Format a lexicon entry as a one-line footnote."""
+    head = ' '.join(value for value in (entry.get('lexeme'), f"({entry['transliteration']})" if entry.get('transliteration') else None) if value)
+    gloss = entry['gloss']
+    if len(gloss) > max_length:
+        gloss = gloss[:max_length].rstrip() + '…'
+    return f"[{number}] {head}: {gloss}" if head else f"[{number}] {gloss}"
+
+def get_plan_index_path(module_name):
+    """Return the path to the JSON file with the day index of a reading plan module."""
+    index_dir = os.path.join(get_default_config_path(), 'moduledata')
+    os.makedirs(index_dir, exist_ok=True)
+    return os.path.join(index_dir, f"{module_name}.days.json")
+
+def iter_plan_readings(module_path):
+    """Yield (day, evening, book_number, start_chapter, start_verse, end_chapter, end_verse) rows of a plan in reading order.
+
+    Missing chapters and verses are None: the whole book, chapter or the rest of it."""
+    conn = open_module_file(module_path)
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(reading_plan)")}
+        evening = 'evening' if 'evening' in columns else '0'
+        item = 'item' if 'item' in columns else 'rowid'
+        yield from conn.execute(f"""
+            SELECT day, {evening}, book_number, start_chapter, start_verse, end_chapter, end_verse
+            FROM reading_plan
+            ORDER BY day, {evening}, {item}
+        """)
+    finally:
+        conn.close()
+
+def build_plan_index(module_path):
+    """Group the readings of a plan by day: {'day': [[evening, book, start chapter, start verse, end chapter, end verse], ...]}."""
+    days = {}
+    for day, evening, *reading in iter_plan_readings(module_path):
+        days.setdefault(str(day), []).append([1 if evening else 0, *reading])
+    return days
+
+def ensure_plan_index(module_name, module_path):
+    """Load the day index of the plan, building it again if the module has changed."""
+    return ensure_fingerprinted_json(get_plan_index_path(module_name), get_module_fingerprint(module_path),
+                                     'days', lambda: build_plan_index(module_path))
+
+def plan_readings_to_ranges(readings, verses_count):
+    """Turn plan readings into ranges of a Bible module; books the module doesn't have are skipped."""
+    ranges = []
+    for _, book_number, start_chapter, start_verse, end_chapter, end_verse in readings:
+        if str(book_number) not in verses_count:
+            continue
+        if not start_chapter:
+            start_chapter, end_chapter = 1, get_last_chapter(book_number, verses_count)
+        end_chapter = end_chapter or start_chapter
+        ranges.append({
+            'start': {'book': book_number, 'chapter': start_chapter, 'verse': start_verse or 1},
+            'end': {'book': book_number, 'chapter': end_chapter, 'verse': end_verse or get_last_verse(book_number, end_chapter, verses_count)},
+        })
+    return ranges
+
+class PlanModule:
+    """A MyBible reading plan module (*.plan.SQLite3).
+
+    Readings are grouped by day into an index kept next to the other module data,
+    so looking a day up doesn't read the plan table."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = get_module_kind_name(path)
+        self._lock = threading.RLock()
+        self._days = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def days(self):
+        with self._lock:
+            if self._days is None:
+                self._days = ensure_plan_index(get_module_name(self.path), self.path)
+            return self._days
+
+    @property
+    def length(self):
+        """Number of days in the plan."""
+        return max((int(day) for day in self.days), default=0)
+
+    def day_for_date(self, date):
+        """Return the day of the plan for a date, counting from January 1 and starting over after the last day."""
+        return (date.timetuple().tm_yday - 1) % max(self.length, 1) + 1
+
+    def readings(self, day):
+        """Return [evening, book, start chapter, start verse, end chapter, end verse] readings of the day."""
+        return self.days.get(str(day), [])
+
+    def iter_days(self):
+        """Yield (day, evening, readings) for the whole plan, read from the module in one pass."""
+        for (day, evening), rows in itertools.groupby(iter_plan_readings(self.path), key=lambda row: (row[0], bool(row[1]))):
+            yield day, evening, [[1 if evening else 0, *row[2:]] for row in rows]
+
+    def close(self):
+        pass
+
+class ModuleRegistry:
+    """MyBible modules found in one or more folders, looked up by type and case-insensitive name.
+
+    Names are indexed once; refresh() re-lists only the folders whose modification
+    time changed. When the same name exists in several folders, the first folder
+    wins and the other paths are kept in collisions. Handles returned by get() are
+    cached, so a long-running process opens each module only once; a ModuleWatcher
+    keeps them current when modules are added or replaced.
+
+    With a memory_budget (in bytes), Bible modules are loaded into memory in the
+    background after their first use. When the budget is full, the modules used
+    least often, and of those the least recently used, are dropped from memory to
+    make room; stats() reports the accounting."""
+
+    def __init__(self, paths, memory_budget=0):
+        if isinstance(paths, str):
+            paths = split_modules_path(paths)
+        self.paths = list(paths)
+        self.memory_budget = memory_budget
+        # (kind, key) -> [number of get() calls, time of the last one]
+        self._accesses = {}
+        self._preloading = set()
+        self._preloader = None
+        self.memory_events = {'loads': 0, 'evictions': 0, 'skipped': 0}
+        self._lock = threading.RLock()
+        self._folder_mtimes = {}
+        self._folder_files = {}
+        self._indexes = {}
+        self.collisions = {}
+        self._files = {}
+        self._modules = {}
+        self._fingerprints = {}
+        self._alias_index = None
+        self.refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def refresh(self, paths=()):
+        """Pick up modules added, removed or replaced since the last call and return the changes.
+
+        Each change is a tuple (event, kind, name, path) with event 'added', 'removed'
+        or 'changed'. Only folders whose modification time changed are listed again,
+        and only modules with open handles are checked for a new fingerprint, so a
+        call costs a few stat() calls however many modules there are. Files known to
+        have been written (paths, e.g. from inotify) are reported as changed too.
+        Handles of removed or replaced modules are closed and dropped together with
+        their cached data and pooled connections."""
+        with self._lock:
+            changes = []
+            folders_changed = False
+            for folder in self.paths:
+                try:
+                    mtime = os.stat(folder).st_mtime_ns
+                except OSError:
+                    mtime = None
+                if folder in self._folder_mtimes and self._folder_mtimes[folder] == mtime:
+                    continue
+                self._folder_mtimes[folder] = mtime
+                self._folder_files[folder] = find_sqlite_files(folder) if mtime is not None else []
+                folders_changed = True
+
+            if folders_changed:
+                # Modules of each type are indexed separately, so 'KJV' and 'KJV.crossreferences' don't clash
+                indexes = {}
+                collisions = {}
+                for folder in self.paths:
+                    for file in self._folder_files[folder]:
+                        kind = get_module_kind(file)
+                        index = indexes.setdefault(kind, {})
+                        key = get_module_kind_name(file).lower()
+                        module_path = os.path.join(folder, file)
+                        if key in index:
+                            if kind == 'bible':
+                                collisions.setdefault(key, [index[key]]).append(module_path)
+                        else:
+                            index[key] = module_path
+                for kind in sorted(self._indexes.keys() | indexes.keys()):
+                    old_index = self._indexes.get(kind, {})
+                    new_index = indexes.get(kind, {})
+                    for key in sorted(old_index.keys() | new_index.keys()):
+                        old_path = old_index.get(key)
+                        new_path = new_index.get(key)
+                        if old_path != new_path:
+                            event = 'added' if old_path is None else 'removed' if new_path is None else 'changed'
+                            changes.append((event, kind, get_module_kind_name(new_path or old_path), new_path or old_path))
+                self._indexes = indexes
+                self.collisions = collisions
+                # Modules by the file on disk, which is the archive for archived modules
+                self._files = {}
+                for kind, index in indexes.items():
+                    for key, module_path in index.items():
+                        self._files.setdefault(split_archive_path(module_path)[0] or module_path, []).append((kind, key))
+
+            reported = {change[3] for change in changes}
+            for path in paths:
+                for kind, key in self._files.get(path, []):
+                    module_path = self._indexes[kind][key]
+                    if module_path not in reported:
+                        reported.add(module_path)
+                        changes.append(('changed', kind, get_module_kind_name(module_path), module_path))
+
+            # A module copied over an existing file doesn't change the folder's modification time
+            for kind, key in list(self._modules):
+                module = self._modules[kind, key]
+                module_path = self._indexes.get(kind, {}).get(key)
+                if module_path == module.path:
+                    try:
+                        if get_module_fingerprint(module_path) == self._fingerprints.get((kind, key)):
+                            continue
+                    except OSError:
+                        pass
+                    if module_path not in reported:
+                        changes.append(('changed', kind, module.name, module_path))
+                self._modules.pop((kind, key)).close()
+                self._fingerprints.pop((kind, key), None)
+            return changes
+
+    def names(self, kind='bible'):
+        return sorted(get_module_kind_name(module_path) for module_path in self._indexes.get(kind, {}).values())
+
+    def module_paths(self, kind=None):
+        """Return the paths to the modules of one type, or of all types, sorted by name."""
+        kinds = [kind] if kind else sorted(self._indexes)
+        return [self._indexes[kind][key] for kind in kinds for key in sorted(self._indexes.get(kind, {}))]
+
+    def find(self, name, kind='bible'):
+        """Return the path to the module file, or None if there is no such module."""
+        return self._indexes.get(kind, {}).get(name.lower())
+
+    def get(self, name, kind='bible'):
+        """Return a cached handle for the module, or raise KeyError if there is no such module."""
+        key = name.lower()
+        with self._lock:
+            if (kind, key) not in self._modules:
+                module_path = self.find(name, kind)
+                if module_path is None and self.refresh():
+                    module_path = self.find(name, kind)
+                if module_path is None:
+                    raise KeyError(name)
+                self._fingerprints[kind, key] = get_module_fingerprint(module_path)
+                self._modules[kind, key] = MODULE_CLASSES[kind](module_path)
+            module = self._modules[kind, key]
+            if kind == 'bible':
+                access = self._accesses.setdefault((kind, key), [0, 0.0])
+                access[0] += 1
+                access[1] = time.monotonic()
+                if self.memory_budget and not module.memory_size and (kind, key) not in self._preloading:
+                    self._preloading.add((kind, key))
+                    if self._preloader is None:
+                        self._preloader = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='preload')
+                    self._preloader.submit(self._preload, kind, key, module)
+            return module
+
+    def memory_used(self):
+        """Bytes taken by the modules loaded into memory."""
+        with self._lock:
+            return sum(module.memory_size for module in self._modules.values() if isinstance(module, BibleModule))
+
+    def _make_room(self, size, keep):
+        """Drop the modules used least from memory until size more bytes fit in the budget.
+
+        Returns False, dropping nothing, if that would take a module used as often as keep or more,
+        so that modules used about as often don't push each other out in turns."""
+        with self._lock:
+            resident = sorted((self._accesses.get(module_key, [0, 0.0]), module_key) for module_key, module in self._modules.items()
+                              if module_key != keep and isinstance(module, BibleModule) and module.memory_size)
+            excess = self.memory_used() + size - self.memory_budget
+            victims = []
+            for access, module_key in resident:
+                if excess <= 0:
+                    break
+                if access[0] >= self._accesses.get(keep, [0, 0.0])[0]:
+                    return False
+                victims.append(self._modules[module_key])
+                excess -= self._modules[module_key].memory_size
+            if excess > 0:
+                return False
+        for victim in victims:
+            victim.unload_from_memory()
+            self._count_event('evictions')
+        return True
+
+    def _count_event(self, event):
+        # stats() reads the counters from server threads
+        with self._lock:
+            self.memory_events[event] += 1
+
+    def _preload(self, kind, key, module):
+        """Load a module into memory if it fits in the budget; runs in the preloading thread."""
+        try:
+            # The in-memory copy takes about as much as the file
+            size = os.path.getsize(get_module_file(module.path))
+            with self._lock:
+                current = self._modules.get((kind, key)) is module
+            if size <= self.memory_budget and current and self._make_room(size, (kind, key)):
+                module.load_into_memory()
+                self._count_event('loads')
+                with self._lock:
+                    replaced = self._modules.get((kind, key)) is not module
+                if replaced:
+                    # The module changed on disk while it was loading
+                    module.unload_from_memory()
+                elif self.memory_used() > self.memory_budget and not self._make_room(0, (kind, key)):
+                    module.unload_from_memory()
+                    self._count_event('evictions')
+            else:
+                self._count_event('skipped')
+        except (sqlite3.Error, OSError):
+            self._count_event('skipped')
+        finally:
+            with self._lock:
+                self._preloading.discard((kind, key))
+
+    def stats(self):
+        """Return the memory budget, the bytes in use, counts of loads, evictions and skipped loads, and per-module use."""
+        with self._lock:
+            modules = []
+            for (kind, key), (count, _) in sorted(self._accesses.items(), key=lambda item: -item[1][0]):
+                module = self._modules.get((kind, key))
+                modules.append({
+                    'name': module.name if module else key,
+                    'accesses': count,
+                    'in_memory': bool(module and module.memory_size),
+                    'memory_size': module.memory_size if module else 0,
+                })
+            return {'memory_budget': self.memory_budget, 'memory_used': self.memory_used(), **self.memory_events, 'modules': modules}
+
+    def alias_index(self):
+        """Return book names of all Bible modules and mapping files merged by load_alias_index().
+
+        The index is kept in memory while no module or mapping file changes."""
+        module_paths = [self.find(name) for name in self.names()]
+        fingerprint = get_alias_index_fingerprint(module_paths, list_mapping_files())
+        with self._lock:
+            if self._alias_index is None or self._alias_index[0] != fingerprint:
+                self._alias_index = (fingerprint, load_alias_index(module_paths, fingerprint))
+            return self._alias_index[1]
+
+    def close(self):
+        if self._preloader is not None:
+            self._preloader.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            modules, self._modules = self._modules, {}
+        for module in modules.values():
+            module.close()
+
+# Handles created by ModuleRegistry.get() for each type of module
+MODULE_CLASSES = {
+    'bible': BibleModule,
+    'crossreferences': CrossReferencesModule,
+    'subheadings': SubheadingsModule,
+    'dictionary': DictionaryModule,
+    'plan': PlanModule,
+}
+
+def get_module_cache_files(module_path):
+    """Return {cache name: path} of the files cached for a module of any type."""
+    name = get_module_name(module_path)
+    kind = get_module_kind(os.path.basename(module_path))
+    cache_files = {'encoding': get_encoding_file_path(module_path)}
+    if kind == 'bible':
+        cache_files['versification'] = get_allverses_file_path(name)
+        cache_files['book names'] = get_abbrs_file_path(name)
+        cache_files['verse hashes'] = get_hashes_file_path(name)
+        cache_files['schema'] = get_schema_file_path(name)
+        cache_files['verses index'] = get_verses_index_path(module_path)
+    elif kind == 'crossreferences':
+        cache_files['index'] = get_crossreferences_index_path(module_path)
+    elif kind == 'plan':
+        cache_files['days'] = get_plan_index_path(name)
+    return cache_files
+
+def warm_module_cache(module_path):
+    """Build the missing or stale cache files of a module, as the first lookups would.
+
+    Up-to-date files are left alone. Returns (module_path, names of the caches built,
+    {'language': ..., 'description': ...}, seconds taken)."""
+    start = time.perf_counter()
+
+    def modified(file_path):
+        try:
+            return os.stat(file_path).st_mtime_ns
+        except OSError:
+            return None
+
+    cache_files = get_module_cache_files(module_path)
+    before = {name: modified(file_path) for name, file_path in cache_files.items()}
+    kind = get_module_kind(os.path.basename(module_path))
+    module = MODULE_CLASSES[kind](module_path) if kind in ('bible', 'crossreferences', 'plan') else None
+    try:
+        if kind == 'bible':
+            module.verses_count
+            module.book_names
+            module.verse_hashes
+            # Opening a connection builds the indexed copy of the verses if the module needs one
+            module.release_connection(module.acquire_connection())
+        elif kind == 'crossreferences':
+            module.connection()
+        elif kind == 'plan':
+            module.days
+        # Reading the info also detects the encoding of modules without other caches
+        info = {field_name: get_info(module_path, field_name) for field_name in ('language', 'description')}
+    finally:
+        if module is not None:
+            module.close()
+    built = [name for name, file_path in cache_files.items() if modified(file_path) != before[name]]
+    return module_path, built, info, time.perf_counter() - start
+
+def warm_module_caches(module_paths, workers=None):
+    """Run warm_module_cache() for the modules in a process pool and yield its results as modules finish.
+
+    A module that fails yields (module_path, None, exception, 0.0). File locks keep
+    workers from building a shared file, such as an extracted archive, twice. A single
+    module (or workers=1) is processed in this process, without starting a pool."""
+    module_paths = list(module_paths)
+    if len(module_paths) <= 1 or workers == 1:
+        for module_path in module_paths:
+            try:
+                yield warm_module_cache(module_path)
+            except Exception as e:
+                yield module_path, None, e, 0.0
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(warm_module_cache, module_path): module_path for module_path in module_paths}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield futures[future], None, e, 0.0
+
+# Seconds between checks of the modules folders by ModuleWatcher
+WATCH_INTERVAL = 2.0
+
+class ModuleWatcher:
+    """Keep a ModuleRegistry current from a background thread.
+
+    The registry is refreshed every interval seconds; with the optional
+    inotify_simple package it is refreshed as soon as a modules folder reports a
+    change instead. on_change(changes) is called from the watcher thread with the
+    non-empty lists returned by ModuleRegistry.refresh()."""
+
+    def __init__(self, registry, interval=WATCH_INTERVAL, on_change=None, use_inotify=True):
+        self.registry = registry
+        self.interval = interval
+        self.on_change = on_change
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify = None
+        if use_inotify and inotify_simple is not None:
+            flags = inotify_simple.flags
+            mask = flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO | flags.CLOSE_WRITE
+            self._folders = {}
+            try:
+                self._inotify = inotify_simple.INotify()
+                for folder in registry.paths:
+                    self._folders[self._inotify.add_watch(folder, mask)] = folder
+            except OSError:
+                # Too many watches or a missing folder: polling still works
+                if self._inotify is not None:
+                    self._inotify.close()
+                self._inotify = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='mybible-module-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _wait(self):
+        """Wait for the next check and return the paths of files reported as written."""
+        if self._inotify is not None:
+            events = self._inotify.read(timeout=int(self.interval * 1000))
+            return {os.path.join(self._folders[event.wd], event.name) for event in events
+                    if event.mask & inotify_simple.flags.CLOSE_WRITE and event.wd in self._folders}
+        self._stop.wait(self.interval)
+        return set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            paths = self._wait()
+            if self._stop.is_set():
+                break
+            changes = self.registry.refresh(paths)
+            if changes and self.on_change is not None:
+                self.on_change(changes)
+
+# Letters with the combining marks of Latin, Greek, Cyrillic, Hebrew and Arabic scripts; apostrophes join parts of a word
+WORD_PATTERN = re.compile(r"(?:[^\W\d_]|[\u0300-\u036f\u0483-\u0489\u0591-\u05c7\u064b-\u065f])+"
+                          r"(?:['\u2019\u02bc](?:[^\W\d_]|[\u0300-\u036f\u0483-\u0489\u0591-\u05c7\u064b-\u065f])+)*")
+
+# Characters of context on each side of a word in keyword-in-context lines
+KWIC_WIDTH = 40
+
+# Smaller requests are counted in the calling process: starting a process pool costs more than reading them
+CONCORDANCE_POOL_MIN_VERSES = 5000
+
+def iter_words(text):
+    """Yield (start, end, word) for the words of the text; word is in lower case, with one kind of apostrophe."""
+    for match in WORD_PATTERN.finditer(text):
+        yield match.start(), match.end(), match.group().lower().replace('\u2019', "'").replace('\u02bc', "'")
+
+def normalize_keyword(keyword):
+    """Return the keyword as iter_words() yields it, or None if it isn't exactly one word (e.g. 'word1' or 'two words')."""
+    keyword = unicodedata.normalize('NFC', keyword.strip())
+    words = list(iter_words(keyword))
+    if len(words) != 1 or words[0][:2] != (0, len(keyword)):
+        return None
+    return words[0][2]
+
+def get_top_words(counts, top=None):
+    """Return [[word, count], ...] sorted by count and then by word, cut to the top words if top is given."""
+    key = lambda item: (-item[1], item[0])
+    items = heapq.nsmallest(top, counts.items(), key=key) if top else sorted(counts.items(), key=key)
+    return [list(item) for item in items]
+
+def split_ranges_by_book(ranges, verses_count):
+    """Split ranges at book boundaries and group them by book: [(book_number, [ranges]), ...] in Bible order."""
+    books = {}
+    book_numbers = sorted(int(book_number) for book_number in verses_count)
+    for range_ in ranges:
+        start, end = range_['start'], range_['end']
+        for book_number in book_numbers:
+            if not start['book'] <= book_number <= end['book']:
+                continue
+            last_chapter = get_last_chapter(book_number, verses_count)
+            books.setdefault(book_number, []).append({
+                'start': start if book_number == start['book'] else {'book': book_number, 'chapter': 1, 'verse': 1},
+                'end': end if book_number == end['book'] else
+                    {'book': book_number, 'chapter': last_chapter, 'verse': get_last_verse(book_number, last_chapter, verses_count)},
+            })
+    return sorted(books.items())
+
+def count_words(module_path, ranges, by='word', top=None):
+    """Count the words of the zap_full() text of the ranges, reading the verses as a stream.
+
+    Returns groups [book_number, chapter, number of words, [[word, count], ...]]: one
+    group for all the text with by='word', one per book or per chapter with 'book' or
+    'chapter' (book_number and chapter are None where they don't apply). Ranges
+    should be merged and sorted, so that each group comes in one piece; a group is
+    cut down to its top words as soon as it ends, so only one group is counted in
+    full at a time."""
+    groups = []
+    counts = collections.Counter()
+    total = 0
+    group = None
+    conn = connect_verses(module_path)
+    try:
+        for book_number, chapter, _, text in fetch_verses(conn, ranges):
+            verse_group = (None if by == 'word' else book_number, chapter if by == 'chapter' else None)
+            if verse_group != group:
+                if group is not None:
+                    groups.append([*group, total, get_top_words(counts, top)])
+                group, counts, total = verse_group, collections.Counter(), 0
+            words = [word for _, _, word in iter_words(unicodedata.normalize('NFC', zap_full(text or '')))]
+            counts.update(words)
+            total += len(words)
+    finally:
+        conn.close()
+    if group is not None:
+        groups.append([*group, total, get_top_words(counts, top)])
+    return groups
+
+def find_keywords(module_path, ranges, words, width=KWIC_WIDTH):
+    """Return [book_number, chapter, verse, left context, word as written, right context] for each occurrence of the words.
+
+    Words are matched case-insensitively as whole words of the zap_full() text; the
+    context doesn't reach into the neighbouring verses. A word that normalize_keyword()
+    doesn't accept raises ValueError."""
+    invalid_words = [word for word in words if normalize_keyword(word) is None]
+    if invalid_words:
+        raise ValueError(f"Not single words: {', '.join(invalid_words)}")
+    words = {normalize_keyword(word) for word in words}
+    lines = []
+    conn = connect_verses(module_path)
+    try:
+        for book_number, chapter, verse, text in fetch_verses(conn, ranges):
+            text = unicodedata.normalize('NFC', zap_full(text or ''))
+            for start, end, word in iter_words(text):
+                if word in words:
+                    lines.append([book_number, chapter, verse, text[max(0, start - width):start], text[start:end], text[end:end + width]])
+    finally:
+        conn.close()
+    return lines
+
+def concordance(module_path, ranges, verses_count, by='word', top=None, keywords=None, workers=None):
+    """Count words (or find keywords in context) in the ranges with one task per book in a process pool.
+
+    Yields the groups of count_words() in Bible order, or with keywords the lines of
+    find_keywords(). Results are yielded as soon as the books before them are done.
+    With by='word', books are counted in full and their counts are merged into the
+    one group yielded at the end. A single book, or fewer than
+    CONCORDANCE_POOL_MIN_VERSES verses, is read in this process without a pool."""
+    books = split_ranges_by_book(ranges, verses_count)
+    if len(books) <= 1 or workers == 1 or sum(calculate_verses_in_range(ranges, verses_count)) < CONCORDANCE_POOL_MIN_VERSES:
+        if keywords:
+            yield from find_keywords(module_path, ranges, keywords)
+        else:
+            yield from count_words(module_path, ranges, by, top)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        if keywords:
+            for lines in executor.map(find_keywords, itertools.repeat(module_path), [book_ranges for _, book_ranges in books],
+                                      itertools.repeat(keywords)):
+                yield from lines
+            return
+        results = executor.map(count_words, itertools.repeat(module_path), [book_ranges for _, book_ranges in books],
+                               itertools.repeat(by), itertools.repeat(None if by == 'word' else top))
+        if by != 'word':
+            for groups in results:
+                yield from groups
+            return
+        counts = collections.Counter()
+        total = 0
+        for groups in results:
+            for _, _, group_total, words in groups:
+                counts.update(dict(words))
+                total += group_total
+        yield [None, None, total, get_top_words(counts, top)]
+
+# Text variants of a verse in JSON output: the same text as %t, %T and %z in format strings
+TEXT_VARIANTS = {
+    'text': zap_text,
+    'raw': lambda raw_text: raw_text,
+    'zapped': zap_full,
+}
+
+def verse_record(module, row, variants=('text', 'raw')):
+    """Describe a verse row as a dict for JSON output; rows with headings get a 'headings' list."""
+    book_number, chapter, verse, raw_text = row[:4]
+    names = module.book_names.get(str(book_number), [str(book_number), str(book_number)])
+    record = {
+        'module': module.name,
+        'book_number': book_number,
+        'full_name': names[0],
+        'short_name': names[1],
+        'chapter': chapter,
+        'verse': verse,
+    }
+    if len(row) > 4:
+        record['headings'] = row[4]
+    for variant in variants:
+        record[variant] = TEXT_VARIANTS[variant](raw_text)
+    return record
+
+def iter_json_document(metadata, records, list_name='verses'):
+    """Yield a JSON object with the metadata and the records in its 'verses' (or list_name) list, piece by piece.
+
+    Records are serialized one at a time as they come, so a long passage is never
+    held in memory as a whole."""
+    head = json.dumps(metadata, ensure_ascii=False)
+    yield head[:-1] + (', ' if metadata else '') + f'{json.dumps(list_name)}: ['
+    for i, record in enumerate(records):
+        yield (',\n' if i else '\n') + json.dumps(record, ensure_ascii=False)
+    yield '\n]}\n'
+
+def iter_json_lines(metadata, records, record_type='verse'):
+    """Yield JSON Lines: one line with the metadata followed by one line per record."""
+    yield json.dumps({'type': 'request', **metadata}, ensure_ascii=False) + '\n'
+    for record in records:
+        yield json.dumps({'type': record_type, **record}, ensure_ascii=False) + '\n'
+
+class BibleRequestHandler(BaseHTTPRequestHandler):
+    """Serve /modules, /resolve and /verses from the registry of the server, and /stats on its memory use.
+
+    Responses carry ETags derived from module fingerprints, so clients can
+    revalidate with If-None-Match and get an empty 304 while nothing changed."""
+    protocol_version = 'HTTP/1.1'
+    server_version = 'mybible-cli'
+    # Headers and body are written separately; without this keep-alive clients wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        routes = {
+            '/modules': self.get_modules,
+            '/resolve': self.get_resolve,
+            '/verses': self.get_verses,
+            '/stats': self.get_stats,
+        }
+        route = routes.get(url.path.rstrip('/'))
+        if route is None:
+            self.send_json(404, {'error': f'Unknown path: {url.path}'})
+            return
+        try:
+            route(params)
+        except InvalidReferenceError as e:
+            self.send_json(400, {'error': f'Invalid reference for this module: {e}'})
+        except InvalidCursorError as e:
+            self.send_json(400, {'error': f'Invalid cursor: {e}'})
+        except UnknownMappingError as e:
+            self.send_json(404, {'error': f'No mapping file named {e}_mapping.json'})
+        except KeyError as e:
+            self.send_json(404, {'error': f'No module named {e}'})
+        except ValueError as e:
+            self.send_json(400, {'error': f'Invalid request: {e}'})
+        except ConnectionError:
+            # The client went away; there is no one to answer
+            pass
+        except Exception as e:
+            # Anything unexpected still gets an answer instead of a dropped connection
+            self.send_json(500, {'error': f'Internal error: {type(e).__name__}'})
+
+    def make_etag(self, *parts):
+        return '"' + hashlib.sha1('|'.join(map(str, parts)).encode('utf-8')).hexdigest()[:20] + '"'
+
+    def is_not_modified(self, etag):
+        """Answer with 304 if the client already has the current response."""
+        if_none_match = self.headers.get('If-None-Match')
+        if not if_none_match:
+            return False
+        if if_none_match.strip() != '*' and etag not in [tag.strip() for tag in if_none_match.split(',')]:
+            return False
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.end_headers()
+        return True
+
+    def send_body(self, status, body, content_type, etag=None, headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status, payload, etag=None, headers=None):
+        self.send_body(status, json.dumps(payload, ensure_ascii=False), 'application/json; charset=utf-8', etag, headers)
+
+    def get_module(self, params):
+        return self.server.registry.get(params.get('m') or self.server.default_module or '')
+
+    def get_mapping(self, module, params):
+        if params.get('self_abbr'):
+            return module.abbrs_mapping
+        if params.get('all_abbr'):
+            return self.server.registry.alias_index()
+        if params.get('abbr'):
+            # Only the mapping files of the configuration folder can be named, not arbitrary paths
+            mapping_file = find_mapping_file(params['abbr'])
+            if mapping_file is None:
+                raise UnknownMappingError(params['abbr'])
+            return load_mapping(mapping_file)
+        return None
+
+    def mapping_fingerprint(self, params):
+        """Fingerprint the files that get_mapping() reads besides the module, so that editing them changes the ETags."""
+        if params.get('self_abbr'):
+            return ''
+        if params.get('all_abbr'):
+            registry = self.server.registry
+            return json.dumps(get_alias_index_fingerprint([registry.find(name) for name in registry.names()], list_mapping_files()))
+        if params.get('abbr'):
+            mapping_file = find_mapping_file(params['abbr'])
+            return get_module_fingerprint(mapping_file) if mapping_file else ''
+        return get_module_fingerprint(BOOKMAPPING_FILE) if os.path.exists(BOOKMAPPING_FILE) else ''
+
+    def get_subheadings(self, module):
+        registry = self.server.registry
+        return registry.get(module.name, 'subheadings') if registry.find(module.name, 'subheadings') else None
+
+    def resolve(self, module, reference, params):
+        ranges = module.resolve(reference, self.get_mapping(module, params), bool(params.get('fuzzy')))
+        if params.get('merge'):
+            ranges = module.normalize(ranges, 'request' if params['merge'] == 'request' else 'canonical')
+        return ranges
+
+    def get_stats(self, params):
+        self.send_json(200, self.server.registry.stats())
+
+    def get_modules(self, params):
+        registry = self.server.registry
+        registry.refresh()
+        # Listing the modules doesn't count as using them, so it doesn't load them into memory
+        module_paths = [registry.find(name) for name in registry.names()]
+        etag = self.make_etag(*(f'{get_module_name(module_path)}:{get_module_fingerprint(module_path)}' for module_path in module_paths))
+        if self.is_not_modified(etag):
+            return
+        self.send_json(200, [{
+            'name': get_module_name(module_path),
+            'language': get_info(module_path, 'language'),
+            'description': get_info(module_path, 'description'),
+        } for module_path in module_paths], etag)
+
+    def get_resolve(self, params):
+        module = self.get_module(params)
+        reference = params.get('ref', '')
+        etag = self.make_etag(module.fingerprint, self.mapping_fingerprint(params), 'resolve', reference, params.get('abbr', ''), params.get('self_abbr', ''), params.get('all_abbr', ''), params.get('fuzzy', ''), params.get('merge', ''))
+        if self.is_not_modified(etag):
+            return
+        ranges = self.resolve(module, reference, params)
+        self.send_json(200, {'module': module.name, 'reference': reference, 'ranges': ranges}, etag)
+
+    def get_verses(self, params):
+        module = self.get_module(params)
+        reference = params.get('ref', '')
+        output = params.get('format', 'text')
+        format_string = params.get('f') or self.server.format_string
+        # Headings of the companion subheadings module are part of JSON output and of %h
+        subheadings = self.get_subheadings(module) if output == 'json' or '%h' in format_string else None
+        etag = self.make_etag(module.fingerprint, self.mapping_fingerprint(params), get_module_fingerprint(subheadings.path) if subheadings else '', 'verses', reference, params.get('abbr', ''), params.get('self_abbr', ''), params.get('all_abbr', ''), params.get('fuzzy', ''), output, format_string, params.get('variants', ''),
+                              params.get('limit', ''), params.get('offset', ''), params.get('cursor', ''), params.get('merge', ''))
+        if self.is_not_modified(etag):
+            return
+        ranges = self.resolve(module, reference, params)
+        headers = {}
+        if params.get('limit') or params.get('offset') or params.get('cursor'):
+            try:
+                limit = int(params['limit']) if params.get('limit') else None
+                offset = int(params.get('offset') or 0)
+                if offset < 0 or (limit is not None and limit < 1):
+                    raise ValueError
+            except ValueError:
+                self.send_json(400, {'error': 'limit must be a positive number and offset a non-negative one'})
+                return
+            # Without a limit the page is the rest of the reference; a reference without verses still gets a (empty) page
+            verses, total, next_cursor = module.page(ranges, limit if limit is not None else max(sum(module.count_verses(ranges)), 1), offset, params.get('cursor'))
+            headers['X-Total-Count'] = str(total)
+            if next_cursor:
+                headers['X-Next-Cursor'] = next_cursor
+        else:
+            verses = module.iter_verses(ranges)
+        if output == 'json' or '%h' in format_string:
+            verses = module.with_headings(verses, ranges, subheadings)
+        if output == 'json':
+            variants = [variant for variant in params.get('variants', 'text,raw').split(',') if variant in TEXT_VARIANTS]
+            self.send_json(200, [verse_record(module, row, variants) for row in verses], etag, headers)
+        else:
+            lines = module.render(verses, format_string, noansi=True)
+            self.send_body(200, ''.join(f'{line}\n' for line in lines), 'text/plain; charset=utf-8', etag, headers)
+
+def make_http_server(registry, host, port, default_module=None, format_string=DEFAULT_FORMAT_STRING):
+    """Create a threaded HTTP server answering lookups from the registry; call serve_forever() on it."""
+    server = ThreadingHTTPServer((host, port), BibleRequestHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    server.default_module = default_module
+    server.format_string = format_string
+    return server
@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKERS = 24
+
+
+def create_module(path):
+    """Create a Bible module with Genesis, Exodus and John, 50 chapters of 30 verses each."""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE info(name text, value text);
+        CREATE TABLE books(book_color text, book_number numeric, short_name text, long_name text);
+        CREATE TABLE verses(book_number numeric, chapter numeric, verse numeric, text text);
+        CREATE UNIQUE INDEX verses_index on verses(book_number, chapter, verse);
+        INSERT INTO info VALUES ('description', 'Test module');
+        INSERT INTO books VALUES ('#ffffff', 10, 'Gen', 'Genesis'), ('#ffffff', 20, 'Ex', 'Exodus'), ('#ffffff', 500, 'Jn', 'John');
+    """)
+    conn.executemany("INSERT INTO verses VALUES (?, ?, ?, ?)",
+                     [(book, chapter, verse, f"Text of {book} {chapter}:{verse}")
+                      for book in (10, 20, 500) for chapter in range(1, 51) for verse in range(1, 31)])
+    conn.commit()
+    conn.close()
+
+
+def cold_lookup(home, module_path, builds_path, barrier, results):
+    """Look a reference up in a fresh process, recording every cache build in builds_path."""
+    # The config folder comes from HOME, which has to be set before mybible is imported
+    os.environ['HOME'] = home
+    sys.path.insert(0, ROOT)
+    import mybible
+
+    def recorded(name, build):
+        def record_build(*args):
+            with open(builds_path, 'a', encoding='utf-8') as file:
+                file.write(f"{name}\n")
+            return build(*args)
+        return record_build
+
+    mybible.extract_verses_to_json = recorded('verses', mybible.extract_verses_to_json)
+    mybible.extract_abbrs_to_json = recorded('abbrs', mybible.extract_abbrs_to_json)
+    barrier.wait()
+    try:
+        with mybible.BibleModule(module_path) as module:
+            ranges = module.resolve('Jn 3:16-18')
+            results.put(list(module.render(module.iter_verses(ranges), '%f %c:%v %t')))
+    except Exception as e:
+        results.put(repr(e))
+
+
+class ColdLookupTest(unittest.TestCase):
+    def test_concurrent_cold_lookups_build_once(self):
+        home = tempfile.mkdtemp()
+        modules_folder = tempfile.mkdtemp()
+        module_path = os.path.join(modules_folder, 'COLD.SQLite3')
+        create_module(module_path)
+        builds_path = os.path.join(tempfile.mkdtemp(), 'builds.txt')
+        context = multiprocessing.get_context('spawn')
+        barrier = context.Barrier(WORKERS)
+        results = context.Queue()
+        processes = [context.Process(target=cold_lookup, args=(home, module_path, builds_path, barrier, results))
+                     for _ in range(WORKERS)]
+        for process in processes:
+            process.start()
+        outputs = [results.get(timeout=120) for _ in processes]
+        for process in processes:
+            process.join(timeout=60)
+
+        expected = [f"John 3:{verse} Text of 500 3:{verse}" for verse in (16, 17, 18)]
+        self.assertEqual(outputs, [expected] * WORKERS)
+        with open(builds_path, encoding='utf-8') as file:
+            builds = sorted(file.read().split())
+        self.assertEqual(builds, ['abbrs', 'verses'])
+        # Caches are renamed into place when complete, so no partial file is left behind
+        leftovers = [name for _, _, names in os.walk(home) for name in names if name.endswith('.part')]
+        self.assertEqual(leftovers, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+# Module data is cached in the config folder under HOME, so it has to point to a scratch folder before the import
+home = tempfile.mkdtemp()
+os.environ['HOME'] = home
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mybible import CrossReferencesModule  # noqa: E402
+
+
+def create_module(path, indexed, votes):
+    """Create a cross-references module: Jn 3:16-18 -> Rom 5:8 and Jn 3:20 -> 1Jn 4:9-10."""
+    conn = sqlite3.connect(path)
+    conn.execute(f"""
+        CREATE TABLE cross_references(book numeric, chapter numeric, verse numeric, verse_end numeric,
+            book_to numeric, chapter_to numeric, verse_to_start numeric, verse_to_end numeric{', votes numeric' if votes else ''})
+    """)
+    if indexed:
+        conn.execute("CREATE INDEX cross_references_index ON cross_references(book, chapter, verse)")
+    rows = [(500, 3, 16, 18, 520, 5, 8, None, 7), (500, 3, 20, None, 690, 4, 9, 10, 3)]
+    conn.executemany(f"INSERT INTO cross_references VALUES (?, ?, ?, ?, ?, ?, ?, ?{', ?' if votes else ''})",
+                     [row if votes else row[:-1] for row in rows])
+    conn.commit()
+    conn.close()
+
+
+def verse(number):
+    return {'start': {'book': 500, 'chapter': 3, 'verse': number}, 'end': {'book': 500, 'chapter': 3, 'verse': number}}
+
+
+class LookupTest(unittest.TestCase):
+    def lookup(self, ranges, indexed=True, votes=True):
+        folder = tempfile.mkdtemp(dir=home)
+        path = os.path.join(folder, f"X{int(indexed)}{int(votes)}.crossreferences.SQLite3")
+        create_module(path, indexed, votes)
+        with CrossReferencesModule(path) as module:
+            return [(item['source']['verse'], item['target']['start']['book']) for item in module.lookup(ranges)]
+
+    def test_source_span_covers_every_verse(self):
+        for indexed in (True, False):
+            with self.subTest(indexed=indexed):
+                self.assertEqual(self.lookup([verse(16)], indexed), [(16, 520)])
+                self.assertEqual(self.lookup([verse(17)], indexed), [(16, 520)])
+                self.assertEqual(self.lookup([verse(18)], indexed), [(16, 520)])
+                self.assertEqual(self.lookup([verse(19)], indexed), [])
+
+    def test_source_without_end_is_one_verse(self):
+        self.assertEqual(self.lookup([verse(20)]), [(20, 690)])
+        self.assertEqual(self.lookup([verse(21)]), [])
+
+    def test_range_finds_spans_and_verses_once(self):
+        ranges = [{'start': {'book': 500, 'chapter': 3, 'verse': 17}, 'end': {'book': 500, 'chapter': 3, 'verse': 20}}]
+        self.assertEqual(self.lookup(ranges), [(16, 520), (20, 690)])
+
+    def test_indexed_module_without_votes(self):
+        folder = tempfile.mkdtemp(dir=home)
+        path = os.path.join(folder, 'NOVOTES.crossreferences.SQLite3')
+        create_module(path, indexed=True, votes=False)
+        with CrossReferencesModule(path) as module:
+            self.assertEqual([item['votes'] for item in module.lookup([verse(17)])], [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
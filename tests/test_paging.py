@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+# Module data is cached in the config folder under HOME, so it has to point to a scratch folder before the import
+home = tempfile.mkdtemp()
+os.environ['HOME'] = home
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mybible import BibleModule  # noqa: E402
+
+
+def create_module(path):
+    """Create a small Bible module: John 1 with 5 verses."""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE info(name text, value text);
+        CREATE TABLE books(book_color text, book_number numeric, short_name text, long_name text);
+        CREATE TABLE verses(book_number numeric, chapter numeric, verse numeric, text text);
+        CREATE UNIQUE INDEX verses_index on verses(book_number, chapter, verse);
+        INSERT INTO info VALUES ('description', 'Test module');
+        INSERT INTO books VALUES ('#ffffff', 500, 'Jn', 'John');
+    """)
+    conn.executemany("INSERT INTO verses VALUES (500, 1, ?, ?)", [(verse, f"Verse {verse}") for verse in range(1, 6)])
+    conn.commit()
+    conn.close()
+
+
+class PageTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(dir=home)
+        path = os.path.join(self.folder, 'TEST.SQLite3')
+        create_module(path)
+        self.module = BibleModule(path)
+        self.ranges = [{'start': {'book': 500, 'chapter': 1, 'verse': 1}, 'end': {'book': 500, 'chapter': 1, 'verse': 5}}]
+
+    def tearDown(self):
+        self.module.close()
+
+    def test_limit_zero_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.module.page(self.ranges, 0)
+
+    def test_limit_one_pages_through_the_reference(self):
+        verses, total, cursor = self.module.page(self.ranges, 1)
+        self.assertEqual(total, 5)
+        self.assertEqual([verse for _, _, verse, _ in verses], [1])
+        seen = [1]
+        while cursor:
+            verses, total, cursor = self.module.page(self.ranges, 1, cursor=cursor)
+            self.assertEqual(len(verses), 1)
+            seen.append(verses[0][2])
+        self.assertEqual(seen, [1, 2, 3, 4, 5])
+
+    def test_limit_one_with_offset(self):
+        verses, _, cursor = self.module.page(self.ranges, 1, offset=4)
+        self.assertEqual([verse for _, _, verse, _ in verses], [5])
+        self.assertIsNone(cursor)
+
+    def test_reference_without_verses_gives_an_empty_page(self):
+        ranges = [{'start': {'book': 500, 'chapter': 99, 'verse': 1}, 'end': {'book': 500, 'chapter': 99, 'verse': 1}}]
+        self.assertEqual(self.module.page(ranges, max(sum(self.module.count_verses(ranges)), 1)), ([], 0, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,4 +7,4 @@ if not "%COMSPEC%"=="%SystemRoot%\system32\cmd.exe" (
 cd /d "%~dp0"
 for /f "usebackq tokens=*" %%a in (`powershell -command "Get-Clipboard"`) do set clipboard_content=%%a
 
-start /min cmd /c mybible-cli.exe -r "%clipboard_content%" --gui
\ No newline at end of file
+start /min cmd /c mybible-cli.exe -r "%clipboard_content%" --max-verses 1000 --gui
\ No newline at end of file
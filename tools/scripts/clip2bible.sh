@@ -18,4 +18,4 @@ else
     exit 1
 fi
 
-mybible-cli -r "$($clipcommand)" --gui
+mybible-cli -r "$($clipcommand)" --max-verses 1000 --gui